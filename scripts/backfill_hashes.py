@@ -6,10 +6,11 @@ from pathlib import Path
 
 import fire
 import httpx
-import imagehash
 from PIL import Image
 
-from similar_images.crappy_db import CrappyDB
+from similar_images.hashing import image_hashes
+from similar_images.types import Result
+from similar_images.utils import get_database
 
 
 async def download(client, url):
@@ -31,22 +32,22 @@ async def process_batch(batch, output_db):
         try:
             if contents := url2contents.get(record.url):
                 img = Image.open(io.BytesIO(contents))
-                hashes = {
-                    "a": str(imagehash.average_hash(img)),
-                    "p": str(imagehash.phash(img)),
-                    "d": str(imagehash.dhash(img)),
-                    "dv": str(imagehash.dhash_vertical(img)),
-                    "w": str(imagehash.whash(img)),
-                }
-                record.hashes = hashes
+                hashes = image_hashes(img)
+                record = Result(
+                    url=record.url,
+                    hashstr=record.hashstr,
+                    ts=record.ts,
+                    query=record.query,
+                    hashes=hashes,
+                )
         except Exception as e:
             pass
         output_db.put(record)
 
 
 def backfill(input_db_path: str, output_db_path: str, batch_size: int = 500):
-    input_db = CrappyDB(input_db_path)
-    output_db = CrappyDB(output_db_path)
+    input_db = get_database(input_db_path)
+    output_db = get_database(output_db_path)
     generator = input_db.scan()
     batch = []
     try:
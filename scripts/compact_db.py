@@ -0,0 +1,150 @@
+import hashlib
+import os
+import stat
+import tempfile
+import time
+from pathlib import Path
+
+import fire
+import numpy as np
+
+from similar_images.crappy_db import CrappyDB
+from similar_images.types import Result
+
+try:
+    import orjson as json
+except ImportError:
+    import json
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def _scan_lines(path: str):
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def _key(d: dict) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(d.get("url")).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(str(d.get("hashstr")).encode("utf-8"))
+    return digest.digest()
+
+
+def _plan(path: str) -> tuple[np.ndarray, np.ndarray]:
+    """First pass: for each line, whether it is the last one of its (url, hashstr),
+    and for these lines, the index of the last line of the same (url, hashstr) with
+    hashes, or -1.
+
+    Keeps 17 bytes per line in memory rather than the records themselves."""
+    keys = bytearray()
+    has_hashes = bytearray()
+    for line in _scan_lines(path):
+        d = json.loads(line)
+        keys += _key(d)
+        has_hashes.append(bool(d.get("hashes")))
+    n = len(has_hashes)
+    key_array = np.frombuffer(bytes(keys), dtype=np.dtype("V16"))
+    # Group lines by key, in file order within each group
+    order = np.argsort(key_array, kind="stable")
+    sorted_keys = key_array[order]
+    group_end = np.ones(n, dtype=bool)
+    group_end[:-1] = sorted_keys[1:] != sorted_keys[:-1]
+    group_start = np.ones(n, dtype=bool)
+    group_start[1:] = group_end[:-1]
+    # Last line with hashes so far within each group, carried forward
+    with_hashes = np.where(
+        np.frombuffer(bytes(has_hashes), dtype=bool)[order], order, -1
+    )
+    group_id = np.cumsum(group_start) - 1
+    latest_hashes = np.maximum.accumulate(with_hashes + (group_id * (n + 1)))
+    latest_hashes = latest_hashes - group_id * (n + 1)
+    latest_hashes[latest_hashes < 0] = -1
+    keep = np.zeros(n, dtype=bool)
+    keep[order[group_end]] = True
+    hashes_from = np.full(n, -1, dtype=np.int64)
+    hashes_from[order[group_end]] = latest_hashes[group_end]
+    return keep, hashes_from
+
+
+def compact(input_path: str, output_path: str) -> int:
+    """Write one record per (url, sha256) of `input_path` to `output_path`: the last
+    one, with the last non-empty hashes recorded for it. Records are written in the
+    order of their last occurrence, so lookups by URL and by hashstr return the same
+    records as before. Return the number of records written.
+
+    `input_path` is locked meanwhile, as by writers of a shared CrappyDB, and
+    `output_path` gets its permissions."""
+    with open(input_path, "rb") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        return _compact(input_path, output_path)
+
+
+def _compact(input_path: str, output_path: str) -> int:
+    keep, hashes_from = _plan(input_path)
+    # Hashes to carry over to a later line
+    wanted = set(hashes_from[keep & (hashes_from != np.arange(len(keep)))].tolist())
+    wanted.discard(-1)
+    saved_hashes: dict[int, dict[str, str]] = {}
+    n = 0
+    output_dir = Path(output_path).parent
+    with tempfile.NamedTemporaryFile(
+        "wt", dir=output_dir, prefix=".compact-", delete=False
+    ) as f:
+        try:
+            for i, line in enumerate(_scan_lines(input_path)):
+                if not keep[i] and i not in wanted:
+                    continue
+                d = json.loads(line)
+                if i in wanted:
+                    saved_hashes[i] = d["hashes"]
+                if keep[i]:
+                    j = int(hashes_from[i])
+                    if j >= 0 and j != i:
+                        d["hashes"] = saved_hashes.pop(j)
+                    f.write(f"{Result.model_validate(d).dump()}\n")
+                    n += 1
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    os.chmod(f.name, stat.S_IMODE(os.stat(input_path).st_mode))
+    os.replace(f.name, output_path)
+    return n
+
+
+def _load_seconds(path: str) -> float:
+    return CrappyDB(path).load_stats["seconds"]
+
+
+def compact_db(db_path: str, output_path: str | None = None) -> None:
+    """Compact a JSONL database: keep one record per URL and sha256, with the latest
+    hashes. The database is rewritten in place, unless `output_path` is given.
+
+    Processes sharing the database (`--db-shared`) wait for the compaction, then
+    load the compacted file."""
+    output_path = output_path or db_path
+    before_size = os.path.getsize(db_path)
+    before_lines = sum(1 for _ in _scan_lines(db_path))
+    before_seconds = _load_seconds(db_path)
+    start_time = time.perf_counter()
+    n = compact(db_path, output_path)
+    total_time = time.perf_counter() - start_time
+    after_size = os.path.getsize(output_path)
+    after_seconds = _load_seconds(output_path)
+    print(f"Compacted {db_path} to {output_path} in {total_time:.1f} s")
+    print(f"records: {before_lines} -> {n}")
+    print(f"size: {before_size / 2**20:.1f} MiB -> {after_size / 2**20:.1f} MiB")
+    print(f"load time: {before_seconds:.2f} s -> {after_seconds:.2f} s")
+
+
+if __name__ == "__main__":
+    fire.Fire(compact_db)
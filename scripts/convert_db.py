@@ -0,0 +1,27 @@
+import time
+
+import fire
+
+from similar_images.utils import get_database
+
+
+def convert_db(input_db_path: str, output_db_path: str) -> None:
+    """Copy all records of a database into another one, e.g. from JSONL to binary
+    (`.sidb`) or back. The storage is picked from the file extension."""
+    start_time = time.perf_counter()
+    input_db = get_database(input_db_path)
+    output_db = get_database(output_db_path)
+    n = 0
+    for record in input_db.scan():
+        output_db.put(record)
+        n += 1
+    output_db.close()
+    input_db.close()
+    total_time = time.perf_counter() - start_time
+    print(
+        f"Converted {n} records from {input_db_path} to {output_db_path} in {total_time:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    fire.Fire(convert_db)
@@ -0,0 +1,26 @@
+import time
+
+import fire
+
+from similar_images.crappy_db import CrappyDB
+
+
+def db_memory(db_path: str) -> None:
+    """Load a JSONL database and report the memory used by each part of its
+    in-memory store, in total and per million records."""
+    start_time = time.perf_counter()
+    db = CrappyDB(db_path)
+    total_time = time.perf_counter() - start_time
+    n = len(db)
+    print(f"Loaded {n} records from {db_path} in {total_time:.1f} s")
+    usage = db.memory_usage()
+    usage["total"] = sum(usage.values())
+    for name, size in usage.items():
+        per_million = size / n * 1_000_000 if n else 0.0
+        print(
+            f"{name:>15}: {size / 2**20:10.1f} MiB {per_million / 2**20:10.1f} MiB/M records"
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(db_memory)
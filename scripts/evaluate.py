@@ -9,7 +9,9 @@ from typing import Any
 import fire
 import httpx
 
+from similar_images.decision_cache import DecisionCache
 from similar_images.gemini import Decision, Gemini
+from similar_images.image_encoder import ImageEncoder
 from similar_images.utils import get_urls_or_files
 
 logger = logging.getLogger(__name__)
@@ -49,9 +51,12 @@ def evaluate_dataset(
         fn_dir = f"{outdir}/fn"
         Path(fp_dir).mkdir(parents=True, exist_ok=True)
         Path(fn_dir).mkdir(parents=True, exist_ok=True)
-    TP, FN, FP, TN = 0, 0, 0, 0
+    TP, FN, FP, TN, ERR = 0, 0, 0, 0, 0
     for decision in positive_decisions:
-        if decision.answer() in positive_answers:
+        if decision.failed():
+            ERR += 1
+            logger.info(f"Failed: {decision.image_path}")
+        elif decision.answer() in positive_answers:
             TP += 1
         else:
             FN += 1
@@ -59,7 +64,10 @@ def evaluate_dataset(
             if outdir:
                 shutil.copy2(decision.image_path, fn_dir)
     for decision in negative_decisions:
-        if decision.answer() in positive_answers:
+        if decision.failed():
+            ERR += 1
+            logger.info(f"Failed: {decision.image_path}")
+        elif decision.answer() in positive_answers:
             FP += 1
             logger.info(f"False positive: {decision}")
             if outdir:
@@ -76,6 +84,7 @@ def evaluate_dataset(
         "FN": FN,
         "P": TP + FN,
         "N": FP + TN,
+        "ERR": ERR,  # not in P or N
     }
     return d
 
@@ -96,11 +105,34 @@ async def evaluate(
     max_output_tokens: int = 10,
     concurrency: int = 1,
     outdir: str | None = None,
+    decision_cache: str | None = None,
+    rpm: float | None = None,
+    tpm: float | None = None,
+    max_edge: int | None = None,
+    image_format: str | None = None,
+    quality: int = 85,
 ):
+    """With `max_edge` or `image_format`, images are downscaled or re-encoded
+    before being sent (see `ImageEncoder`), to check how it changes the results."""
     logging.basicConfig(level=logging.DEBUG)
     client = httpx.AsyncClient(follow_redirects=False, timeout=30)
+    cache = DecisionCache(decision_cache) if decision_cache else None
+    encoder = None
+    if max_edge or image_format:
+        encoder = ImageEncoder(
+            max_edge=max_edge,
+            image_format=image_format or "JPEG",
+            quality=quality,
+            workers=concurrency,
+        )
     gemini = Gemini(
-        httpx_client=client, model=model, max_output_tokens=max_output_tokens
+        httpx_client=client,
+        model=model,
+        max_output_tokens=max_output_tokens,
+        decision_cache=cache,
+        rpm=rpm,
+        tpm=tpm,
+        image_encoder=encoder,
     )
     positive_files = get_urls_or_files(positive_paths.split(","))
     negative_files = get_urls_or_files(negative_paths.split(","))
@@ -118,6 +150,15 @@ async def evaluate(
     d["positive_paths"] = positive_paths
     d["negative_paths"] = negative_paths
     d["positive_answers"] = positive_answers
+    if encoder is not None:
+        d["image_encoder"] = encoder.settings()
+        d["bytes_in"] = encoder.bytes_in
+        d["bytes_out"] = encoder.bytes_out
+        encoder.close()
+    if cache is not None:
+        d["cache_hits"] = cache.hits
+        d["cache_misses"] = cache.misses
+        cache.close()
     print(json.dumps(d))
 
 
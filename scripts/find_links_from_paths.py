@@ -3,20 +3,19 @@ import os
 
 import fire
 
-from similar_images.crappy_db import CrappyDB
+from similar_images.database import Database
+from similar_images.utils import get_database
 
 
-def get_url(db: CrappyDB, path: str) -> str | None:
+def get_url(db: Database, path: str) -> str | None:
     _, file = os.path.split(path)
     name, _ = os.path.splitext(file)
-    for record in db.scan():
-        if record.hashstr.startswith(name):
-            return record.url
-    return None
+    record = db.get_by_hashstr_prefix(name)
+    return record.url if record is not None else None
 
 
 def find_links_from_paths(db_path: str, paths: str) -> None:
-    db = CrappyDB(db_path)
+    db = get_database(db_path)
     urls = []
     for path in paths.split(","):
         if os.path.isfile(path):
@@ -6,6 +6,9 @@ import fire
 import imagehash
 from PIL import Image
 
+from similar_images.hash_index import HASH_TYPES
+from similar_images.hashing import image_hashes
+
 
 def info(directory: str):
     kept = []
@@ -15,11 +18,10 @@ def info(directory: str):
             continue
         try:
             with Image.open(path) as im:
-                ahash = imagehash.average_hash(im)
-                phash = imagehash.phash(im)
-                dhash = imagehash.dhash(im)
-                dhashv = imagehash.dhash_vertical(im)
-                whash = imagehash.whash(im)
+                hashes = image_hashes(im)
+                ahash, phash, dhash, dhashv, whash = (
+                    imagehash.hex_to_hash(hashes[k]) for k in HASH_TYPES
+                )
                 chash = imagehash.colorhash(im)
                 crhash = imagehash.crop_resistant_hash(im)
                 print(
@@ -4,6 +4,7 @@ import os
 import fire
 import httpx
 
+from similar_images.decision_cache import DecisionCache
 from similar_images.gemini import Gemini
 
 logger = logging.getLogger(__name__)
@@ -15,11 +16,20 @@ async def run_gemini(
     outfile: str,
     model: str = "gemini-1.5-flash",
     max_output_tokens: int = 100,
+    decision_cache: str | None = None,
+    rpm: float | None = None,
+    tpm: float | None = None,
 ):
     logging.basicConfig(level=logging.DEBUG, force=True)
     client = httpx.AsyncClient(follow_redirects=False, timeout=30)
+    cache = DecisionCache(decision_cache) if decision_cache else None
     gemini = Gemini(
-        httpx_client=client, model=model, max_output_tokens=max_output_tokens
+        httpx_client=client,
+        model=model,
+        max_output_tokens=max_output_tokens,
+        decision_cache=cache,
+        rpm=rpm,
+        tpm=tpm,
     )
     files = []
     for file in image_paths.split(","):
@@ -36,6 +46,9 @@ async def run_gemini(
         decision = await gemini.chat(query, [file])
         with open(outfile, "at") as f:
             f.write(f"{decision.model_dump_json()}\n")
+    if cache is not None:
+        logger.info(f"Decision cache: hits={cache.hits} misses={cache.misses}")
+        cache.close()
 
 
 if __name__ == "__main__":
@@ -4,11 +4,13 @@ import logging
 import fire
 
 from similar_images.bing_selenium import BingSelenium
-from similar_images.crappy_db import CrappyDB
+from similar_images.download_cache import get_download_cache
 from similar_images.filters.utils import get_filters
 from similar_images.image_sources import get_image_sources
+from similar_images.reject_cache import get_reject_cache
 from similar_images.scraper import Scraper
 from similar_images.types import ScrapeConfiguration
+from similar_images.utils import get_database
 
 logger = logging.getLogger()
 
@@ -45,8 +47,16 @@ def scrape(configfile: str) -> None:
     for run in scrape_config.runs:
         run.resolve(scrape_config.common)
 
-        db = CrappyDB(run.database) if run.database else None
+        db = get_database(run.database, run.database_config) if run.database else None
+        download_cache = None
+        if run.download_cache:
+            download_cache = get_download_cache(
+                run.download_cache, run.download_cache_config
+            )
         filters = get_filters(run, db)
+        reject_cache = None
+        if run.reject_cache:
+            reject_cache = get_reject_cache(run.reject_cache, run.reject_cache_config)
         image_sources = get_image_sources(run)
 
         logger.info(f"Scraping {run=}")
@@ -66,11 +76,25 @@ def scrape(configfile: str) -> None:
                 count=run.count,
                 debug_outdir=run.debug_outdir,
                 concurrency=run.concurrency,
+                hash_workers=run.hash_workers,
+                hash_types=run.hash_types,
+                profile=bool(run.profile),
+                stream=bool(run.stream),
+                max_bytes=run.max_bytes,
+                stage_workers=run.stage_workers,
+                download_cache=download_cache,
+                reject_cache=reject_cache,
             )
             scraper.sync_scrape()
             # TODO:
             # browser.done()
             # shutil.rmtree(home_tmp_dir)
+        if db is not None:
+            db.close()
+        if download_cache is not None:
+            download_cache.close()
+        if reject_cache is not None:
+            reject_cache.close()
 
 
 if __name__ == "__main__":
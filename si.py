@@ -9,7 +9,7 @@ import tempfile
 from typer import Option, Typer
 
 from similar_images.bing_selenium import BingSelenium
-from similar_images.crappy_db import CrappyDB
+from similar_images.download_cache import DownloadCache
 from similar_images.filters.db_filters import (
     DbExactDupFilter,
     DbNearDupFilter,
@@ -22,7 +22,10 @@ from similar_images.image_sources import (
     BrowserQuerySource,
     LocalFileImageSource,
 )
+from similar_images.reject_cache import RejectCache
 from similar_images.scraper import Scraper
+from similar_images.types import DatabaseConfiguration
+from similar_images.utils import get_database
 
 logger = logging.getLogger()
 app = Typer()
@@ -56,13 +59,34 @@ def setup_logging(verbose: bool, logfile: str | None) -> None:
 
 @app.command()
 def scrape(
-    db: str | None = None,
+    db: str | None = Option(
+        None,
+        help="Database file: JSONL, or SQLite (.sqlite, .sqlite3), or binary (.sidb)",
+    ),
+    db_buffer_size: int | None = Option(
+        None, help="Write database records in groups of this size"
+    ),
+    db_flush_interval: float | None = Option(
+        None,
+        help="Write buffered database records when a record is added this many seconds after the last write",
+    ),
+    db_fsync: bool = Option(False, help="fsync the database after each write"),
+    db_shared: bool = Option(
+        False, help="Share the JSONL database with other processes (file locking)"
+    ),
     debug_outdir: str | None = Option(None, "-D"),
+    download_cache: str | None = Option(
+        None, help="Cache downloads in this directory, e.g. to run again"
+    ),
     gemini: list[str] | None = Option(
         None, "-g", help="Run Gemini filters. You must export your GEMINI_API_KEY."
     ),
+    hash_workers: int | None = Option(
+        None, help="Decode and hash images in this many processes"
+    ),
     local_files: list[str] | None = Option(None, "-l"),
     logfile: str | None = Option(None, "-L", "--logfile"),
+    max_bytes: int | None = Option(None, help="Skip images larger than this"),
     min_area: int | None = None,
     min_size: int | None = Option(
         None, parser=lambda arg: (int(x) for x in arg.split(","))
@@ -71,8 +95,19 @@ def scrape(
     num_images: int | None = Option(None, "-n"),
     outdir: str | None = Option(None, "-o"),
     paths: list[str] | None = Option(None, "-p"),
+    profile: bool = Option(False, help="Log the CPU time spent on each image"),
     queries: str | None = Option(None, "-q"),
     randomize: bool = Option(False, "-r"),
+    reject_cache: str | None = Option(
+        None, help="Remember URLs of small images and errors in this SQLite file"
+    ),
+    stage_workers: str | None = Option(
+        None,
+        help="Process links in stages with their own workers, e.g. download=32,hash=8,expensive=4",
+    ),
+    stream: bool = Option(
+        False, help="Stream downloads and stop them as soon as images are rejected"
+    ),
     threads: int | None = Option(None, "-t"),
     timestamp: bool = Option(False, "-T", "--timestamp", help="Add timestamp to -D, -o, and -L arguments"),
     verbose: bool = Option(False, "-v"),
@@ -93,11 +128,19 @@ def scrape(
     if min_size:
         min_size = tuple(min_size)
     logger.info(
-        f"{db=} {debug_outdir=} {gemini=} {headless=} {local_files=} {logfile=} "
-        f"{min_area=} {min_size=} {no_safe_search=} {num_images=} {outdir=} "
-        f"{paths=} {queries=} {randomize=} {threads=} {timestamp=} {verbose=} "
+        f"{db=} {db_buffer_size=} {db_flush_interval=} {db_fsync=} {db_shared=} {debug_outdir=} {download_cache=} {gemini=} {hash_workers=} {headless=} {local_files=} {logfile=} "
+        f"{max_bytes=} {min_area=} {min_size=} {no_safe_search=} {num_images=} {outdir=} "
+        f"{paths=} {profile=} {queries=} {randomize=} {reject_cache=} {stage_workers=} {stream=} {threads=} {timestamp=} {verbose=} "
         f"{wait_between_scroll=} {wait_first_load=} "
     )
+    cache = DownloadCache(download_cache) if download_cache else None
+    rejects = RejectCache(reject_cache) if reject_cache else None
+    workers = None
+    if stage_workers:
+        workers = {}
+        for stage_and_count in stage_workers.split(","):
+            stage, count = stage_and_count.split("=")
+            workers[stage] = int(count)
     assert local_files or paths or queries, (
         "at least one of -l, -p or -q must be specified"
     )
@@ -105,7 +148,15 @@ def scrape(
     crappy_db = None
     filter_objects = []
     if db:
-        crappy_db = CrappyDB(db)
+        crappy_db = get_database(
+            db,
+            DatabaseConfiguration(
+                buffer_size=db_buffer_size,
+                flush_interval=db_flush_interval,
+                fsync=db_fsync,
+                shared=db_shared,
+            ),
+        )
         filter_objects += [
             DbUrlFilter(crappy_db),
             DbExactDupFilter(crappy_db),
@@ -147,8 +198,21 @@ def scrape(
             debug_outdir=debug_outdir,
             count=num_images,
             concurrency=threads,
+            hash_workers=hash_workers,
+            profile=profile,
+            stream=stream,
+            max_bytes=max_bytes,
+            stage_workers=workers,
+            download_cache=cache,
+            reject_cache=rejects,
         )
         scraper.sync_scrape()
+    if crappy_db is not None:
+        crappy_db.close()
+    if cache is not None:
+        cache.close()
+    if rejects is not None:
+        rejects.close()
 
 
 if __name__ == "__main__":
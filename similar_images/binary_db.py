@@ -0,0 +1,294 @@
+import datetime
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+
+import numpy as np
+
+from similar_images.crappy_db import NEAR_DUP_INDEX_DISTANCE
+from similar_images.database import INDEX_FIELDS, Database
+from similar_images.hash_index import HASH_TYPES, HammingIndex, KeyIndex
+from similar_images.result_store import (
+    _SHA256_RE,
+    _micros_to_ts,
+    _prefix_key,
+    _ts_to_micros,
+)
+from similar_images.types import Result
+
+BINARY_DB_EXTENSION = ".sidb"
+HEAP_SUFFIX = ".heap"
+
+_HEADER = struct.Struct("<4sIII")  # magic, version, record size, reserved
+_MAGIC = b"SIDB"
+_VERSION = 1
+
+RECORD_DTYPE = np.dtype(
+    [
+        ("url_key", "<u8"),  # see _key()
+        ("hashstr_key", "<u8"),
+        ("sha256", "u1", (32,)),  # hashstr, unless _HASHSTR_IN_HEAP
+        ("url", "<u8"),  # heap offset
+        ("url_len", "<u4"),
+        ("hashstr", "<u8"),
+        ("hashstr_len", "<u4"),
+        ("query", "<u8"),
+        ("query_len", "<u4"),
+        ("extra", "<u8"),  # hashes that can't be packed, as JSON
+        ("extra_len", "<u4"),
+        ("ts", "<i8"),  # microseconds since the epoch
+        ("hashes", "<u8", (len(HASH_TYPES),)),
+        ("hash_len", "u1", (len(HASH_TYPES),)),  # number of hex digits, 0 if absent
+        ("flags", "u1"),
+    ]
+)
+_HAS_TS = 1
+_TS_UTC = 2
+_HAS_QUERY = 4
+_HAS_HASHES = 8
+_HASHSTR_IN_HEAP = 16
+
+_PACKABLE_HASH_RE = re.compile("[0-9a-f]{1,16}")
+_HASH_TYPE_INDEX = {k: i for i, k in enumerate(HASH_TYPES)}
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+
+def _key(value: str) -> int:
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _sha256_prefix_keys(sha256: np.ndarray) -> np.ndarray:
+    """`_prefix_key` of the hex strings of sha256s, given as rows of 32 bytes."""
+    head = sha256[:, :4]
+    digits = _HEX_DIGITS[np.stack([head >> 4, head & 15], axis=-1).reshape(-1, 8)]
+    return np.ascontiguousarray(digits).view(">u8").ravel().astype(np.uint64)
+
+
+class BinaryDB(Database):
+    """Append-only binary storage, memory-mapped and paged in lazily.
+
+    `filename` holds a header followed by fixed-width records (see `RECORD_DTYPE`):
+    keys of the URL and hashstr, the sha256, hashes packed as 64-bit integers and the
+    timestamp. Strings (URL, query, hashstr when it is not a sha256, hashes that can't
+    be packed) are appended to a heap, `filename + ".heap"`, and records point into it.
+
+    Opening a database only maps the files, whatever their size. Indexes (of URLs,
+    hashstrs, hashstr prefixes and near-duplicate hashes, as in CrappyDB) are built on
+    first use with vectorized operations, and kept up to date by `put`.
+
+    Like CrappyDB, BinaryDB assumes a single process and a single thread.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = str(filename)
+        self._heap_filename = self.filename + HEAP_SUFFIX
+        self._records_file = open(self.filename, "ab")
+        self._heap_file = open(self._heap_filename, "ab")
+        size = os.path.getsize(self.filename)
+        if size == 0:
+            header = _HEADER.pack(_MAGIC, _VERSION, RECORD_DTYPE.itemsize, 0)
+            self._records_file.write(header)
+            self._records_file.flush()
+            size = _HEADER.size
+        else:
+            with open(self.filename, "rb") as f:
+                magic, version, record_size, _ = _HEADER.unpack(f.read(_HEADER.size))
+            if (magic, version, record_size) != (
+                _MAGIC,
+                _VERSION,
+                RECORD_DTYPE.itemsize,
+            ):
+                raise ValueError(
+                    f"{self.filename}: not a binary database: {magic=} {version=} {record_size=}"
+                )
+        self._num_records = (size - _HEADER.size) // RECORD_DTYPE.itemsize
+        if _HEADER.size + self._num_records * RECORD_DTYPE.itemsize != size:
+            # Drop a record that was partially written
+            self._records_file.truncate(
+                _HEADER.size + self._num_records * RECORD_DTYPE.itemsize
+            )
+        self._heap_size = os.path.getsize(self._heap_filename)
+        self._records = np.zeros(0, dtype=RECORD_DTYPE)
+        self._heap: mmap.mmap | bytes = b""
+        self._key_indexes: dict[str, KeyIndex] = {}
+        self._prefix_index: KeyIndex | None = None
+        self._near_dup_index: HammingIndex | None = None
+
+    def __len__(self) -> int:
+        return self._num_records
+
+    def put(self, r: Result) -> None:
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        flags = 0
+        record["url_key"] = _key(r.url)
+        record["hashstr_key"] = _key(r.hashstr)
+        record["url"], record["url_len"] = self._heap_append(r.url)
+        if _SHA256_RE.fullmatch(r.hashstr):
+            record["sha256"] = np.frombuffer(bytes.fromhex(r.hashstr), dtype=np.uint8)
+        else:
+            flags |= _HASHSTR_IN_HEAP
+            record["hashstr"], record["hashstr_len"] = self._heap_append(r.hashstr)
+        if r.query is not None:
+            flags |= _HAS_QUERY
+            record["query"], record["query_len"] = self._heap_append(r.query)
+        if r.ts is not None:
+            flags |= _HAS_TS
+            ts = r.ts
+            if ts.tzinfo is not None:
+                flags |= _TS_UTC
+                ts = ts.astimezone(datetime.UTC).replace(tzinfo=None)
+            record["ts"] = _ts_to_micros(ts)
+        if r.hashes is not None:
+            flags |= _HAS_HASHES
+            extra = {}
+            for k, h in r.hashes.items():
+                if k in _HASH_TYPE_INDEX and _PACKABLE_HASH_RE.fullmatch(h):
+                    record["hashes"][0, _HASH_TYPE_INDEX[k]] = int(h, 16)
+                    record["hash_len"][0, _HASH_TYPE_INDEX[k]] = len(h)
+                else:
+                    extra[k] = h
+            if extra:
+                record["extra"], record["extra_len"] = self._heap_append(
+                    json.dumps(extra)
+                )
+        record["flags"] = flags
+        # The heap is written first, so that records never point past its end
+        self._heap_file.flush()
+        self._records_file.write(record.tobytes())
+        self._records_file.flush()
+        pos = self._num_records
+        self._num_records += 1
+        for field in INDEX_FIELDS:
+            if field in self._key_indexes:
+                self._key_indexes[field].add(_key(getattr(r, field)), pos)
+        if self._prefix_index is not None:
+            self._prefix_index.add(_prefix_key(r.hashstr.encode("utf-8")), pos)
+        if self._near_dup_index is not None:
+            self._near_dup_index.add(pos, r.hashes or {})
+
+    def get(self, field: str, value: str) -> Result | None:
+        if field not in INDEX_FIELDS:
+            return None
+        for pos in self._key_index(field).positions(_key(value)):
+            r = self._materialize(pos)
+            if getattr(r, field) == value:
+                return r
+        return None
+
+    def scan(self):
+        for pos in range(self._num_records):
+            yield self._materialize(pos)
+
+    def get_by_hashstr_prefix(self, prefix: str) -> Result | None:
+        if self._prefix_index is None:
+            self._map()
+            keys = _sha256_prefix_keys(np.asarray(self._records["sha256"]))
+            for pos in np.flatnonzero(self._records["flags"] & _HASHSTR_IN_HEAP):
+                hashstr = self._heap_str(pos, "hashstr")
+                keys[pos] = _prefix_key(hashstr.encode("utf-8"))
+            self._prefix_index = KeyIndex(keys)
+        data = prefix.encode("utf-8")
+        lo, hi = _prefix_key(data), _prefix_key(data, pad=b"\xff")
+        for pos in self._prefix_index.between(lo, hi).tolist():
+            r = self._materialize(pos)
+            if r.hashstr.startswith(prefix):
+                return r
+        return None
+
+    def near_duplicate(
+        self, hashes: dict[str, str], max_distance: int = 2
+    ) -> Result | None:
+        if self._near_dup_index is None:
+            self._map()
+            index = HammingIndex(max_distance=NEAR_DUP_INDEX_DISTANCE)
+            index.extend_packed(
+                np.asarray(self._records["hashes"]),
+                np.asarray(self._records["hash_len"]) > 0,
+            )
+            for pos in np.flatnonzero(self._records["extra_len"]):
+                index.add(int(pos), json.loads(self._heap_str(pos, "extra")))
+            self._near_dup_index = index
+        pos = self._near_dup_index.find(hashes, max_distance)
+        return self._materialize(pos) if pos is not None else None
+
+    def close(self) -> None:
+        self._records_file.close()
+        self._heap_file.close()
+        self._unmap()
+
+    def _heap_append(self, s: str) -> tuple[int, int]:
+        data = s.encode("utf-8")
+        self._heap_file.write(data)
+        offset = self._heap_size
+        self._heap_size += len(data)
+        return (offset, len(data))
+
+    def _heap_str(self, pos: int, field: str) -> str:
+        offset = int(self._records[field][pos])
+        length = int(self._records[f"{field}_len"][pos])
+        return self._heap[offset : offset + length].decode("utf-8")
+
+    def _map(self) -> None:
+        """Map the records and the heap written so far."""
+        if len(self._records) < self._num_records:
+            self._records = np.memmap(
+                self.filename,
+                dtype=RECORD_DTYPE,
+                mode="r",
+                offset=_HEADER.size,
+                shape=(self._num_records,),
+            )
+        if len(self._heap) < self._heap_size:
+            if isinstance(self._heap, mmap.mmap):
+                self._heap.close()
+            with open(self._heap_filename, "rb") as f:
+                self._heap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _unmap(self) -> None:
+        if isinstance(self._heap, mmap.mmap):
+            self._heap.close()
+        self._heap = b""
+        self._records = np.zeros(0, dtype=RECORD_DTYPE)
+
+    def _key_index(self, field: str) -> KeyIndex:
+        if field not in self._key_indexes:
+            self._map()
+            self._key_indexes[field] = KeyIndex(np.array(self._records[f"{field}_key"]))
+        return self._key_indexes[field]
+
+    def _materialize(self, pos: int) -> Result:
+        if pos >= len(self._records):
+            self._map()
+        record = self._records[pos]
+        flags = int(record["flags"])
+        if flags & _HASHSTR_IN_HEAP:
+            hashstr = self._heap_str(pos, "hashstr")
+        else:
+            hashstr = record["sha256"].tobytes().hex()
+        ts = None
+        if flags & _HAS_TS:
+            ts = _micros_to_ts(int(record["ts"]))
+            if flags & _TS_UTC:
+                ts = ts.replace(tzinfo=datetime.UTC)
+        hashes = None
+        if flags & _HAS_HASHES:
+            hashes = {
+                k: f"{int(value):0{int(length)}x}"
+                for k, value, length in zip(
+                    HASH_TYPES, record["hashes"], record["hash_len"]
+                )
+                if length
+            }
+            if record["extra_len"]:
+                hashes.update(json.loads(self._heap_str(pos, "extra")))
+        return Result(
+            url=self._heap_str(pos, "url"),
+            hashstr=hashstr,
+            ts=ts,
+            query=self._heap_str(pos, "query") if flags & _HAS_QUERY else None,
+            hashes=hashes,
+        )
@@ -1,4 +1,5 @@
 import asyncio
+import contextlib
 import functools
 import json
 import logging
@@ -80,8 +81,12 @@ class BingSelenium:
         url = f"https://www.bing.com/images/search?q={quote_plus(query)}"
         logger.info(f"Searching {url=}")
         await asyncio.to_thread(functools.partial(self.driver.get, url))
-        async for url in self.yield_images("iusc", "m", max_images):
-            yield url
+        # Close the inner generator as soon as this one is closed: stop scrolling
+        async with contextlib.aclosing(
+            self.yield_images("iusc", "m", max_images)
+        ) as urls:
+            async for url in urls:
+                yield url
 
     async def search_similar_images(self, url_or_path: str, max_images: int = -1):
         logger.info(
@@ -106,8 +111,11 @@ class BingSelenium:
                 _JS_DROP_FILE, drop_target, 0, 0
             )
             file_input.send_keys(url_or_path)
-        async for url in self.yield_images("richImgLnk", "data-m", max_images):
-            yield url
+        async with contextlib.aclosing(
+            self.yield_images("richImgLnk", "data-m", max_images)
+        ) as urls:
+            async for url in urls:
+                yield url
 
     async def yield_images(self, img_class_name: str, image_attr: str, max_images: int):
         done = set()
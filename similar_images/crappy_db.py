@@ -1,45 +1,284 @@
-from collections import defaultdict
+import contextlib
+import gc
+import logging
+import os
+import time
+import weakref
 from pathlib import Path
+from typing import TextIO
 
+from similar_images.database import Database
+from similar_images.result_store import ResultStore, ResultView
 from similar_images.types import Result
 
-INDEX_FIELDS = ["url", "hashstr"]
+try:
+    import orjson as json
+except ImportError:
+    import json
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
-class CrappyDB:
-    """CrappyDB assumes a single process and a single thread accesses the storage file at a time."""
+logger = logging.getLogger(__name__)
 
-    def __init__(self, filename: str):
+NEAR_DUP_INDEX_DISTANCE = 2
+DEFAULT_BUFFER_SIZE = 1000
+
+
+@contextlib.contextmanager
+def _locked(f: TextIO, operation: int | None):
+    """Hold an advisory lock (fcntl.LOCK_SH or LOCK_EX) on `f`; no-op if None."""
+    if operation is None:
+        yield
+        return
+    fcntl.flock(f.fileno(), operation)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Pause the cyclic garbage collector, which would otherwise scan the decoded
+    records again and again while they wait to be stored."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _lock_current(f: TextIO, filename: str, operation: int) -> TextIO:
+    """Lock `filename` (fcntl.LOCK_SH or LOCK_EX) and return it open for appending:
+    `f`, unless another file replaced it since `f` was opened (e.g. compact_db), in
+    which case `f` is closed and the new file is opened."""
+    while True:
+        fcntl.flock(f.fileno(), operation)
+        if os.fstat(f.fileno()).st_ino == os.stat(filename).st_ino:
+            return f
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+        f = open(filename, "at")
+
+
+def _write_lines(f: TextIO, lines: list[str], fsync: bool) -> None:
+    if f.closed:
+        return
+    if lines:
+        f.writelines(lines)
+        lines.clear()
+    f.flush()
+    if fsync:
+        os.fsync(f.fileno())
+
+
+def _close(
+    f: TextIO, filename: str, lines: list[str], fsync: bool, shared: bool
+) -> None:
+    if f.closed:
+        return
+    if shared:
+        current = _lock_current(f, filename, fcntl.LOCK_EX)
+        try:
+            _write_lines(current, lines, fsync)
+        finally:
+            fcntl.flock(current.fileno(), fcntl.LOCK_UN)
+        current.close()
+    else:
+        _write_lines(f, lines, fsync)
+    f.close()
+
+
+class CrappyDB(Database):
+    """CrappyDB assumes a single thread, and by default a single process, accesses the storage file at a time.
+
+    Records are appended through a persistent file handle. By default, each `put` is
+    written right away. With `buffer_size` and/or `flush_interval`, records are
+    buffered in memory and written in groups: when `buffer_size` records are pending,
+    on the first `put` at least `flush_interval` seconds after the last write (there
+    is no timer: without new records, pending ones wait), on `flush`, on `close` and
+    at exit. With `fsync`, every write is followed by an fsync.
+    Either way, `put` updates the in-memory indexes immediately. After `close`, `put`
+    and `flush` raise a ValueError.
+
+    With `shared`, several processes can use the same file (POSIX only). Writes hold an
+    exclusive lock on the file, and reads a shared one. Before a lookup, records that
+    other processes appended since the last one are read from the end of the file,
+    and added to the in-memory indexes. Two processes can still both add the same image
+    if they look it up before either of them writes it. If the file is replaced (e.g.
+    compacted by compact_db while holding the lock), it is opened and loaded again.
+
+    Records are kept in memory in a compact `ResultStore`, and `get`, `scan` and
+    `near_duplicate` return read-only `ResultView`s of them. `memory_usage` reports
+    the size of the store.
+
+    Loading does not validate records: lines are decoded (with orjson if it is installed)
+    into plain dicts, and records that don't fit the store's columns are only validated
+    when their fields are read. `load_stats` reports how long loading took.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        buffer_size: int | None = None,
+        flush_interval: float | None = None,
+        fsync: bool = False,
+        shared: bool = False,
+    ):
+        if shared and fcntl is None:
+            raise ValueError("A shared CrappyDB needs fcntl (POSIX)")
         self.filename = filename
+        if buffer_size is None:
+            buffer_size = DEFAULT_BUFFER_SIZE if flush_interval is not None else 1
+        assert buffer_size >= 1
+        self._buffer_size = buffer_size
+        self._flush_interval = flush_interval
+        self._fsync = fsync
+        self._shared = shared
+        self._buffer: list[str] = []
+        self._last_flush = time.monotonic()
         Path(filename).touch()
-        self._cache: list[Result] = []
-        self._index: dict[str, dict[str, Result]] = defaultdict(
-            dict
-        )  # field name -> field value -> result
+        self._store = ResultStore(near_dup_distance=NEAR_DUP_INDEX_DISTANCE)
+        self._offset = 0  # bytes of the file read so far
+        self._reload_buffer = False  # whether the store lacks the buffered records
+        self._open(open(self.filename, "at"))
         self._build_cache()
 
-    def put(self, r: Result) -> None:
-        with open(self.filename, "at") as f:
-            f.write(f"{r.dump()}\n")
-        self._cache.append(r)
-        for field in INDEX_FIELDS:
-            self._index[field][getattr(r, field)] = r
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def put(self, r: Result | ResultView) -> None:
+        self._check_open()
+        self._buffer.append(f"{r.dump()}\n")
+        self._store.append(r)
+        if len(self._buffer) >= self._buffer_size or (
+            self._flush_interval is not None
+            and time.monotonic() - self._last_flush >= self._flush_interval
+        ):
+            self.flush()
 
-    def get(self, field: str, value: str) -> Result | None:
-        return self._index.get(field, {}).get(value, None)
+    def get(self, field: str, value: str) -> ResultView | None:
+        self._read_new_records()
+        return self._store.get(field, value)
+
+    def get_by_hashstr_prefix(self, prefix: str) -> ResultView | None:
+        self._read_new_records()
+        return self._store.get_by_hashstr_prefix(prefix)
 
     def scan(self):
-        for r in self._cache:
-            yield r
+        self._read_new_records()
+        for pos in range(len(self._store)):
+            yield self._store.view(pos)
+
+    def near_duplicate(
+        self, hashes: dict[str, str], max_distance: int = 2
+    ) -> ResultView | None:
+        self._read_new_records()
+        return self._store.near_duplicate(hashes, max_distance)
+
+    def memory_usage(self) -> dict[str, int]:
+        """Approximate number of bytes used in memory by each part of the store."""
+        return self._store.memory_usage()
+
+    def flush(self) -> None:
+        self._check_open()
+        if self._shared:
+            with self._locked_current(fcntl.LOCK_EX):
+                # Read what others wrote first, so as to skip our own records
+                self._read_records()
+                _write_lines(self._file, self._buffer, self._fsync)
+                self._offset = os.fstat(self._file.fileno()).st_size
+        else:
+            _write_lines(self._file, self._buffer, self._fsync)
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        self._finalizer()
+
+    def _check_open(self) -> None:
+        if self._file.closed:
+            raise ValueError("CrappyDB is closed")
+
+    def _open(self, f: TextIO) -> None:
+        self._file = f
+        self._inode = os.fstat(f.fileno()).st_ino
+        self._finalizer = weakref.finalize(
+            self,
+            _close,
+            self._file,
+            self.filename,
+            self._buffer,
+            self._fsync,
+            self._shared,
+        )
+
+    @contextlib.contextmanager
+    def _locked_current(self, operation: int):
+        """Hold a lock on the shared file, after loading it again if it was
+        replaced."""
+        f = _lock_current(self._file, self.filename, operation)
+        if f is not self._file:
+            self._finalizer.detach()
+            self._open(f)
+            self._store = ResultStore(near_dup_distance=NEAR_DUP_INDEX_DISTANCE)
+            self._offset = 0
+            self._reload_buffer = True
+        try:
+            yield
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _read_new_records(self) -> None:
+        """Read the records that other processes appended to a shared file, or
+        the file that replaced it."""
+        if not self._shared:
+            return
+        st = os.stat(self.filename)
+        if st.st_size > self._offset or st.st_ino != self._inode:
+            with self._locked_current(fcntl.LOCK_SH):
+                self._read_records()
 
-    def _scan_file(self):
-        with open(self.filename, "rt") as f:
-            for line in f.readlines():
-                r = Result.model_validate_json(line)
-                yield r
+    def _read_records(self) -> None:
+        """Add the records of the file past `_offset` to the store."""
+        with _gc_paused():
+            with open(self.filename, "rb") as f:
+                f.seek(self._offset)
+                for line in f:
+                    if not line.strip():
+                        continue
+                    d = json.loads(line)
+                    if (
+                        not isinstance(d, dict)
+                        or not isinstance(d.get("url"), str)
+                        or not isinstance(d.get("hashstr"), str)
+                        or not isinstance(d.get("hashes"), dict | None)
+                    ):
+                        # Let pydantic explain what's wrong, or coerce it
+                        d = Result.model_validate_json(line)
+                    self._store.append(d)
+                self._offset = f.tell()
+            if self._reload_buffer:
+                for line in self._buffer:
+                    self._store.append(json.loads(line))
+                self._reload_buffer = False
+            self._store.commit()
 
     def _build_cache(self) -> None:
-        for r in self._scan_file():
-            self._cache.append(r)
-            for field in INDEX_FIELDS:
-                self._index[field][getattr(r, field)] = r
+        start_time = time.perf_counter()
+        with _locked(self._file, fcntl.LOCK_SH if self._shared else None):
+            self._read_records()
+        seconds = time.perf_counter() - start_time
+        rows = len(self._store)
+        self.load_stats = {
+            "rows": rows,
+            "seconds": seconds,
+            "rows_per_second": rows / seconds if seconds else 0.0,
+        }
+        logger.info(
+            f"Loaded {rows} records from {self.filename} in {seconds:.3f} s ({self.load_stats['rows_per_second']:.0f} rows/s)"
+        )
@@ -0,0 +1,46 @@
+from typing import Generator
+
+from similar_images.hash_index import near_duplicate_hash
+from similar_images.types import Result
+
+INDEX_FIELDS = ["url", "hashstr"]
+
+
+class Database:
+    """Stores `Result`s and looks them up by URL, by sha256 of the contents,
+    or by perceptual hashes."""
+
+    def put(self, r: Result) -> None:
+        raise NotImplementedError()
+
+    def get(self, field: str, value: str) -> Result | None:
+        """Return the last record put with `field` (one of `INDEX_FIELDS`) equal to `value`."""
+        raise NotImplementedError()
+
+    def scan(self) -> Generator[Result, None, None]:
+        raise NotImplementedError()
+
+    def get_by_hashstr_prefix(self, prefix: str) -> Result | None:
+        """Return the first record whose hashstr starts with `prefix`, e.g. the name of
+        a file saved by the scraper."""
+        for r in self.scan():
+            if r.hashstr.startswith(prefix):
+                return r
+        return None
+
+    def near_duplicate(
+        self, hashes: dict[str, str], max_distance: int = 2
+    ) -> Result | None:
+        """Return the first record with a hash within `max_distance` bits of `hashes`."""
+        for r in self.scan():
+            if r.hashes is not None:
+                if near_duplicate_hash(r.hashes, hashes, max_distance):
+                    return r
+        return None
+
+    def flush(self) -> None:
+        """Write pending records to storage."""
+        pass
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,61 @@
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Any
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS decisions (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    decision TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+"""
+
+
+def decision_key(
+    model: str, query: str, config: dict[str, Any], image_sha256s: list[str]
+) -> str:
+    """Key of the decision of `model` on `query` about images with sha256s
+    `image_sha256s`, with generation (and request) configuration `config`."""
+    d = [model, query, config, image_sha256s]
+    return hashlib.sha256(json.dumps(d, sort_keys=True).encode()).hexdigest()
+
+
+class DecisionCache:
+    """Decisions of LLMs (as JSON), in an SQLite file, by `decision_key`, so that
+    an image is only judged once by a model with the same query and configuration,
+    across runs. Counts the `hits` and `misses` of `get`."""
+
+    def __init__(self, filename: str):
+        self.filename = str(filename)
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(self.filename)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM decisions").fetchone()[0]
+
+    def get(self, key: str) -> str | None:
+        row = self._conn.execute(
+            "SELECT decision FROM decisions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, model: str, decision: str) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO decisions (key, model, decision, ts) "
+            "VALUES (?, ?, ?, ?)",
+            (key, model, decision, time.time()),
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
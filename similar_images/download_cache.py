@@ -0,0 +1,251 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import httpx
+
+from similar_images.types import DownloadCacheConfiguration
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    sha256 TEXT,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS urls_sha256 ON urls (sha256);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used);
+"""
+# Response headers kept with cached responses
+_HEADERS = ("content-type", "content-encoding", "location")
+# Statuses cached for `negative_ttl` seconds; TIMEOUT stands for a timeout
+TIMEOUT = -1
+NEGATIVE_STATUSES = (404, 410, TIMEOUT)
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+DEFAULT_MAX_BYTES = 1 << 30
+DEFAULT_NEGATIVE_TTL = 24 * 3600
+
+
+class CachedResponse:
+    def __init__(
+        self, status: int, headers: dict[str, str], contents: bytes | None = None
+    ):
+        self.status = status
+        self.headers = headers
+        self.contents = contents
+
+
+class DownloadCache:
+    """Responses to GET requests, in a directory: an SQLite index from URLs to
+    responses, and their bodies in files named after their sha256, so that URLs
+    with the same contents share a file.
+
+    Images (status 200) and redirects are kept until evicted: when the files
+    take more than `max_bytes`, the least recently used are removed. "Not found"
+    responses and timeouts are kept for `negative_ttl` seconds."""
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+        self._conn = sqlite3.connect(self.directory / "index.sqlite")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM blobs"
+        ).fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+    def size(self) -> int:
+        """Bytes in cached bodies."""
+        return self._size
+
+    def get(self, url: str) -> CachedResponse | None:
+        row = self._conn.execute(
+            "SELECT status, headers, sha256, ts FROM urls WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, headers, sha256, ts = row
+        if status in NEGATIVE_STATUSES and time.time() - ts > self.negative_ttl:
+            return None
+        contents = None
+        if sha256 is not None:
+            try:
+                contents = self._path(sha256).read_bytes()
+            except FileNotFoundError:
+                return None
+            self._conn.execute(
+                "UPDATE blobs SET last_used = ? WHERE sha256 = ?", (time.time(), sha256)
+            )
+            self._conn.commit()
+        return CachedResponse(status, json.loads(headers), contents)
+
+    def put(
+        self,
+        url: str,
+        status: int,
+        headers: dict[str, str] | None = None,
+        contents: bytes | None = None,
+    ) -> None:
+        sha256 = None
+        if contents is not None:
+            sha256 = hashlib.sha256(contents).hexdigest()
+            path = self._path(sha256)
+            if not path.exists():
+                path.parent.mkdir(exist_ok=True)
+                tmp_path = path.with_suffix(".tmp")
+                tmp_path.write_bytes(contents)
+                os.replace(tmp_path, path)
+            now = time.time()
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO blobs (sha256, size, last_used) VALUES (?, ?, ?)",
+                (sha256, len(contents), now),
+            )
+            if cursor.rowcount:
+                self._size += len(contents)
+            else:
+                self._conn.execute(
+                    "UPDATE blobs SET last_used = ? WHERE sha256 = ?", (now, sha256)
+                )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO urls (url, status, headers, sha256, ts) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (url, status, json.dumps(headers or {}), sha256, time.time()),
+        )
+        self._conn.commit()
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def _path(self, sha256: str) -> Path:
+        return self.directory / sha256[:2] / sha256
+
+    def _evict(self) -> None:
+        """Remove the least recently used bodies down to 90% of `max_bytes`."""
+        target = self.max_bytes * 9 // 10
+        evicted = []
+        for sha256, size in self._conn.execute(
+            "SELECT sha256, size FROM blobs ORDER BY last_used"
+        ).fetchall():
+            if self._size <= target:
+                break
+            evicted.append((sha256,))
+            self._size -= size
+            self._path(sha256).unlink(missing_ok=True)
+        self._conn.executemany("DELETE FROM urls WHERE sha256 = ?", evicted)
+        self._conn.executemany("DELETE FROM blobs WHERE sha256 = ?", evicted)
+        self._conn.commit()
+        logger.debug(f"Evicted {len(evicted)} files from the download cache")
+
+
+def get_download_cache(
+    directory: str, config: DownloadCacheConfiguration | None = None
+) -> DownloadCache:
+    config = config or DownloadCacheConfiguration()
+    return DownloadCache(
+        directory,
+        max_bytes=config.max_bytes or DEFAULT_MAX_BYTES,
+        negative_ttl=(
+            config.negative_ttl
+            if config.negative_ttl is not None
+            else DEFAULT_NEGATIVE_TTL
+        ),
+    )
+
+
+class _CachingStream(httpx.AsyncByteStream):
+    """Body of a response, put in the cache once read to the end (streamed
+    downloads stopped early are not cached)."""
+
+    def __init__(self, stream, cache: DownloadCache, url: str, headers: dict):
+        self._stream = stream
+        self._cache = cache
+        self._url = url
+        self._headers = headers
+
+    async def __aiter__(self):
+        chunks = []
+        async for chunk in self._stream:
+            chunks.append(chunk)
+            yield chunk
+        self._cache.put(self._url, 200, self._headers, b"".join(chunks))
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+class CachingTransport(httpx.AsyncBaseTransport):
+    """Answers GET requests from `cache` when possible, otherwise from `transport`
+    (by default, the one of `httpx.AsyncClient`), and caches the responses."""
+
+    def __init__(
+        self, cache: DownloadCache, transport: httpx.AsyncBaseTransport | None = None
+    ):
+        self._cache = cache
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method != "GET":
+            return await self._transport.handle_async_request(request)
+        url = str(request.url)
+        cached = self._cache.get(url)
+        if cached is not None:
+            if cached.status == TIMEOUT:
+                raise httpx.TimeoutException(f"Timed out (cached) for url {url}")
+            return httpx.Response(
+                cached.status,
+                headers=cached.headers,
+                content=cached.contents,
+                request=request,
+            )
+        try:
+            response = await self._transport.handle_async_request(request)
+        except httpx.TimeoutException:
+            self._cache.put(url, TIMEOUT)
+            raise
+        headers = {k: response.headers[k] for k in _HEADERS if k in response.headers}
+        if response.status_code == 200:
+            return httpx.Response(
+                200,
+                headers=response.headers,
+                stream=_CachingStream(response.stream, self._cache, url, headers),
+                request=request,
+                extensions=response.extensions,
+            )
+        if (
+            response.status_code in NEGATIVE_STATUSES
+            or response.status_code in _REDIRECT_STATUSES
+        ):
+            await response.aclose()
+            self._cache.put(url, response.status_code, headers)
+            return httpx.Response(
+                response.status_code, headers=headers, request=request
+            )
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
@@ -0,0 +1,58 @@
+from similar_images.filters.filter import (
+    Filter,
+    FilterInput,
+    FilterResult,
+    FilterStage,
+)
+from similar_images.reject_cache import RejectCache
+
+
+class _Size:
+    """Stands for an image of which only the size is known."""
+
+    def __init__(self, size: tuple[int, int]):
+        self.size = size
+
+
+class RejectCacheFilter(Filter):
+    """Rejects URLs rejected recently by the "contents" filters, or that failed.
+
+    URLs rejected by one of `size_filters`, which only need the size of the image,
+    are checked again against the size remembered, so that they are downloaded again
+    if the filters changed (e.g. with a smaller minimum size)."""
+
+    def __init__(
+        self, reject_cache: RejectCache, size_filters: list[Filter] | None = None
+    ) -> None:
+        self._reject_cache = reject_cache
+        self._size_filters = size_filters or []
+
+    def stage(self) -> FilterStage:
+        return "url"
+
+    def stat_name(self) -> str:
+        return "cache:reject"
+
+    def allow_debug_rejected(self) -> bool:
+        return False
+
+    def inputs(self) -> set[FilterInput]:
+        return {"url"}
+
+    async def filter(self, url: str, **kwargs) -> FilterResult:
+        reject = self._reject_cache.get(url)
+        if reject is None:
+            return FilterResult(keep=True)
+        if reject.size is not None and reject.reason in (
+            f.stat_name() for f in self._size_filters
+        ):
+            for filter in self._size_filters:
+                result = await filter.filter(url=url, img=_Size(reject.size), **kwargs)
+                if not result.keep:
+                    break
+            else:
+                return FilterResult(keep=True)
+        explanation = f"Rejected before ({reject.reason}): {url}"
+        if reject.size is not None:
+            explanation += f": {reject.size}"
+        return FilterResult(keep=False, explanation=explanation)
@@ -1,12 +1,17 @@
-import hashlib
-
-from similar_images.crappy_db import CrappyDB
-from similar_images.filters.filter import Filter, FilterResult, FilterStage
+from similar_images.database import Database
+from similar_images.filters.filter import (
+    Filter,
+    FilterInput,
+    FilterResult,
+    FilterStage,
+)
+from similar_images.hash_index import HASH_TYPES, hash_distance, near_duplicate_hash
+from similar_images.hashing import sha256
 from similar_images.types import Result
 
 
 class DbFilter(Filter):
-    def __init__(self, db: CrappyDB) -> None:
+    def __init__(self, db: Database) -> None:
         self._db = db
 
     def _return_result(self, url: str, record: Result) -> FilterResult:
@@ -21,7 +26,7 @@ class DbFilter(Filter):
 
 class DbUrlFilter(DbFilter):
     """
-    def __init__(self, db: CrappyDB) -> None:
+    def __init__(self, db: Database) -> None:
         super(self).__init__(db)
     """
 
@@ -34,6 +39,9 @@ class DbUrlFilter(DbFilter):
     def allow_debug_rejected(self) -> bool:
         return False
 
+    def inputs(self) -> set[FilterInput]:
+        return {"url"}
+
     async def filter(self, url: str, **kwargs) -> FilterResult:
         record = self._db.get("url", url)
         return self._return_result(url, record)
@@ -49,42 +57,47 @@ class DbExactDupFilter(DbFilter):
     def allow_debug_rejected(self) -> bool:
         return False
 
-    async def filter(self, url: str, contents: bytes, **kwargs) -> FilterResult:
-        # https://stackoverflow.com/a/64994148
-        hashstr = hashlib.sha256(contents).hexdigest()
+    def inputs(self) -> set[FilterInput]:
+        return {"url", "hashstr"}
+
+    async def filter(
+        self,
+        url: str,
+        hashstr: str | None = None,
+        contents: bytes | None = None,
+        **kwargs,
+    ) -> FilterResult:
+        if hashstr is None:
+            hashstr = sha256(contents)
         record = self._db.get("hashstr", hashstr)
         return self._return_result(url, record)
 
 
-def hash_distance(hash1: str, hash2: str) -> int:
-    int1 = int(hash1, 16)
-    int2 = int(hash2, 16)
-    return bin(int1 ^ int2).count("1")
-
-
-def near_duplicate_hash(
-    hashes1: dict[str, str], hashes2: dict[str, str], max_distance: int = 2
-) -> bool:
-    common_keys = set(hashes1.keys()).intersection(set(hashes2.keys()))
-    return any(
-        hash_distance(hashes1[k], hashes2[k]) <= max_distance for k in common_keys
-    )
+class DbNearDupFilter(DbFilter):
+    """Rejects images with a perceptual hash close to one in the database.
+    Only `hash_types` (all of them by default) are computed and compared."""
 
+    def __init__(self, db: Database, hash_types: list[str] | None = None) -> None:
+        super().__init__(db)
+        self._hash_types = hash_types or HASH_TYPES
+        assert set(self._hash_types) <= set(HASH_TYPES), self._hash_types
 
-class DbNearDupFilter(DbFilter):
     def stage(self) -> FilterStage:
         return "hashes"
 
     def stat_name(self) -> str:
         return "dup:near"
 
+    def inputs(self) -> set[FilterInput]:
+        return {"url", "hashes"}
+
+    def hash_types(self) -> list[str]:
+        return self._hash_types
+
     async def filter(self, url: str, hashes: dict[str, str], **kwargs) -> FilterResult:
+        hashes = {k: hashes[k] for k in self._hash_types if k in hashes}
         record = self._find_near_duplicate(hashes)
         return self._return_result(url, record)
 
     def _find_near_duplicate(self, hashes: dict[str, str]) -> Result | None:
-        for r in self._db.scan():
-            if r.hashes is not None:
-                if near_duplicate_hash(r.hashes, hashes):
-                    return r
-        return None
+        return self._db.near_duplicate(hashes)
@@ -2,6 +2,8 @@ from typing import Literal
 
 from pydantic import BaseModel
 
+from similar_images.hash_index import HASH_TYPES
+
 
 class FilterResult(BaseModel):
     keep: bool
@@ -10,6 +12,9 @@ class FilterResult(BaseModel):
 
 type FilterStage = Literal["url", "contents", "hashes", "image"]
 
+type FilterInput = Literal["query", "url", "contents", "hashstr", "img", "hashes"]
+ALL_INPUTS: set[FilterInput] = {"query", "url", "contents", "hashstr", "img", "hashes"}
+
 
 class Filter:
     def stage(self) -> FilterStage:
@@ -21,5 +26,19 @@ class Filter:
     def allow_debug_rejected(self) -> bool:
         return True
 
+    def inputs(self) -> set[FilterInput]:
+        """Keyword arguments `filter` needs. The scraper only computes those that the
+        filters of a stage need."""
+        return ALL_INPUTS
+
+    def hash_types(self) -> list[str]:
+        """Perceptual hashes `filter` needs, if it needs "hashes"."""
+        return HASH_TYPES
+
+    def stats(self) -> dict[str, int]:
+        """Counters of the filter (e.g. cache hits) since it was created, added to
+        the stats of the scraper."""
+        return {}
+
     async def filter(self, *args, **kwargs) -> FilterResult:
         raise NotImplementedError()
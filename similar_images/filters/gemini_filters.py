@@ -1,9 +1,19 @@
 import logging
 
 import httpx
+from PIL import Image
 
-from similar_images.filters.filter import Filter, FilterResult, FilterStage
+from similar_images.decision_cache import DecisionCache
+from similar_images.filters.filter import (
+    Filter,
+    FilterInput,
+    FilterResult,
+    FilterStage,
+)
 from similar_images.gemini import Gemini
+from similar_images.gemini_batcher import GeminiBatcher
+from similar_images.image_encoder import get_image_encoder
+from similar_images.retry_policy import RetryPolicy
 
 logger = logging.getLogger("__name__")
 
@@ -17,19 +27,42 @@ class GeminiFilter(Filter):
         model: str,
         timeout: float = 60,
         filter_name: str | None = None,
+        decision_cache: str | None = None,
+        retry_policy: dict | None = None,
+        image_encoder: dict | None = None,
+        batch_size: int | None = None,
+        batch_wait: float = 0.5,
         **kwargs,
     ):
+        """`decision_cache`: SQLite file of decisions, to only ask about an image
+        once (see `DecisionCache`).
+        `retry_policy`: arguments of `RetryPolicy`, e.g. {"tries": 3, "deadline": 60}.
+        `image_encoder`: arguments of `get_image_encoder`, to send smaller images,
+        e.g. {"max_edge": 1024, "image_format": "JPEG", "quality": 85}.
+        `batch_size`: to ask about up to that many images per request, waiting at
+        most `batch_wait` seconds for them (see `GeminiBatcher`)."""
         self._query = query
         self._keep_responses = keep_responses
         self._model = model
         self._httpx_client = httpx.AsyncClient(timeout=timeout)
         self._filter_name = filter_name or "llm"
+        self._decision_cache = (
+            DecisionCache(decision_cache) if decision_cache is not None else None
+        )
         self._gemini = Gemini(
             *args,
             httpx_client=self._httpx_client,
             model=model,
+            decision_cache=self._decision_cache,
+            retry_policy=RetryPolicy(**retry_policy) if retry_policy else None,
+            image_encoder=get_image_encoder(**image_encoder) if image_encoder else None,
             **kwargs,
         )
+        self._batcher = (
+            GeminiBatcher(self._gemini, batch_size, batch_wait)
+            if batch_size is not None and batch_size > 1
+            else None
+        )
 
     def stage(self) -> FilterStage:
         return "expensive"
@@ -37,8 +70,50 @@ class GeminiFilter(Filter):
     def stat_name(self) -> str:
         return self._filter_name
 
-    async def filter(self, url: str, contents: bytes, **kwargs) -> FilterResult:
-        got = await self._gemini.chat(query=self._query, image_contents=[contents])
+    def inputs(self) -> set[FilterInput]:
+        return {"url", "contents", "img", "hashstr"}
+
+    def stats(self) -> dict[str, int]:
+        retry_policy = self._gemini.retry_policy
+        ret = {
+            f"{self._filter_name}:retries": retry_policy.retries,
+            f"{self._filter_name}:gave_up": retry_policy.gave_up,
+        }
+        if self._decision_cache is not None:
+            ret[f"{self._filter_name}:cache_hit"] = self._decision_cache.hits
+            ret[f"{self._filter_name}:cache_miss"] = self._decision_cache.misses
+        if self._batcher is not None:
+            ret[f"{self._filter_name}:batches"] = self._batcher.batches
+            ret[f"{self._filter_name}:fell_back"] = self._batcher.fell_back
+        return ret
+
+    async def filter(
+        self,
+        url: str,
+        contents: bytes,
+        img: Image.Image | None = None,
+        hashstr: str | None = None,
+        **kwargs,
+    ) -> FilterResult:
+        if self._batcher is not None:
+            got = await self._batcher.chat(
+                self._query,
+                contents,
+                img.format if img is not None else None,
+                sha256=hashstr,
+            )
+        else:
+            got = await self._gemini.chat(
+                query=self._query,
+                image_contents=[contents],
+                image_formats=[img.format] if img is not None else None,
+                image_sha256s=[hashstr] if hashstr is not None else None,
+            )
+        if got.failed():
+            # Not a decision: don't reject the image for it
+            raise RuntimeError(
+                f"Gemini {self._model}/{self._filter_name} gave up for url {url}"
+            )
         status = got.status_code
         block = got.block
         decision = got.decision
@@ -1,6 +1,11 @@
 from PIL import Image
 
-from similar_images.filters.filter import Filter, FilterResult, FilterStage
+from similar_images.filters.filter import (
+    Filter,
+    FilterInput,
+    FilterResult,
+    FilterStage,
+)
 
 
 class ImageFilter(Filter):
@@ -19,6 +24,9 @@ class ImageFilter(Filter):
     def allow_debug_rejected(self) -> bool:
         return False
 
+    def inputs(self) -> set[FilterInput]:
+        return {"url", "img"}
+
     async def filter(self, url: str, img: Image, **kwargs) -> FilterResult:
         size = sorted(img.size)
         area = size[0] * size[1]
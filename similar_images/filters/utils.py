@@ -1,4 +1,4 @@
-from similar_images.crappy_db import CrappyDB
+from similar_images.database import Database
 from similar_images.filters.db_filters import (
     DbExactDupFilter,
     DbNearDupFilter,
@@ -10,7 +10,7 @@ from similar_images.filters.image_filters import ImageFilter
 from similar_images.types import CommonConfiguration
 
 
-def get_filters(config: CommonConfiguration, db: CrappyDB | None) -> list[Filter]:
+def get_filters(config: CommonConfiguration, db: Database | None) -> list[Filter]:
     if not config.filters:
         return []
     ret = []
@@ -18,14 +18,14 @@ def get_filters(config: CommonConfiguration, db: CrappyDB | None) -> list[Filter
         for filter_name, filter_config in filter_group.items():
             match filter_name:
                 case "DbUrlFilter":
-                    assert db
+                    assert db is not None
                     ret.append(DbUrlFilter(db))
                 case "DbExactDupFilter":
-                    assert db
+                    assert db is not None
                     ret.append(DbExactDupFilter(db))
                 case "DbNearDupFilter":
-                    assert db
-                    ret.append(DbNearDupFilter(db))
+                    assert db is not None
+                    ret.append(DbNearDupFilter(db, **filter_config))
                 case "ImageFilter":
                     ret.append(ImageFilter(**filter_config))
                 case "GeminiFilter":
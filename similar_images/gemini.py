@@ -5,14 +5,29 @@ import json
 import logging
 import os
 import re
+import time
 from typing import Any
 
 import httpx
 from PIL import Image
 from pydantic import BaseModel
 
+from similar_images.decision_cache import DecisionCache, decision_key
+from similar_images.hashing import sha256
+from similar_images.image_encoder import ImageEncoder
+from similar_images.rate_limiter import RateLimiter, get_rate_limiter
+from similar_images.retry_policy import RetryPolicy
+
 logger = logging.getLogger(__name__)
 
+# Asks `query` about `n` images at once (see `Gemini.chat_batch`)
+BATCH_QUERY = (
+    "{query}\n\n"
+    "Answer the above separately for each of the {n} images, numbered from 1 to {n} "
+    "in the order they are given. Reply only with a JSON object from the number of "
+    'each image to its answer, e.g. {{"1": "...", "2": "..."}}.'
+)
+
 
 class Decision(BaseModel):
     image_path: str
@@ -23,7 +38,13 @@ class Decision(BaseModel):
     status_code: int  # response.status_code
     usage: dict[str, int] | None  # response.json()["usageMetadata"]
 
-    def answer(self):
+    def failed(self) -> bool:
+        """Whether there is no answer because all tries failed."""
+        return self.status_code != 200
+
+    def answer(self) -> str | None:
+        if self.decision is None:
+            return None
         d: str = self.decision
         if m := re.search("<answer>(.*)</answer>", d):
             return m.group(1).strip().lower()
@@ -48,6 +69,19 @@ class Decision(BaseModel):
         return d
 
 
+def _failed_decision(image_path: str) -> Decision:
+    """The decision of a request that failed (see `Decision.failed`)."""
+    return Decision(
+        image_path=image_path,
+        content={},
+        block=None,
+        text=None,
+        decision=None,
+        status_code=400,
+        usage=None,
+    )
+
+
 class Gemini:
     def __init__(
         self,
@@ -58,37 +92,245 @@ class Gemini:
         retry_sleep: float = 10,
         api_key: str | None = None,
         text_before_image: bool = True,
+        decision_cache: DecisionCache | None = None,
+        rpm: float | None = None,
+        tpm: float | None = None,
+        rate_limiter: RateLimiter | None = None,
+        retry_policy: RetryPolicy | None = None,
+        image_encoder: ImageEncoder | None = None,
     ):
+        """`rpm`, `tpm`: requests and tokens per minute budgets of `model`, shared
+        by all instances (see `get_rate_limiter`), unless given a `rate_limiter`.
+
+        `retry_policy`: by default, `tries` attempts, with waits starting at
+        `retry_sleep` seconds.
+
+        `image_encoder`: to make images smaller before sending them."""
         self._api_key = api_key if api_key else os.environ["GEMINI_API_KEY"]
         self._httpx_client = httpx_client
         self._model = model
         self._max_output_tokens = max_output_tokens
-        self._tries = tries
-        self._retry_sleep = retry_sleep
         self._text_before_image = text_before_image
+        self._decision_cache = decision_cache
+        self._image_encoder = image_encoder
+        self.retry_policy = (
+            retry_policy
+            if retry_policy is not None
+            else RetryPolicy(tries=tries, base_sleep=retry_sleep)
+        )
+        self._rate_limiter = (
+            rate_limiter
+            if rate_limiter is not None
+            else get_rate_limiter(model, rpm, tpm)
+        )
 
     async def chat(
         self,
         query: str,
         image_paths: list[str] | None = None,
         image_contents: list[bytes] | None = None,
+        image_formats: list[str] | None = None,
+        image_sha256s: list[str] | None = None,
     ) -> Decision:
+        """`image_formats`: PIL formats of `image_contents`, if known (otherwise,
+        images are opened to read them). `image_sha256s`: of `image_contents`, if
+        known (otherwise, they are computed when needed).
+
+        With a decision cache, successful decisions are cached, and returned
+        without a request when asked again about the same images."""
         image_paths = image_paths if image_paths else []
         image_contents = image_contents if image_contents else []
-        for i in range(self._tries):
-            try:
-                return await self.do_chat(query, image_paths, image_contents)
-            except httpx.HTTPStatusError as ex:
-                logger.warning(f"Gemini failed {i=} on {image_paths=}: {type(ex)} {ex}")
-                if ex.response.status_code in (429, 503, 504):
-                    await asyncio.sleep(self._retry_sleep)
         image_path = image_paths[0] if image_paths else ""
-        return Decision(
-            image_path=image_path, content={}, decision=None, status_code=400
+        key = None
+        if self._decision_cache is not None:
+            key = self.decision_key(query, image_paths, image_contents, image_sha256s)
+            if (cached := self._decision_cache.get(key)) is not None:
+                decision = Decision.model_validate_json(cached)
+                return decision.model_copy(update={"image_path": image_path})
+        decision = await self._chat(
+            query, image_paths, image_contents, image_formats, image_sha256s
         )
+        if decision is None:
+            return _failed_decision(image_path)
+        decision.image_path = image_path
+        if key is not None:
+            self._decision_cache.put(key, self._model, decision.model_dump_json())
+        return decision
+
+    async def chat_batch(
+        self,
+        query: str,
+        image_contents: list[bytes],
+        image_formats: list[str] | None = None,
+        image_sha256s: list[str] | None = None,
+    ) -> list[Decision] | None:
+        """Ask `query` about each of `image_contents` in a single request, with up
+        to `max_output_tokens` per image. Return a decision per image (failed ones
+        if the request failed), or None if its answers couldn't be told apart.
+
+        With a decision cache, only images not in the cache are sent, and their
+        decisions are cached as if asked one by one."""
+        decisions: list[Decision | None] = [None] * len(image_contents)
+        keys: list[str | None] = [None] * len(image_contents)
+        if self._decision_cache is not None:
+            for i, contents in enumerate(image_contents):
+                keys[i] = self.decision_key(
+                    query,
+                    [],
+                    [contents],
+                    [image_sha256s[i]] if image_sha256s else None,
+                )
+                if (cached := self._decision_cache.get(keys[i])) is not None:
+                    decisions[i] = Decision.model_validate_json(cached)
+        missing = [i for i, d in enumerate(decisions) if d is None]
+        if missing:
+            batch = await self._chat(
+                BATCH_QUERY.format(query=query, n=len(missing)),
+                [],
+                [image_contents[i] for i in missing],
+                [image_formats[i] for i in missing] if image_formats else None,
+                [image_sha256s[i] for i in missing] if image_sha256s else None,
+                max_output_tokens=self._max_output_tokens * len(missing),
+            )
+            if batch is None:
+                # Asking about the images one by one would fail the same way
+                for i in missing:
+                    decisions[i] = _failed_decision("")
+                return decisions
+            answers = parse_batch_answers(batch.text, len(missing))
+            if answers is None:
+                return None
+            usage = None
+            if batch.usage is not None:
+                # Each image gets its share of the tokens
+                usage = {k: v // len(missing) for k, v in batch.usage.items()}
+            for i, answer in zip(missing, answers):
+                decisions[i] = Decision(
+                    image_path="",
+                    content=batch.content,
+                    block=None,
+                    text=answer,
+                    decision=answer.strip().lower().replace("\n", " "),
+                    status_code=batch.status_code,
+                    usage=usage,
+                )
+                if keys[i] is not None:
+                    self._decision_cache.put(
+                        keys[i], self._model, decisions[i].model_dump_json()
+                    )
+        return decisions
+
+    async def _chat(
+        self,
+        query: str,
+        image_paths: list[str],
+        image_contents: list[bytes],
+        image_formats: list[str] | None,
+        image_sha256s: list[str] | None = None,
+        max_output_tokens: int | None = None,
+    ) -> Decision | None:
+        """Send a request following the retry policy. Return None on failure."""
+        image_path = image_paths[0] if image_paths else ""
+        if self._image_encoder is not None:
+            image_contents, image_formats = await self.encode_images(
+                image_paths, image_contents, image_sha256s
+            )
+            image_paths = []
+        policy = self.retry_policy
+        start = time.monotonic()
+        sleep = 0.0
+        for i in range(policy.tries):
+            try:
+                async with asyncio.timeout(policy.remaining(start)):
+                    estimate = await self._rate_limiter.acquire()
+                    decision = await self.do_chat(
+                        query,
+                        image_paths,
+                        image_contents,
+                        image_formats,
+                        max_output_tokens=max_output_tokens,
+                    )
+                self._rate_limiter.record(estimate, decision.usage)
+                return decision
+            except TimeoutError:
+                logger.warning(f"Gemini deadline exceeded {i=} on {image_path=}")
+                break
+            except httpx.HTTPError as ex:
+                logger.warning(f"Gemini failed {i=} on {image_path=}: {type(ex)} {ex}")
+                if i + 1 == policy.tries or not policy.retryable(ex):
+                    break
+                sleep = policy.sleep_time(sleep, ex)
+                remaining = policy.remaining(start)
+                if remaining is not None and sleep > remaining:
+                    break
+                policy.retries += 1
+                if (
+                    isinstance(ex, httpx.HTTPStatusError)
+                    and ex.response.status_code == 429
+                ):
+                    # Pauses all requests to the model
+                    self._rate_limiter.throttle(sleep)
+                else:
+                    await asyncio.sleep(sleep)
+        policy.gave_up += 1
+        return None
+
+    def decision_key(
+        self,
+        query: str,
+        image_paths: list[str],
+        image_contents: list[bytes],
+        image_sha256s: list[str] | None = None,
+    ) -> str:
+        sha256s = []
+        for image_path in image_paths:
+            with open(image_path, "rb") as f:
+                sha256s.append(sha256(f.read()))
+        if image_sha256s is None:
+            image_sha256s = [sha256(c) for c in image_contents]
+        sha256s += image_sha256s
+        config = {
+            "generationConfig": self._generation_config(),
+            "text_before_image": self._text_before_image,
+        }
+        if self._image_encoder is not None:
+            config["image_encoder"] = self._image_encoder.settings()
+        return decision_key(self._model, query, config, sha256s)
+
+    async def encode_images(
+        self,
+        image_paths: list[str],
+        image_contents: list[bytes],
+        image_sha256s: list[str] | None = None,
+    ) -> tuple[list[bytes], list[str]]:
+        """The images of `image_paths` then `image_contents` (with sha256s
+        `image_sha256s`, if known), encoded by the image encoder, and their
+        formats."""
+        contents = []
+        for image_path in image_paths:
+            with open(image_path, "rb") as f:
+                contents.append(f.read())
+        sha256s = [None] * len(contents) + (
+            image_sha256s or [None] * len(image_contents)
+        )
+        encoded = [
+            await self._image_encoder.encode(c, s)
+            for c, s in zip(contents + image_contents, sha256s)
+        ]
+        return [c for c, _ in encoded], [f for _, f in encoded]
+
+    def _generation_config(
+        self, max_output_tokens: int | None = None
+    ) -> dict[str, Any]:
+        return {"max_output_tokens": max_output_tokens or self._max_output_tokens}
 
     async def do_chat(
-        self, query: str, image_paths: list[str], image_contents: list[bytes]
+        self,
+        query: str,
+        image_paths: list[str],
+        image_contents: list[bytes],
+        image_formats: list[str] | None = None,
+        max_output_tokens: int | None = None,
     ) -> Decision:
         parts = []
         if self._text_before_image:
@@ -103,11 +345,12 @@ class Gemini:
                     }
                 }
                 parts.append(d)
-        for content in image_contents:
-            img = Image.open(io.BytesIO(content))
+        if image_formats is None:
+            image_formats = [Image.open(io.BytesIO(c)).format for c in image_contents]
+        for content, image_format in zip(image_contents, image_formats, strict=True):
             d = {
                 "inline_data": {
-                    "mime_type": f"image/{img.format}",
+                    "mime_type": f"image/{image_format}",
                     "data": base64.b64encode(content).decode("ascii"),
                 }
             }
@@ -115,9 +358,7 @@ class Gemini:
         if not self._text_before_image:
             parts.append({"text": query})
         data = {
-            "generationConfig": {
-                "max_output_tokens": self._max_output_tokens,
-            },
+            "generationConfig": self._generation_config(max_output_tokens),
             "contents": {"parts": parts},
         }
         url = f"https://generativelanguage.googleapis.com/v1beta/models/{self._model}:generateContent?key={self._api_key}"
@@ -152,3 +393,25 @@ class Gemini:
             status_code=response.status_code,
             usage=usage,
         )
+
+
+def parse_batch_answers(text: str | None, n: int) -> list[str] | None:
+    """Answers to `BATCH_QUERY` about `n` images, from the text of the response, or
+    None if there isn't exactly one answer per image."""
+    if text is None:
+        return None
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        answers = json.loads(text[start : end + 1])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(answers, dict) or set(answers) != {
+        str(i) for i in range(1, n + 1)
+    }:
+        return None
+    return [
+        a if isinstance(a, str) else json.dumps(a)
+        for a in (answers[str(i)] for i in range(1, n + 1))
+    ]
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+
+from similar_images.gemini import Decision, Gemini
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    """An image waiting for its batch, and the future of its decision."""
+
+    def __init__(
+        self,
+        contents: bytes,
+        image_format: str | None,
+        sha256: str | None,
+        future: asyncio.Future[Decision],
+    ):
+        self.contents = contents
+        self.image_format = image_format
+        self.sha256 = sha256
+        self.future = future
+        self.task: asyncio.Task | None = None  # sending its batch
+
+
+class GeminiBatcher:
+    """Groups questions about single images, asked concurrently, into requests
+    about up to `batch_size` images (see `Gemini.chat_batch`): a batch is sent
+    once full, or `max_wait` seconds after its first image. If the answers of a
+    batch can't be told apart, its images are asked about one by one. If the
+    request fails, they all get a failed decision. Batches whose callers were all
+    cancelled are not sent, or stop being sent.
+
+    Counts the `batches` sent, and those that `fell_back` to single images."""
+
+    def __init__(self, gemini: Gemini, batch_size: int, max_wait: float = 0.5):
+        assert batch_size >= 1
+        self._gemini = gemini
+        self._batch_size = batch_size
+        self._max_wait = max_wait
+        self._pending: dict[str, list[_Pending]] = {}  # by query
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._tasks: dict[asyncio.Task, list[_Pending]] = {}  # batches being sent
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.batches = 0
+        self.fell_back = 0
+
+    async def chat(
+        self,
+        query: str,
+        contents: bytes,
+        image_format: str | None = None,
+        sha256: str | None = None,
+    ) -> Decision:
+        """`sha256`: of `contents`, if known."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # E.g. a new `asyncio.run`: whatever was pending died with the old loop
+            self._loop = loop
+            self._pending.clear()
+            self._timers.clear()
+            self._tasks.clear()
+        future = loop.create_future()
+        entry = _Pending(contents, image_format, sha256, future)
+        pending = self._pending.setdefault(query, [])
+        pending.append(entry)
+        if len(pending) >= self._batch_size:
+            self._flush(query)
+        elif query not in self._timers:
+            self._timers[query] = loop.call_later(self._max_wait, self._flush, query)
+        try:
+            return await future
+        finally:
+            if future.cancelled():
+                self._drop_cancelled(query, entry)
+
+    def _drop_cancelled(self, query: str, entry: _Pending) -> None:
+        """Forget the pending batch of `query`, or cancel the sending of the batch
+        of `entry`, if all their callers were cancelled."""
+        if entry.task is not None:
+            if all(p.future.done() for p in self._tasks.get(entry.task, [])):
+                entry.task.cancel()
+            return
+        pending = self._pending.get(query, [])
+        if all(p.future.done() for p in pending):
+            self._pending.pop(query, None)
+            if (timer := self._timers.pop(query, None)) is not None:
+                timer.cancel()
+
+    def _flush(self, query: str) -> None:
+        if (timer := self._timers.pop(query, None)) is not None:
+            timer.cancel()
+        # Callers cancelled while waiting (e.g. once enough images were found)
+        batch = [p for p in self._pending.pop(query, []) if not p.future.done()]
+        if not batch:
+            return
+        task = asyncio.create_task(self._send(query, batch))
+        self._tasks[task] = batch
+        task.add_done_callback(self._tasks.pop)
+        for p in batch:
+            p.task = task
+
+    async def _send(self, query: str, batch: list[_Pending]) -> None:
+        try:
+            decisions = None
+            if len(batch) > 1:
+                self.batches += 1
+                image_formats = [p.image_format for p in batch]
+                sha256s = [p.sha256 for p in batch]
+                decisions = await self._gemini.chat_batch(
+                    query,
+                    [p.contents for p in batch],
+                    image_formats if None not in image_formats else None,
+                    sha256s if None not in sha256s else None,
+                )
+                if decisions is None:
+                    self.fell_back += 1
+                    logger.debug(f"Gemini batch of {len(batch)} fell back")
+            if decisions is None:
+                decisions = await asyncio.gather(
+                    *(
+                        self._gemini.chat(
+                            query,
+                            image_contents=[p.contents],
+                            image_formats=[p.image_format]
+                            if p.image_format is not None
+                            else None,
+                            image_sha256s=[p.sha256] if p.sha256 is not None else None,
+                        )
+                        for p in batch
+                    )
+                )
+            for p, decision in zip(batch, decisions):
+                if not p.future.done():
+                    p.future.set_result(decision)
+        except Exception as ex:
+            for p in batch:
+                if not p.future.done():
+                    p.future.set_exception(ex)
@@ -0,0 +1,383 @@
+from collections import defaultdict
+
+import numpy as np
+
+HASH_TYPES = ["a", "p", "d", "dv", "w"]
+_MASK64 = (1 << 64) - 1
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def hash_distance(hash1: str, hash2: str) -> int:
+    int1 = int(hash1, 16)
+    int2 = int(hash2, 16)
+    return (int1 ^ int2).bit_count()
+
+
+def near_duplicate_hash(
+    hashes1: dict[str, str], hashes2: dict[str, str], max_distance: int = 2
+) -> bool:
+    common_keys = set(hashes1.keys()).intersection(set(hashes2.keys()))
+    return any(
+        hash_distance(hashes1[k], hashes2[k]) <= max_distance for k in common_keys
+    )
+
+
+def _parse_hash(h: str) -> int | None:
+    try:
+        return int(h, 16)
+    except ValueError:
+        return None
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+        return np.bitwise_count(values)
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class HashMatrix:
+    """Hashes packed as 64-bit integers, one NumPy column per hash type.
+
+    Comparing a query against a column is a single vectorized XOR + popcount.
+    Hash types not in `hash_types` and hashes wider than 64 bits are kept aside
+    as Python integers and compared one by one.
+    """
+
+    def __init__(self, hash_types: list[str] = HASH_TYPES):
+        self._types = {k: i for i, k in enumerate(hash_types)}
+        self._columns = np.zeros((len(hash_types), 0), dtype=np.uint64)
+        self._present = np.zeros((len(hash_types), 0), dtype=bool)
+        self._size = 0
+        # hash type -> position -> hash value
+        self._overflow: dict[str, dict[int, int]] = defaultdict(dict)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def hash_types(self) -> list[str]:
+        return list(self._types)
+
+    def packable(self, k: str, value: int) -> bool:
+        return k in self._types and value.bit_length() <= 64
+
+    def set(self, pos: int, hashes: dict[str, str]) -> dict[str, int]:
+        """Store `hashes` at `pos` and return the ones that were packed."""
+        if pos >= self._columns.shape[1]:
+            self._grow(max(pos + 1, 2 * self._columns.shape[1], 1024))
+        self._size = max(self._size, pos + 1)
+        packed = {}
+        for k, h in hashes.items():
+            value = _parse_hash(h)
+            if value is None:
+                continue
+            if self.packable(k, value):
+                self._columns[self._types[k], pos] = value
+                self._present[self._types[k], pos] = True
+                packed[k] = value
+            else:
+                self._overflow[k][pos] = value
+        return packed
+
+    def extend(self, values: np.ndarray, present: np.ndarray) -> None:
+        """Append hashes in bulk.
+
+        `values` and `present` have one row per position and one column per hash type,
+        in the order of `hash_types`."""
+        n = values.shape[0]
+        if self._size + n > self._columns.shape[1]:
+            self._grow(max(self._size + n, 2 * self._columns.shape[1], 1024))
+        self._columns[:, self._size : self._size + n] = values.T
+        self._present[:, self._size : self._size + n] = present.T
+        self._size += n
+
+    def extend_hashes(
+        self, hashes: list[dict[str, str] | None]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Append hashes in bulk. Return the packed values and where they're present,
+        as given to `extend`."""
+        start = self._size
+        columns: list[list[int]] = [[0] * len(hashes) for _ in self._types]
+        present: list[list[bool]] = [[False] * len(hashes) for _ in self._types]
+        for pos, h in enumerate(hashes):
+            if not h:
+                continue
+            for k, v in h.items():
+                value = _parse_hash(v)
+                if value is None:
+                    continue
+                if self.packable(k, value):
+                    columns[self._types[k]][pos] = value
+                    present[self._types[k]][pos] = True
+                else:
+                    self._overflow[k][start + pos] = value
+        shape = (len(self._types), len(hashes))
+        values_array = np.array(columns, dtype=np.uint64).reshape(shape).T
+        present_array = np.array(present, dtype=bool).reshape(shape).T
+        self.extend(values_array, present_array)
+        return values_array, present_array
+
+    def nbytes(self) -> int:
+        # A dict entry and its Python int take about 100 bytes
+        overflow = sum(len(values) for values in self._overflow.values())
+        return self._columns.nbytes + self._present.nbytes + overflow * 100
+
+    def get(self, pos: int) -> dict[str, int]:
+        """Hashes stored at `pos`."""
+        ret = {}
+        if pos < self._size:
+            for k, i in self._types.items():
+                if self._present[i, pos]:
+                    ret[k] = int(self._columns[i, pos])
+        for k, values in self._overflow.items():
+            if pos in values:
+                ret[k] = values[pos]
+        return ret
+
+    def find(self, hashes: dict[str, str], max_distance: int = 2) -> int | None:
+        """Return the smallest position sharing a hash type with `hashes` within
+        `max_distance` bits, or None."""
+        best = None
+        for k, h in hashes.items():
+            value = _parse_hash(h)
+            if value is None:
+                continue
+            pos = self.match(k, value, max_distance, limit=best)
+            if pos is not None:
+                best = pos  # later hash types only need to look at earlier positions
+                if best == 0:
+                    break
+        return best
+
+    def match(
+        self,
+        k: str,
+        value: int,
+        max_distance: int,
+        limit: int | None = None,
+        positions: np.ndarray | None = None,
+    ) -> int | None:
+        """Return the smallest position below `limit` whose type `k` hash is within
+        `max_distance` bits of `value`.
+
+        If `positions` (sorted) is given, only these positions are looked at in the
+        packed column; hashes kept aside are always looked at."""
+        limit = self._size if limit is None else limit
+        best = None
+        if k in self._types:
+            i = self._types[k]
+            high_distance = (value >> 64).bit_count()
+            if high_distance <= max_distance:
+                if positions is None:
+                    columns = self._columns[i, :limit]
+                    present = self._present[i, :limit]
+                else:
+                    positions = positions[positions < limit]
+                    columns = self._columns[i, positions]
+                    present = self._present[i, positions]
+                distances = _popcount(columns ^ np.uint64(value & _MASK64))
+                hits = np.flatnonzero(
+                    present & (distances <= max_distance - high_distance)
+                )
+                if hits.size:
+                    best = int(hits[0] if positions is None else positions[hits[0]])
+        for pos, other in self._overflow.get(k, {}).items():
+            if pos < (limit if best is None else best):
+                if (other ^ value).bit_count() <= max_distance:
+                    best = pos
+        return best
+
+    def _grow(self, capacity: int) -> None:
+        columns = np.zeros((len(self._types), capacity), dtype=np.uint64)
+        present = np.zeros((len(self._types), capacity), dtype=bool)
+        columns[:, : self._columns.shape[1]] = self._columns
+        present[:, : self._present.shape[1]] = self._present
+        self._columns = columns
+        self._present = present
+
+
+class KeyIndex:
+    """Positions by integer key: sorted arrays for keys added in bulk, and a dict for
+    keys added one at a time.
+
+    Keys keep the unsigned integer type of the first `keys`, and positions are 32-bit.
+    The dict holds up to `max_tail` keys, or an eighth of the keys of the sorted arrays,
+    so that small, frequent runs given to `extend` don't copy the sorted arrays. Larger
+    runs, and the dict when it is full, are sorted on their own and merged into them."""
+
+    def __init__(
+        self,
+        keys: np.ndarray,
+        positions: np.ndarray | None = None,
+        max_tail: int = 1024,
+    ):
+        self._keys = np.zeros(0, dtype=keys.dtype)
+        self._positions = np.zeros(0, dtype=np.uint32)
+        self._tail: dict[int, list[int]] = defaultdict(list)
+        self._tail_size = 0
+        self._max_tail = max_tail
+        self._tail_capacity = max_tail
+        self.extend(keys, positions)
+
+    def add(self, key: int, pos: int) -> None:
+        self._tail[key].append(pos)
+        self._tail_size += 1
+        if self._tail_size > self._tail_capacity:
+            self._merge(self._keys[:0], self._positions[:0])
+
+    def extend(self, keys: np.ndarray, positions: np.ndarray | None = None) -> None:
+        if positions is None:
+            positions = np.arange(len(keys), dtype=np.uint32)
+        if self._tail_size + len(keys) <= self._tail_capacity:
+            for key, pos in zip(keys.tolist(), positions.tolist()):
+                self.add(key, pos)
+        else:
+            self._merge(keys.astype(self._keys.dtype), positions.astype(np.uint32))
+
+    def _merge(self, keys: np.ndarray, positions: np.ndarray) -> None:
+        """Merge a run of keys, and the keys of the dict, into the sorted arrays
+        without sorting these again.
+
+        Positions with the same key are not kept in order."""
+        if self._tail:
+            tail = [
+                (k, pos) for k, positions in self._tail.items() for pos in positions
+            ]
+            self._tail.clear()
+            self._tail_size = 0
+            tail_keys, tail_positions = zip(*tail)
+            keys = np.concatenate([keys, np.array(tail_keys, dtype=keys.dtype)])
+            positions = np.concatenate(
+                [positions, np.array(tail_positions, dtype=np.uint32)]
+            )
+        order = np.argsort(keys)
+        keys, positions = keys[order], positions[order]
+        if len(self._keys):
+            at = np.searchsorted(self._keys, keys, side="right")
+            keys = np.insert(self._keys, at, keys)
+            positions = np.insert(self._positions, at, positions)
+        self._keys = keys
+        self._positions = positions
+        self._tail_capacity = max(self._max_tail, len(keys) // 8)
+
+    def positions(self, key: int) -> list[int]:
+        """Positions with `key`, in decreasing order, whether they were added one at
+        a time or in bulk."""
+        ret = self._tail.get(key, [])
+        key = self._keys.dtype.type(key)
+        lo = np.searchsorted(self._keys, key, side="left")
+        hi = np.searchsorted(self._keys, key, side="right")
+        return sorted(ret + self._positions[lo:hi].tolist(), reverse=True)
+
+    def between(self, lo: int, hi: int) -> np.ndarray:
+        """Positions with keys between `lo` and `hi` included, in increasing order."""
+        if self._tail:  # range queries need the keys sorted
+            self._merge(self._keys[:0], self._positions[:0])
+        start = np.searchsorted(self._keys, self._keys.dtype.type(lo), side="left")
+        end = np.searchsorted(self._keys, self._keys.dtype.type(hi), side="right")
+        return np.sort(self._positions[start:end])
+
+    def nbytes(self) -> int:
+        # A dict entry and a one-element list take about 150 bytes
+        return self._keys.nbytes + self._positions.nbytes + self._tail_size * 150
+
+
+class HammingIndex:
+    """Multi-index hashing: find hashes within a small Hamming distance of a query.
+
+    Every 64-bit hash is split into `max_distance + 1` bands of bits, and each band is
+    indexed in its own `KeyIndex`. By the pigeonhole principle, two hashes that differ
+    in at most `max_distance` bits agree exactly on at least one band, so the union of
+    the buckets of the query's bands contains all its near-duplicates. Candidates are
+    then checked against the packed hashes of a `HashMatrix`.
+
+    Items are identified by their position, as given to `add`, or following the
+    positions already used for `extend`.
+    Queries with a distance larger than `max_distance` scan the whole `HashMatrix`.
+    """
+
+    def __init__(self, max_distance: int = 2, hash_types: list[str] = HASH_TYPES):
+        assert 0 <= max_distance < 64
+        self.max_distance = max_distance
+        self._matrix = HashMatrix(hash_types)
+        num_bands = max_distance + 1
+        self._bands: list[tuple[int, int]] = []  # (shift, mask)
+        start = 0
+        for i in range(num_bands):
+            width = 64 // num_bands + (1 if i < 64 % num_bands else 0)
+            self._bands.append((start, (1 << width) - 1))
+            start += width
+        self._band_dtype = np.uint32 if num_bands > 1 else np.uint64
+        # hash type -> band -> band value -> positions
+        self._tables: dict[str, list[KeyIndex]] = {}
+
+    def __len__(self) -> int:
+        return len(self._matrix)
+
+    def get(self, pos: int) -> dict[str, int]:
+        """Hashes stored at `pos`."""
+        return self._matrix.get(pos)
+
+    def nbytes(self) -> int:
+        tables = sum(t.nbytes() for ts in self._tables.values() for t in ts)
+        return self._matrix.nbytes() + tables
+
+    def add(self, pos: int, hashes: dict[str, str]) -> None:
+        for k, value in self._matrix.set(pos, hashes).items():
+            for table, (shift, mask) in zip(self._band_tables(k), self._bands):
+                table.add((value >> shift) & mask, pos)
+
+    def extend(self, hashes: list[dict[str, str] | None]) -> None:
+        """Add `hashes` in bulk, at the positions following the last one."""
+        start = len(self._matrix)
+        values, present = self._matrix.extend_hashes(hashes)
+        self._index(start, values, present)
+
+    def extend_packed(self, values: np.ndarray, present: np.ndarray) -> None:
+        """Add hashes packed as 64-bit integers in bulk, at the positions following
+        the last one (see `HashMatrix.extend`)."""
+        start = len(self._matrix)
+        self._matrix.extend(values, present)
+        self._index(start, values, present)
+
+    def _index(self, start: int, values: np.ndarray, present: np.ndarray) -> None:
+        for j, k in enumerate(self._matrix.hash_types):
+            rows = np.flatnonzero(present[:, j])
+            if not rows.size:
+                continue
+            column = values[rows, j]
+            for table, (shift, mask) in zip(self._band_tables(k), self._bands):
+                band = (column >> np.uint64(shift)) & np.uint64(mask)
+                table.extend(band.astype(self._band_dtype), rows + start)
+
+    def find(
+        self, hashes: dict[str, str], max_distance: int | None = None
+    ) -> int | None:
+        """Return the smallest position sharing a hash type with `hashes` within
+        `max_distance` bits, or None."""
+        max_distance = self.max_distance if max_distance is None else max_distance
+        if max_distance > self.max_distance:
+            return self._matrix.find(hashes, max_distance)
+        best = None
+        for k, h in hashes.items():
+            value = _parse_hash(h)
+            if value is None:
+                continue
+            positions = None
+            if value.bit_length() <= 64:
+                candidates = []
+                for table, (shift, mask) in zip(self._tables.get(k, []), self._bands):
+                    candidates += table.positions((value >> shift) & mask)
+                positions = np.unique(np.array(candidates, dtype=np.int64))
+            pos = self._matrix.match(k, value, max_distance, best, positions)
+            if pos is not None:
+                best = pos
+        return best
+
+    def _band_tables(self, k: str) -> list[KeyIndex]:
+        if k not in self._tables:
+            self._tables[k] = [
+                KeyIndex(np.zeros(0, dtype=self._band_dtype)) for _ in self._bands
+            ]
+        return self._tables[k]
@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import imagehash
+import numpy as np
+from PIL import Image
+
+from similar_images.hash_index import HASH_TYPES
+
+HASH_SIZE = 8
+
+
+def sha256(contents: bytes) -> str:
+    # https://stackoverflow.com/a/64994148
+    return hashlib.sha256(contents).hexdigest()
+
+
+def _bits_to_hex(bits: np.ndarray) -> str:
+    # Same as str(imagehash.ImageHash(bits)) for 64 bits
+    return np.packbits(bits.flatten()).tobytes().hex()
+
+
+def _whash(small: Image.Image) -> str:
+    """`imagehash.whash` of a grayscale image already resized to its `image_scale`.
+
+    Removing the lowest frequency and taking the Haar LL band at the hash size
+    amounts to comparing the sums of pixels in blocks of the image to their median,
+    which is done exactly with integers. If blocks tie at the median, the result of
+    `imagehash` depends on rounding errors, so `imagehash` is used."""
+    pixels = np.asarray(small, dtype=np.int64)
+    block = pixels.shape[0] // HASH_SIZE
+    sums = pixels.reshape(HASH_SIZE, block, HASH_SIZE, block).sum(axis=(1, 3))
+    ordered = np.sort(sums, axis=None)
+    middle = sums.size // 2
+    if ordered[middle - 1] == ordered[middle]:
+        return str(imagehash.whash(small, image_scale=pixels.shape[0]))
+    return _bits_to_hex(sums > (ordered[middle - 1] + ordered[middle]) / 2)
+
+
+class _Resizer:
+    """Resizes a grayscale image like `imagehash` does, sharing the horizontal pass
+    between sizes of the same width.
+
+    Pillow resamples horizontally, then vertically, so resizing to (w, h) gives the
+    same pixels as resizing to (w, height) and then to (w, h)."""
+
+    def __init__(self, gray: Image.Image):
+        self._gray = gray
+        self._columns: dict[int, Image.Image] = {}
+
+    def resize(self, size: tuple[int, int]) -> Image.Image:
+        width, height = size
+        if width not in self._columns:
+            self._columns[width] = self._gray.resize(
+                (width, self._gray.height), imagehash.ANTIALIAS
+            )
+        return self._columns[width].resize(size, imagehash.ANTIALIAS)
+
+    def pixels(self, size: tuple[int, int]) -> np.ndarray:
+        return np.asarray(self.resize(size))
+
+
+def image_hashes(
+    img: Image.Image, hash_types: list[str] = HASH_TYPES
+) -> dict[str, str]:
+    """Perceptual hashes of an image, by hash type (see `hash_index.HASH_TYPES`).
+
+    Same values as the `imagehash` functions (average_hash, phash, dhash,
+    dhash_vertical, whash), but the image is decoded and converted to grayscale
+    only once, sizes of the same width share their horizontal resampling, and whash
+    mostly avoids wavelet transforms. `imagehash` functions are given images already
+    at the size they resize to; resizing an image to its own size is a copy, so they
+    see the same pixels."""
+    resizer = _Resizer(img.convert("L"))
+    ret = {}
+    for k in hash_types:
+        match k:
+            case "a":
+                pixels = resizer.pixels((HASH_SIZE, HASH_SIZE))
+                ret[k] = _bits_to_hex(pixels > np.mean(pixels))
+            case "p":
+                small = resizer.resize((4 * HASH_SIZE, 4 * HASH_SIZE))
+                ret[k] = str(imagehash.phash(small))
+            case "d":
+                pixels = resizer.pixels((HASH_SIZE + 1, HASH_SIZE))
+                ret[k] = _bits_to_hex(pixels[:, 1:] > pixels[:, :-1])
+            case "dv":
+                pixels = resizer.pixels((HASH_SIZE, HASH_SIZE + 1))
+                ret[k] = _bits_to_hex(pixels[1:, :] > pixels[:-1, :])
+            case "w":
+                # Computed from the size of the original image
+                scale = max(2 ** int(np.log2(min(img.size))), HASH_SIZE)
+                ret[k] = _whash(resizer.resize((scale, scale)))
+            case _:
+                raise ValueError(f"Unknown hash type: {k}")
+    return ret
+
+
+def _image_hashes_from_bytes(contents: bytes, hash_types: list[str]) -> dict[str, str]:
+    return image_hashes(Image.open(io.BytesIO(contents)), hash_types)
+
+
+class Hasher:
+    """Computes hashes of downloaded images without blocking the event loop.
+
+    With `workers`, images are decoded and hashed in a pool of that many processes,
+    and sha256 runs in a thread (hashlib releases the GIL). At most `max_pending`
+    images (by default, twice the number of workers) are queued for the pool at a
+    time; callers wait for a slot. Without workers, everything runs inline, in the
+    event loop.
+    """
+
+    def __init__(self, workers: int | None = None, max_pending: int | None = None):
+        assert workers is None or workers >= 0
+        self.workers = workers or 0
+        self._semaphore = asyncio.Semaphore(max_pending or 2 * self.workers or 1)
+        self._executor: ProcessPoolExecutor | None = None
+
+    async def sha256(self, contents: bytes) -> str:
+        if not self.workers:
+            return sha256(contents)
+        return await asyncio.to_thread(sha256, contents)
+
+    async def image_hashes(
+        self, contents: bytes, img: Image.Image, hash_types: list[str] = HASH_TYPES
+    ) -> dict[str, str]:
+        """Perceptual hashes of `img`, decoded from `contents`."""
+        if not self.workers:
+            return image_hashes(img, hash_types)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._get_executor(), _image_hashes_from_bytes, contents, hash_types
+            )
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Don't fork: the parent may run threads (e.g. Selenium)
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from PIL import Image, ImageOps
+
+# Formats whose `save` takes a quality
+_LOSSY_FORMATS = ("JPEG", "WEBP")
+
+
+def encode_image(
+    contents: bytes, max_edge: int | None, image_format: str, quality: int
+) -> tuple[bytes, str]:
+    """Downscale the image in `contents` to at most `max_edge` pixels on its longest
+    edge, and re-encode it as `image_format` (upright, as EXIF orientation is
+    lost). Return the encoded image and its
+    format, or `contents` if re-encoding it without resizing makes it larger."""
+    img = Image.open(io.BytesIO(contents))
+    original_format = img.format
+    resize = max_edge is not None and max(img.size) > max_edge
+    if not resize and original_format == image_format:
+        return contents, original_format
+    img = ImageOps.exif_transpose(img)
+    if resize:
+        img.thumbnail((max_edge, max_edge))
+    if image_format == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    elif image_format == "WEBP" and img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA")
+    out = io.BytesIO()
+    if image_format in _LOSSY_FORMATS:
+        img.save(out, format=image_format, quality=quality)
+    else:
+        img.save(out, format=image_format)
+    encoded = out.getvalue()
+    if not resize and len(encoded) >= len(contents):
+        return contents, original_format
+    return encoded, image_format
+
+
+class ImageEncoder:
+    """Makes images smaller before sending them to an LLM (see `encode_image`).
+
+    Images are encoded in a pool of `workers` threads (PIL releases the GIL while
+    decoding, resizing and encoding), or the default executor of the event loop.
+    The last `cache_size` encoded images are kept by sha256 of the original, so
+    that filters sharing the encoder (see `get_image_encoder`) only encode an image
+    once. Counts the bytes of the original (`bytes_in`) and encoded (`bytes_out`)
+    images."""
+
+    def __init__(
+        self,
+        max_edge: int | None = None,
+        image_format: str = "JPEG",
+        quality: int = 85,
+        workers: int | None = None,
+        cache_size: int = 256,
+    ):
+        self.max_edge = max_edge
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self._executor = ThreadPoolExecutor(workers) if workers else None
+        self._cache_size = cache_size
+        self._cache: OrderedDict[str, tuple[bytes, str]] = OrderedDict()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def settings(self) -> dict[str, Any]:
+        """What changes the encoded images, e.g. for cache keys."""
+        return {
+            "max_edge": self.max_edge,
+            "image_format": self.image_format,
+            "quality": self.quality,
+        }
+
+    async def encode(
+        self, contents: bytes, sha256: str | None = None
+    ) -> tuple[bytes, str]:
+        """Return the encoded image and its PIL format. `sha256`: of `contents`,
+        if known."""
+        key = sha256 or hashlib.sha256(contents).hexdigest()
+        if (encoded := self._cache.get(key)) is None:
+            loop = asyncio.get_running_loop()
+            encoded = await loop.run_in_executor(
+                self._executor,
+                encode_image,
+                contents,
+                self.max_edge,
+                self.image_format,
+                self.quality,
+            )
+            self._cache[key] = encoded
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        self.bytes_in += len(contents)
+        self.bytes_out += len(encoded[0])
+        return encoded
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+_image_encoders: dict[tuple, ImageEncoder] = {}
+
+
+def get_image_encoder(
+    max_edge: int | None = None,
+    image_format: str = "JPEG",
+    quality: int = 85,
+    workers: int | None = None,
+) -> ImageEncoder:
+    """The image encoder with these settings shared by the process."""
+    key = (max_edge, image_format.upper(), quality)
+    if key not in _image_encoders:
+        _image_encoders[key] = ImageEncoder(
+            max_edge, image_format, quality, workers=workers
+        )
+    return _image_encoders[key]
@@ -1,3 +1,4 @@
+import contextlib
 import os
 import random
 import tempfile
@@ -6,6 +7,7 @@ import exrex
 import httpx
 
 from similar_images.bing_selenium import BingSelenium
+from similar_images.download_cache import CachingTransport, DownloadCache
 from similar_images.types import RunConfiguration
 from similar_images.utils import get_urls_or_files
 
@@ -13,8 +15,11 @@ from similar_images.utils import get_urls_or_files
 class ImageSource:
     """Return URLs or paths to images."""
 
-    def get_client(self):
-        return httpx.AsyncClient(follow_redirects=True, timeout=30)
+    def get_client(self, download_cache: DownloadCache | None = None):
+        transport = None
+        if download_cache is not None:
+            transport = CachingTransport(download_cache)
+        return httpx.AsyncClient(follow_redirects=True, timeout=30, transport=transport)
 
     async def batches(self):
         raise NotImplementedError()
@@ -41,8 +46,9 @@ class BrowserQuerySource(ImageSource):
             yield query
 
     async def images(self, batch: str):
-        async for url in self._browser.search_images(batch):
-            yield url
+        async with contextlib.aclosing(self._browser.search_images(batch)) as urls:
+            async for url in urls:
+                yield url
 
 
 class BrowserImageSource(ImageSource):
@@ -64,8 +70,11 @@ class BrowserImageSource(ImageSource):
             yield path
 
     async def images(self, batch: str):
-        async for url in self._browser.search_similar_images(batch):
-            yield url
+        async with contextlib.aclosing(
+            self._browser.search_similar_images(batch)
+        ) as urls:
+            async for url in urls:
+                yield url
 
 
 class FakeClient:
@@ -77,6 +86,10 @@ class FakeClient:
                 request=httpx.Request(method="GET", url=f"file://{url}"),
             )
 
+    @contextlib.asynccontextmanager
+    async def stream(self, method: str, url: str, *args, **kwargs):
+        yield await self.get(url)
+
 
 class LocalFileImageSource(ImageSource):
     """Returns paths to the local file system.
@@ -88,8 +101,8 @@ class LocalFileImageSource(ImageSource):
         self._local_paths = local_paths
         self._random = random
 
-    def get_client(self):
-        return FakeClient()
+    def get_client(self, download_cache: DownloadCache | None = None):
+        return FakeClient()  # nothing to cache
 
     async def batches(self):
         paths = self._local_paths
@@ -0,0 +1,80 @@
+import asyncio
+
+from similar_images.hash_index import near_duplicate_hash
+
+# Of a link: whether it was stored in the database, and the code of its outcome
+# (None if it was not processed to the end, e.g. cancelled)
+type Outcome = tuple[bool, str | None]
+# (field, value, future) of a claimed reservation
+type Claim = tuple[str, str | dict[str, str], asyncio.Future[Outcome]]
+
+
+class InFlight:
+    """Reservations of the links being processed concurrently, by "url",
+    "hashstr" (sha256) or perceptual "hashes".
+
+    The database only knows about a link once it has gone through all filters. Until
+    then, the first link to claim a value holds it, and later links with the same
+    value (or, for hashes, within `max_distance` bits) wait for its outcome. If it
+    was stored in the database, they are duplicates of it. Otherwise, links with the
+    same URL or sha256 get the same outcome (e.g. too small), without being
+    processed again. Near-duplicates, which are other images, and links waiting for
+    a link that was not processed to the end go on as if it had never been seen.
+    """
+
+    def __init__(self, max_distance: int = 2):
+        self._max_distance = max_distance
+        self._keys: dict[tuple[str, str], asyncio.Future[Outcome]] = {}
+        self._hashes: list[tuple[dict[str, str], asyncio.Future[Outcome]]] = []
+
+    def __len__(self) -> int:
+        return len(self._keys) + len(self._hashes)
+
+    async def claim(
+        self, field: str, value: str | dict[str, str], claims: list[Claim]
+    ) -> Outcome | None:
+        """Reserve `value` of `field` and add it to `claims`, after waiting for the
+        link holding it, if any. Return None if reserved, or the outcome of the link
+        holding it to reuse."""
+        while (holder := self._holder(field, value)) is not None:
+            # Don't cancel the holder's future when cancelled
+            stored, code = await asyncio.shield(holder)
+            if stored or (code is not None and field != "hashes"):
+                return (stored, code)
+        future = asyncio.get_running_loop().create_future()
+        if field == "hashes":
+            self._hashes.append((value, future))
+        else:
+            self._keys[(field, value)] = future
+        claims.append((field, value, future))
+        return None
+
+    def release(
+        self, claims: list[Claim], stored: bool, code: str | None = None
+    ) -> None:
+        """Release `claims`, telling waiting links whether the link was stored, and
+        the `code` of its outcome."""
+        for field, value, future in claims:
+            if field == "hashes":
+                self._hashes = [(h, f) for h, f in self._hashes if f is not future]
+            elif self._keys.get((field, value)) is future:
+                del self._keys[(field, value)]
+            if not future.done():
+                future.set_result((stored, code))
+        claims.clear()
+
+    def clear(self) -> None:
+        """Release all reservations, e.g. of links cancelled while in flight."""
+        claims = [(field, value, f) for (field, value), f in self._keys.items()]
+        claims += [("hashes", h, f) for h, f in self._hashes]
+        self.release(claims, stored=False)
+
+    def _holder(
+        self, field: str, value: str | dict[str, str]
+    ) -> asyncio.Future[Outcome] | None:
+        if field == "hashes":
+            for hashes, future in self._hashes:
+                if near_duplicate_hash(hashes, value, self._max_distance):
+                    return future
+            return None
+        return self._keys.get((field, value))
@@ -0,0 +1,149 @@
+import asyncio
+import time
+from collections import deque
+
+# Budgets are per minute
+_WINDOW = 60
+# After a 429, send at most this fraction of the requests sent in the last minute
+_THROTTLE_FACTOR = 0.8
+# Weight of the last request in the estimate of tokens per request
+_TOKENS_ALPHA = 0.2
+
+
+class TokenBucket:
+    """`rate` units per minute, refilled continuously, in bursts of at most a
+    minute's worth."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._level = rate
+        self._ts = time.monotonic()
+
+    def level(self) -> float:
+        now = time.monotonic()
+        self._level = min(
+            self.rate, self._level + (now - self._ts) * self.rate / _WINDOW
+        )
+        self._ts = now
+        return self._level
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available (at most the whole bucket)."""
+        missing = min(amount, self.rate) - self.level()
+        return max(0.0, missing * _WINDOW / self.rate)
+
+    def take(self, amount: float) -> None:
+        """Take `amount`, possibly going into debt."""
+        self._level = self.level() - amount
+
+    def set_rate(self, rate: float) -> None:
+        self._level = min(self.level(), rate)
+        self.rate = rate
+
+
+class RateLimiter:
+    """Requests per minute (`rpm`) and tokens per minute (`tpm`) budgets of a
+    model, shared by all the requests of the process (see `get_rate_limiter`).
+
+    Tokens used by a request are only known from its response: `acquire`
+    reserves the average number of tokens of the last requests, and `record`
+    corrects it. A 429 response (`throttle`) pauses all requests, and lowers
+    the requests budget below the rate that hit the quota. Successful requests
+    raise it back, by one request per minute each, up to `rpm` if set."""
+
+    def __init__(self, rpm: float | None = None, tpm: float | None = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = TokenBucket(rpm) if rpm else None
+        self._tokens = TokenBucket(tpm) if tpm else None
+        self._tokens_per_request = 0.0
+        self._paused_until = 0.0
+        self._sent: deque[float] = deque()
+        self.waited = 0.0  # seconds spent waiting in `acquire`
+        self.throttled = 0  # number of 429 responses
+
+    def configure(self, rpm: float | None = None, tpm: float | None = None) -> None:
+        if rpm:
+            self.rpm = rpm
+            if self._requests is None:
+                self._requests = TokenBucket(rpm)
+            else:
+                self._requests.set_rate(min(rpm, self._requests.rate))
+        if tpm:
+            self.tpm = tpm
+            if self._tokens is None:
+                self._tokens = TokenBucket(tpm)
+            else:
+                self._tokens.set_rate(tpm)
+
+    def wait_time(self) -> float:
+        """Seconds until a request fits in the budgets."""
+        delay = self._paused_until - time.monotonic()
+        if self._requests is not None:
+            delay = max(delay, self._requests.wait_time(1))
+        if self._tokens is not None:
+            delay = max(delay, self._tokens.wait_time(self._tokens_per_request))
+        return delay
+
+    async def acquire(self) -> float:
+        """Wait for a request to fit in the budgets, and reserve it. Return the
+        tokens reserved, for `record`."""
+        while (delay := self.wait_time()) > 0:
+            self.waited += delay
+            await asyncio.sleep(delay)
+        now = time.monotonic()
+        self._sent.append(now)
+        while self._sent[0] < now - _WINDOW:
+            self._sent.popleft()
+        if self._requests is not None:
+            self._requests.take(1)
+        estimate = self._tokens_per_request
+        if self._tokens is not None:
+            self._tokens.take(estimate)
+        return estimate
+
+    def record(self, estimate: float, usage: dict[str, int] | None) -> None:
+        """Record a successful request, which used `usage` (its `usageMetadata`)
+        after `estimate` tokens were reserved."""
+        tokens = (usage or {}).get("totalTokenCount")
+        if tokens is not None:
+            if self._tokens is not None:
+                self._tokens.take(tokens - estimate)
+            if self._tokens_per_request:
+                self._tokens_per_request += _TOKENS_ALPHA * (
+                    tokens - self._tokens_per_request
+                )
+            else:
+                self._tokens_per_request = tokens
+        if self._requests is not None and (
+            self.rpm is None or self._requests.rate < self.rpm
+        ):
+            rate = self._requests.rate + 1
+            self._requests.set_rate(min(rate, self.rpm) if self.rpm else rate)
+
+    def throttle(self, pause: float) -> None:
+        """Record a 429 response: pause all requests for `pause` seconds."""
+        self.throttled += 1
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + pause)
+        sent = sum(1 for ts in self._sent if ts >= now - _WINDOW)
+        rate = max(1.0, _THROTTLE_FACTOR * sent)
+        if self._requests is None:
+            self._requests = TokenBucket(rate)
+        elif rate < self._requests.rate:
+            self._requests.set_rate(rate)
+
+
+_rate_limiters: dict[str, RateLimiter] = {}
+
+
+def get_rate_limiter(
+    model: str, rpm: float | None = None, tpm: float | None = None
+) -> RateLimiter:
+    """The rate limiter of `model` shared by the process, with budgets `rpm` and
+    `tpm` if given."""
+    if model not in _rate_limiters:
+        _rate_limiters[model] = RateLimiter()
+    rate_limiter = _rate_limiters[model]
+    rate_limiter.configure(rpm, tpm)
+    return rate_limiter
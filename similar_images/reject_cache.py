@@ -0,0 +1,79 @@
+import sqlite3
+import time
+
+from similar_images.types import RejectCacheConfiguration
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rejects (
+    url TEXT PRIMARY KEY,
+    reason TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    expires REAL NOT NULL
+);
+"""
+
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_ERR_TTL = 24 * 3600
+
+
+class Reject:
+    def __init__(self, reason: str, size: tuple[int, int] | None, expires: float):
+        self.reason = reason
+        self.size = size
+        self.expires = expires
+
+
+class RejectCache:
+    """URLs rejected before the expensive filters (which the database doesn't
+    remember), in an SQLite file: the reason (stat name of the filter, or "err"),
+    the size of the image if known, and when to forget it: after `ttl` seconds,
+    or `err_ttl` seconds for errors, which may be transient."""
+
+    def __init__(
+        self, filename: str, ttl: float = DEFAULT_TTL, err_ttl: float = DEFAULT_ERR_TTL
+    ):
+        self.filename = str(filename)
+        self.ttl = ttl
+        self.err_ttl = err_ttl
+        self._conn = sqlite3.connect(self.filename)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM rejects").fetchone()[0]
+
+    def get(self, url: str) -> Reject | None:
+        row = self._conn.execute(
+            "SELECT reason, width, height, expires FROM rejects WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        reason, width, height, expires = row
+        if expires < time.time():
+            return None
+        return Reject(reason, (width, height) if width is not None else None, expires)
+
+    def put(self, url: str, reason: str, size: tuple[int, int] | None = None) -> None:
+        ttl = self.err_ttl if reason == "err" else self.ttl
+        width, height = size if size is not None else (None, None)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO rejects (url, reason, width, height, expires) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (url, reason, width, height, time.time() + ttl),
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def get_reject_cache(
+    filename: str, config: RejectCacheConfiguration | None = None
+) -> RejectCache:
+    config = config or RejectCacheConfiguration()
+    return RejectCache(
+        filename,
+        ttl=config.ttl if config.ttl is not None else DEFAULT_TTL,
+        err_ttl=config.err_ttl if config.err_ttl is not None else DEFAULT_ERR_TTL,
+    )
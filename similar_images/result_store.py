@@ -0,0 +1,528 @@
+import datetime
+import re
+import sys
+from array import array
+from typing import Any
+
+import numpy as np
+
+from similar_images.hash_index import HASH_TYPES, HammingIndex, KeyIndex
+from similar_images.types import Result
+
+_SHA256_RE = re.compile("[0-9a-f]{64}")
+_HASHES_RE = re.compile("[0-9a-f]{16}(?:,[0-9a-f]{16})*")
+_HASH_TYPES = frozenset(HASH_TYPES)
+_MASK64 = (1 << 64) - 1
+_NO_TS = -(2**63)
+_NO_QUERY = -1
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+_HAS_HASHES = 1
+_RAW = 2
+_BAD_QUERY = -2
+# Appended records are stored by chunks of this many, or one by one when there are
+# fewer than _MIN_BULK_SIZE
+_CHUNK_SIZE = 1 << 16
+_MIN_BULK_SIZE = 64
+# Value of each hex digit by ASCII code, and 16 for other characters
+_HEX_VALUES = np.full(256, 16, dtype=np.uint8)
+_HEX_VALUES[np.frombuffer(b"0123456789abcdef", dtype=np.uint8)] = np.arange(16)
+# Timestamps in this format (with or without microseconds) are parsed by NumPy
+_TS_FORMAT = np.frombuffer(b"0000-00-00T00:00:00.000000", dtype=np.uint8)
+
+
+def _key(value: str) -> int:
+    return hash(value) & _MASK64
+
+
+def _keys(values: list[str]) -> np.ndarray:
+    """`_key` of all `values`."""
+    keys = np.fromiter(map(hash, values), dtype=np.int64, count=len(values))
+    return keys.view(np.uint64)
+
+
+def _prefix_key(value: bytes, pad: bytes = b"\0") -> int:
+    """The first 8 bytes of `value` as a big-endian integer, so that integers sort
+    like the strings."""
+    return int.from_bytes(value[:8].ljust(8, pad), "big")
+
+
+def _ts_to_micros(ts: datetime.datetime) -> int:
+    """Microseconds since the epoch of a naive datetime."""
+    return (ts - _EPOCH) // _MICROSECOND
+
+
+def _micros_to_ts(micros: int) -> datetime.datetime:
+    return _EPOCH + micros * _MICROSECOND
+
+
+def _encode_ts(ts: Any) -> int | None:
+    """Microseconds since the epoch, `_NO_TS` for None, or None if `ts` can't be
+    stored as an integer."""
+    if ts is None:
+        return _NO_TS
+    if isinstance(ts, str):
+        try:
+            ts = datetime.datetime.fromisoformat(ts)
+        except ValueError:
+            return None
+    if not isinstance(ts, datetime.datetime) or ts.tzinfo is not None:
+        return None
+    return _ts_to_micros(ts)
+
+
+def _compact_hashes(hashes: Any) -> bool:
+    """Whether `hashes` are all 64-bit, lower-case hex strings of known hash types."""
+    if hashes is None:
+        return True
+    if not isinstance(hashes, dict) or not hashes.keys() <= _HASH_TYPES:
+        return False
+    try:
+        return not hashes or bool(_HASHES_RE.fullmatch(",".join(hashes.values())))
+    except TypeError:  # not strings
+        return False
+
+
+def _encode_ts_column(values: list[Any]) -> tuple[np.ndarray, np.ndarray]:
+    """`_encode_ts` of all `values`: their encodings, and whether they could be
+    encoded.
+
+    Strings in `_TS_FORMAT` are parsed by NumPy, and only the other values one by
+    one."""
+    n = len(values)
+    encoded = np.full(n, _NO_TS, dtype=np.int64)
+    ok = np.ones(n, dtype=bool)
+    done = np.array([v is None for v in values], dtype=bool)
+    strings = np.flatnonzero([isinstance(v, str) for v in values])
+    lengths = np.fromiter(
+        map(len, _take(values, strings)), dtype=np.int64, count=len(strings)
+    )
+    for width in (19, 26):  # without and with microseconds
+        rows = strings[lengths == width]
+        texts = _take(values, rows)
+        chars = np.frombuffer("".join(texts).encode("ascii", "replace"), np.uint8)
+        chars = chars.reshape(len(rows), width)
+        template = _TS_FORMAT[:width]
+        canonical = np.where(
+            template == ord("0"), chars - np.uint8(ord("0")) < 10, chars == template
+        ).all(axis=1)
+        canonical &= (chars[:, :4] != ord("0")).any(axis=1)  # year 0 is invalid
+        rows = rows[canonical]
+        try:
+            micros = np.array(_take(values, rows), dtype="datetime64[us]")
+        except ValueError:  # e.g. day 31 of a 30-day month
+            continue
+        encoded[rows] = micros.astype(np.int64)
+        done[rows] = True
+    for i in np.flatnonzero(~done).tolist():
+        ts = _encode_ts(values[i])
+        if ts is None:
+            ok[i] = False
+        else:
+            encoded[i] = ts
+    return encoded, ok
+
+
+def _take(values: list[Any], rows: np.ndarray) -> list[Any]:
+    """`values` at `rows` (sorted)."""
+    if len(rows) == len(values):
+        return values
+    return [values[i] for i in rows.tolist()]
+
+
+def _hex_chars(texts: list[Any], width: int) -> np.ndarray:
+    """ASCII codes of `texts`, one row of `width` per text. Texts that are not strings
+    of `width` characters get a row of question marks."""
+    bad = "?" * width
+    try:
+        joined = "".join(texts)
+    except TypeError:  # not all strings
+        texts = [t if isinstance(t, str) else bad for t in texts]
+        joined = "".join(texts)
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    if (lengths != width).any():
+        joined = "".join(t if len(t) == width else bad for t in texts)
+    chars = np.frombuffer(joined.encode("ascii", "replace"), dtype=np.uint8)
+    return chars.reshape(len(texts), width)
+
+
+def _decode_hex(chars: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Bytes of rows of lower-case hex digits, and whether each row was valid (the
+    bytes of invalid rows are meaningless)."""
+    nibbles = _HEX_VALUES[chars]
+    if nibbles.max(initial=0) < 16:
+        valid = np.ones(len(chars), dtype=bool)
+    else:
+        valid = (nibbles < 16).all(axis=1)
+    return (nibbles[:, 0::2] << 4) | nibbles[:, 1::2], valid
+
+
+def _pack_hashes(
+    hashes: list[Any],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pack `hashes` as given to `HashMatrix.extend`, in the order of `HASH_TYPES`.
+
+    Also return whether each one is None or only has 64-bit, lower-case hex strings of
+    known hash types."""
+    n = len(hashes)
+    ok = np.array([h is None or isinstance(h, dict) for h in hashes], dtype=bool)
+    dicts = [h if isinstance(h, dict) else {} for h in hashes]
+    values = np.zeros((n, len(HASH_TYPES)), dtype=np.uint64)
+    present = np.zeros((n, len(HASH_TYPES)), dtype=bool)
+    for j, k in enumerate(HASH_TYPES):
+        column = [h.get(k) for h in dicts]
+        if column.count(None):
+            rows = np.flatnonzero([v is not None for v in column])
+        else:
+            rows = np.arange(n)
+        data, valid = _decode_hex(_hex_chars(_take(column, rows), 16))
+        values[rows, j] = data.view(">u8").reshape(len(rows))
+        present[rows, j] = valid
+        ok[rows[~valid]] = False
+    # Dicts with unknown hash types or None values have more keys than packed hashes
+    ok &= np.fromiter(map(len, dicts), dtype=np.int64, count=n) == present.sum(axis=1)
+    return values, present, ok
+
+
+def _sizeof(o: Any) -> int:
+    if isinstance(o, dict):
+        return sys.getsizeof(o) + sum(_sizeof(k) + _sizeof(v) for k, v in o.items())
+    if isinstance(o, list):
+        return sys.getsizeof(o) + sum(_sizeof(v) for v in o)
+    return sys.getsizeof(o)
+
+
+class ResultView:
+    """Read-only view of a record of a `ResultStore`.
+
+    Fields are decoded when they're accessed, and `to_result` returns a `Result`.
+    Views compare equal to `Result`s with the same fields."""
+
+    __slots__ = ("_store", "_pos")
+
+    def __init__(self, store: "ResultStore", pos: int):
+        self._store = store
+        self._pos = pos
+
+    @property
+    def url(self) -> str:
+        return self._store.url(self._pos)
+
+    @property
+    def hashstr(self) -> str:
+        return self._store.hashstr(self._pos)
+
+    @property
+    def ts(self) -> datetime.datetime | None:
+        return self._store.ts(self._pos)
+
+    @property
+    def path(self) -> str | None:
+        return None
+
+    @property
+    def query(self) -> str | None:
+        return self._store.query(self._pos)
+
+    @property
+    def hashes(self) -> dict[str, str] | None:
+        return self._store.hashes(self._pos)
+
+    def to_result(self) -> Result:
+        return self._store.result(self._pos)
+
+    def dump(self) -> str:
+        return self.to_result().dump()
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, ResultView):
+            other = other.to_result()
+        if isinstance(other, Result):
+            return self.to_result() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"ResultView({self.to_result()!r})"
+
+
+class ResultStore:
+    """Compact, column-oriented, in-memory storage of `Result`s.
+
+    URLs are concatenated in one buffer, the sha256 (`hashstr`) takes 32 bytes,
+    timestamps are 64-bit integers, queries are interned, and hashes are packed as
+    64-bit integers in the near-duplicate index. Records that don't fit these columns
+    (e.g. a `hashstr` that is not a sha256, a timezone-aware or invalid timestamp) are
+    kept as they are, and only validated when they are turned into `Result`s.
+
+    URL and hashstr lookups go through `KeyIndex`es of the values' hashes, so the
+    store doesn't keep a string object per record. Another `KeyIndex`, of the first
+    8 bytes of hashstrs, looks up hashstrs by prefix.
+    Records are identified by their position, and handed out as `ResultView`s.
+
+    Appended records are stored and indexed by `commit`, which lookups call first.
+    It works column by column with NumPy, and only falls back to going one by one
+    for records that don't fit the columns, so committing many records at once does
+    little work per record.
+    """
+
+    def __init__(self, near_dup_distance: int = 2):
+        self._urls = bytearray()
+        self._url_ends = array("Q")
+        self._sha256 = bytearray()  # 32 bytes per record
+        self._ts = array("q")
+        self._query_ids = array("i")
+        self._queries: list[str] = []
+        self._query_index: dict[str, int] = {}
+        self._flags = bytearray()
+        self._raw: dict[int, dict[str, Any]] = {}
+        self._near_dup_index = HammingIndex(max_distance=near_dup_distance)
+        self._key_indexes = {
+            "url": KeyIndex(np.zeros(0, dtype=np.uint64)),
+            "hashstr": KeyIndex(np.zeros(0, dtype=np.uint64)),
+        }
+        self._prefix_index = KeyIndex(np.zeros(0, dtype=np.uint64))
+        # Appended records, not stored yet
+        self._pending: list[dict[str, Any]] = []
+        # Keys and packed hashes of stored chunks of records, not indexed yet
+        self._unindexed: list[dict[str, np.ndarray]] = []
+        self._unindexed_hashes: list[tuple[int, dict[str, str]]] = []
+
+    def __len__(self) -> int:
+        return len(self._flags) + len(self._pending)
+
+    def append(self, record: Result | ResultView | dict[str, Any]) -> int:
+        """Add a record, and return its position. It is stored by the next `commit`."""
+        if not isinstance(record, dict):
+            record = {
+                "url": record.url,
+                "hashstr": record.hashstr,
+                "ts": record.ts,
+                "query": record.query,
+                "hashes": record.hashes,
+            }
+        self._pending.append(record)
+        if len(self._pending) >= _CHUNK_SIZE:
+            self._store_pending()
+        return len(self) - 1
+
+    def commit(self) -> None:
+        """Store and index the appended records."""
+        if len(self._pending) >= _MIN_BULK_SIZE:
+            self._store_pending()
+        if self._unindexed:
+            self._index_stored()
+        records, self._pending = self._pending, []
+        for record in records:
+            self._store_record(record)
+
+    def _index_stored(self) -> None:
+        """Index the records stored by `_store_pending`."""
+        chunks, self._unindexed = self._unindexed, []
+        end = len(self._flags)
+        start = end - sum(len(chunk["url"]) for chunk in chunks)
+        positions = np.arange(start, end, dtype=np.uint32)
+
+        def column(name: str) -> np.ndarray:
+            return np.concatenate([chunk[name] for chunk in chunks])
+
+        for field, index in self._key_indexes.items():
+            index.extend(column(field), positions)
+        self._prefix_index.extend(column("prefix"), positions)
+        self._near_dup_index.extend_packed(column("hashes"), column("present"))
+        for pos, hashes in self._unindexed_hashes:
+            self._near_dup_index.add(pos, hashes)
+        self._unindexed_hashes = []
+
+    def _store_record(self, record: dict[str, Any]) -> None:
+        """Store and index a record on its own."""
+        url, hashstr = record["url"], record["hashstr"]
+        ts, query, hashes = record.get("ts"), record.get("query"), record.get("hashes")
+        pos = len(self._flags)
+        self._urls += url.encode("utf-8")
+        self._url_ends.append(len(self._urls))
+        encoded_ts = _encode_ts(ts)
+        if (
+            _SHA256_RE.fullmatch(hashstr)
+            and encoded_ts is not None
+            and (query is None or isinstance(query, str))
+            and _compact_hashes(hashes)
+        ):
+            self._sha256 += bytes.fromhex(hashstr)
+            self._ts.append(encoded_ts)
+            self._query_ids.append(self._intern(query))
+            self._flags.append(_HAS_HASHES if hashes is not None else 0)
+        else:
+            self._raw[pos] = record
+            if isinstance(hashes, dict):  # not validated yet
+                hashes = {k: h for k, h in hashes.items() if isinstance(h, str)}
+            else:
+                hashes = None
+            self._sha256 += bytes(32)
+            self._ts.append(_NO_TS)
+            self._query_ids.append(_NO_QUERY)
+            self._flags.append(_RAW)
+        self._key_indexes["url"].add(_key(url), pos)
+        self._key_indexes["hashstr"].add(_key(hashstr), pos)
+        self._prefix_index.add(_prefix_key(hashstr.encode("utf-8")), pos)
+        self._near_dup_index.add(pos, hashes or {})
+
+    def _store_pending(self) -> None:
+        """Store the appended records in the columns, or as they are if they don't
+        fit, and keep what `commit` needs to index them."""
+        records, self._pending = self._pending, []
+        if not records:
+            return
+        start = len(self._flags)
+        n = len(records)
+        urls = [r["url"] for r in records]
+        hashstrs = [r["hashstr"] for r in records]
+        hashes = [r.get("hashes") for r in records]
+
+        joined = "".join(urls)
+        data = joined.encode("utf-8")
+        if len(data) == len(joined):  # ASCII
+            lengths = np.fromiter(map(len, urls), dtype=np.uint64, count=n)
+        else:
+            lengths = np.array([len(url.encode("utf-8")) for url in urls], np.uint64)
+        self._url_ends.frombytes((np.cumsum(lengths) + len(self._urls)).tobytes())
+        self._urls += data
+
+        chars = _hex_chars(hashstrs, 64)
+        sha256, ok = _decode_hex(chars)
+        prefix_keys = chars[:, :8].copy().view(">u8").reshape(n).astype(np.uint64)
+        for i in np.flatnonzero(~ok).tolist():
+            prefix_keys[i] = _prefix_key(hashstrs[i].encode("utf-8"))
+        ts, ts_ok = _encode_ts_column([r.get("ts") for r in records])
+        query_ids = np.array(
+            [
+                self._intern(q) if q is None or isinstance(q, str) else _BAD_QUERY
+                for q in (r.get("query") for r in records)
+            ],
+            dtype=np.int32,
+        )
+        values, present, hashes_ok = _pack_hashes(hashes)
+        ok &= ts_ok & (query_ids != _BAD_QUERY) & hashes_ok
+        has_hashes = np.array([h is not None for h in hashes], dtype=bool)
+
+        sha256[~ok] = 0
+        ts[~ok] = _NO_TS
+        query_ids[~ok] = _NO_QUERY
+        present[~ok] = False
+        self._sha256 += sha256.tobytes()
+        self._ts.frombytes(ts.tobytes())
+        self._query_ids.frombytes(query_ids.tobytes())
+        flags = np.where(has_hashes, _HAS_HASHES, 0)
+        self._flags += np.where(ok, flags, _RAW).astype(np.uint8).tobytes()
+        for i in np.flatnonzero(~ok).tolist():
+            self._raw[start + i] = records[i]
+            if isinstance(hashes[i], dict):  # not validated yet
+                strings = {k: h for k, h in hashes[i].items() if isinstance(h, str)}
+                self._unindexed_hashes.append((start + i, strings))
+        self._unindexed.append(
+            {
+                "url": _keys(urls),
+                "hashstr": _keys(hashstrs),
+                "prefix": prefix_keys,
+                "hashes": values,
+                "present": present,
+            }
+        )
+
+    def get(self, field: str, value: str) -> ResultView | None:
+        """Return the last record with `field` equal to `value`."""
+        self.commit()
+        if field not in self._key_indexes:
+            return None
+        for pos in self._key_indexes[field].positions(_key(value)):
+            if getattr(self, field)(pos) == value:
+                return ResultView(self, pos)
+        return None
+
+    def get_by_hashstr_prefix(self, prefix: str) -> ResultView | None:
+        """Return the first record whose hashstr starts with `prefix`."""
+        self.commit()
+        data = prefix.encode("utf-8")
+        lo, hi = _prefix_key(data), _prefix_key(data, pad=b"\xff")
+        for pos in self._prefix_index.between(lo, hi).tolist():
+            if self.hashstr(pos).startswith(prefix):
+                return ResultView(self, pos)
+        return None
+
+    def near_duplicate(
+        self, hashes: dict[str, str], max_distance: int
+    ) -> ResultView | None:
+        self.commit()
+        pos = self._near_dup_index.find(hashes, max_distance)
+        return ResultView(self, pos) if pos is not None else None
+
+    def view(self, pos: int) -> ResultView:
+        self.commit()
+        return ResultView(self, pos)
+
+    def url(self, pos: int) -> str:
+        start = self._url_ends[pos - 1] if pos else 0
+        return self._urls[start : self._url_ends[pos]].decode("utf-8")
+
+    def hashstr(self, pos: int) -> str:
+        if pos in self._raw:
+            return self._raw[pos]["hashstr"]
+        return self._sha256[32 * pos : 32 * (pos + 1)].hex()
+
+    def ts(self, pos: int) -> datetime.datetime | None:
+        if pos in self._raw:
+            return self.result(pos).ts
+        ts = self._ts[pos]
+        return None if ts == _NO_TS else _micros_to_ts(ts)
+
+    def query(self, pos: int) -> str | None:
+        if pos in self._raw:
+            return self.result(pos).query
+        query_id = self._query_ids[pos]
+        return None if query_id == _NO_QUERY else self._queries[query_id]
+
+    def hashes(self, pos: int) -> dict[str, str] | None:
+        if pos in self._raw:
+            return self.result(pos).hashes
+        if not self._flags[pos] & _HAS_HASHES:
+            return None
+        return {k: f"{v:016x}" for k, v in self._near_dup_index.get(pos).items()}
+
+    def result(self, pos: int) -> Result:
+        self.commit()
+        if pos in self._raw:
+            return Result.model_validate(self._raw[pos])
+        return Result(
+            url=self.url(pos),
+            hashstr=self.hashstr(pos),
+            ts=self.ts(pos),
+            query=self.query(pos),
+            hashes=self.hashes(pos),
+        )
+
+    def memory_usage(self) -> dict[str, int]:
+        """Approximate number of bytes used by each part of the store."""
+        self.commit()
+        return {
+            "urls": sys.getsizeof(self._urls) + sys.getsizeof(self._url_ends),
+            "sha256": sys.getsizeof(self._sha256),
+            "ts": sys.getsizeof(self._ts),
+            "queries": sys.getsizeof(self._query_ids)
+            + _sizeof(self._queries)
+            + sys.getsizeof(self._query_index),
+            "flags": sys.getsizeof(self._flags),
+            "raw": _sizeof(self._raw),
+            "url_index": self._key_indexes["url"].nbytes(),
+            "hashstr_index": self._key_indexes["hashstr"].nbytes(),
+            "hashstr_prefix_index": self._prefix_index.nbytes(),
+            "near_dup_index": self._near_dup_index.nbytes(),
+        }
+
+    def _intern(self, query: str | None) -> int:
+        if query is None:
+            return _NO_QUERY
+        if query not in self._query_index:
+            self._query_index[query] = len(self._queries)
+            self._queries.append(query)
+        return self._query_index[query]
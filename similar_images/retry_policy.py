@@ -0,0 +1,76 @@
+import email.utils
+import random
+import time
+
+import httpx
+
+# Statuses worth retrying: timed out, rate limited, or unavailable
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+class RetryPolicy:
+    """When to retry a failed request, and how long to wait before.
+
+    Only timeouts, connection errors and `RETRY_STATUSES` are retried, up to
+    `tries` attempts, within `deadline` seconds per call (waits included) if set.
+    Waits follow exponential backoff with "decorrelated jitter": a random time
+    between `base_sleep` and 3 times the previous wait, up to `max_sleep`, or
+    longer if the server asks to with a Retry-After header.
+
+    Counts the `retries`, and the calls that `gave_up`."""
+
+    def __init__(
+        self,
+        tries: int = 5,
+        base_sleep: float = 1,
+        max_sleep: float = 60,
+        deadline: float | None = None,
+    ):
+        self.tries = tries
+        self.base_sleep = base_sleep
+        self.max_sleep = max_sleep
+        self.deadline = deadline
+        self.retries = 0
+        self.gave_up = 0
+
+    def retryable(self, ex: Exception) -> bool:
+        if isinstance(ex, httpx.HTTPStatusError):
+            return ex.response.status_code in RETRY_STATUSES
+        return isinstance(ex, httpx.TransportError)
+
+    def sleep_time(self, previous: float, ex: Exception) -> float:
+        """Seconds to wait after `ex`, `previous` seconds after the last failure
+        (0 after the first)."""
+        sleep = min(
+            self.max_sleep,
+            random.uniform(self.base_sleep, max(self.base_sleep, previous * 3)),
+        )
+        if isinstance(ex, httpx.HTTPStatusError):
+            retry_after = _retry_after(ex.response)
+            if retry_after is not None:
+                sleep = max(sleep, retry_after)
+        return sleep
+
+    def remaining(self, start: float) -> float | None:
+        """Seconds left before the deadline of a call started at `start` (from
+        `time.monotonic`), if any."""
+        if self.deadline is None:
+            return None
+        return max(0.0, start + self.deadline - time.monotonic())
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    """Seconds to wait from the Retry-After header of `response`: either a number
+    of seconds, or a date."""
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
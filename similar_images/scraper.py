@@ -1,23 +1,41 @@
 import asyncio
+import contextlib
 import datetime
-import hashlib
 import io
 import logging
 import re
+import time
 from collections import defaultdict
 from pathlib import Path
+from typing import Any
 
 import httpx
-import imagehash
-from PIL import Image
+from PIL import Image, ImageFile
 
-from similar_images.crappy_db import CrappyDB
-from similar_images.filters.filter import Filter
+from similar_images.database import Database
+from similar_images.download_cache import DownloadCache
+from similar_images.filters.cache_filters import RejectCacheFilter
+from similar_images.filters.db_filters import (
+    DbExactDupFilter,
+    DbFilter,
+    DbNearDupFilter,
+    DbUrlFilter,
+)
+from similar_images.filters.filter import Filter, FilterInput
+from similar_images.hash_index import HASH_TYPES
+from similar_images.hashing import Hasher
 from similar_images.image_sources import ImageSource
+from similar_images.in_flight import Claim, InFlight
+from similar_images.reject_cache import RejectCache
 from similar_images.types import Result
 
 logger = logging.getLogger()
 
+# Inputs known from the first bytes of an image (see `Scraper.stream`)
+_HEADER_INPUTS: set[FilterInput] = {"query", "url", "img"}
+# Stop looking for the image size after this many bytes
+_HEADER_MAX_BYTES = 1 << 16
+
 
 def _empty_stats(stage2filters: dict[str, list[Filter]]) -> dict[str, int]:
     ret: dict[str, int] = defaultdict(int)
@@ -94,174 +112,636 @@ async def _apply_filters(
     return (True, None)
 
 
+class _LinkInputs:
+    """Inputs of the filters for one downloaded link, computed when filters first
+    need them, and kept for the next filters.
+
+    With `profile`, `timings` holds the CPU time (of the event loop thread, in
+    seconds) spent on each derivation and each stage of filters."""
+
+    def __init__(
+        self,
+        hasher: Hasher,
+        query: str,
+        url: str,
+        contents: bytes,
+        profile: bool = False,
+        claims: list[Claim] | None = None,
+    ):
+        self._hasher = hasher
+        self.data: dict[str, Any] = {"query": query, "url": url, "contents": contents}
+        self.hashes: dict[str, str] = {}  # computed so far
+        self.claims: list[Claim] = claims if claims is not None else []  # in flight
+        self.stored = False  # in the database
+        self.timings: dict[str, float] | None = defaultdict(float) if profile else None
+
+    @contextlib.contextmanager
+    def timed(self, name: str):
+        if self.timings is None:
+            yield
+            return
+        start = time.thread_time()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.thread_time() - start
+
+    def img(self) -> Image.Image:
+        if "img" not in self.data:
+            with self.timed("img"):
+                self.data["img"] = Image.open(io.BytesIO(self.data["contents"]))
+        return self.data["img"]
+
+    async def hashstr(self) -> str:
+        if "hashstr" not in self.data:
+            with self.timed("sha256"):
+                # Get image "identity"
+                self.data["hashstr"] = await self._hasher.sha256(self.data["contents"])
+        return self.data["hashstr"]
+
+    async def add_hashes(self, hash_types: list[str]) -> None:
+        missing = [k for k in hash_types if k not in self.hashes]
+        if missing:
+            img = self.img()
+            with self.timed("hashes"):
+                self.hashes.update(
+                    await self._hasher.image_hashes(self.data["contents"], img, missing)
+                )
+        self.data["hashes"] = self.hashes
+
+    async def prepare(self, filters: list[Filter], debug: bool = False) -> None:
+        """Compute the inputs that `filters` need. With `debug`, also those needed to
+        dump rejected images."""
+        inputs: set[FilterInput] = set()
+        hash_types: list[str] = []
+        for filter in filters:
+            inputs |= filter.inputs()
+            if "hashes" in filter.inputs():
+                hash_types += filter.hash_types()
+        if debug and filters:
+            inputs |= {"hashstr", "img"}
+        if "hashstr" in inputs:
+            await self.hashstr()
+        if "img" in inputs:
+            self.img()
+        if "hashes" in inputs:
+            await self.add_hashes(hash_types)
+
+    async def apply_filters(
+        self, stage: str, filters: list[Filter], debug_outdir: str | None = None
+    ) -> tuple[bool, str | None]:
+        await self.prepare(filters, debug=bool(debug_outdir))
+        with self.timed(f"filters:{stage}"):
+            return await _apply_filters(
+                **self.data, filters=filters, debug_outdir=debug_outdir
+            )
+
+
+def _print_timings(timings: dict[str, float], links: int) -> str:
+    # "sha256:0.12ms img:0.05ms hashes:3.10ms filters:contents:0.02ms"
+    return " ".join(f"{k}:{1000 * v / max(links, 1):.2f}ms" for k, v in timings.items())
+
+
+class _Quota:
+    """Run-wide count of new images. Once `count` is reached, cancels the tracked
+    tasks (downloads, filters, the search for more links)."""
+
+    def __init__(self, count: int | None):
+        self.count = count
+        self.new = 0
+        self._tasks: set[asyncio.Task] = set()
+
+    def reached(self) -> bool:
+        return self.count is not None and self.new >= self.count
+
+    def track(self, task: asyncio.Task) -> None:
+        if self.reached():
+            task.cancel()
+            return
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def add_new(self) -> None:
+        self.new += 1
+        if self.reached():
+            current = asyncio.current_task()
+            for task in list(self._tasks):
+                if task is not current:
+                    task.cancel()
+
+
+# Stages of the pipeline (see `Scraper.stage_workers`)
+PIPELINE_STAGES = ("download", "hash", "expensive")
+
+
+async def _run_stage(
+    workers: int,
+    inputs: asyncio.Queue,
+    fn,
+    outputs: asyncio.Queue | None = None,
+    next_workers: int = 0,
+) -> None:
+    """Run `fn` on items of `inputs` in `workers` tasks until each of them gets None,
+    and put its results other than None in `outputs`. Then put None in `outputs`
+    for each of the `next_workers`."""
+
+    async def worker():
+        while (item := await inputs.get()) is not None:
+            result = await fn(item)
+            if result is not None and outputs is not None:
+                await outputs.put(result)
+
+    async with asyncio.TaskGroup() as tg:
+        for _ in range(workers):
+            tg.create_task(worker())
+    for _ in range(next_workers):
+        await outputs.put(None)
+
+
 class Scraper:
     def __init__(
         self,
         image_source: ImageSource,
         client: httpx.AsyncClient | None = None,
-        db: CrappyDB | None = None,
+        db: Database | None = None,
         filters: list[Filter] | None = None,
         outdir: str | None = None,
         debug_outdir: str | None = None,
         concurrency: int | None = None,
         count: int | None = None,
+        hash_workers: int | None = None,
+        hash_types: list[str] | None = None,
+        profile: bool = False,
+        stream: bool = False,
+        max_bytes: int | None = None,
+        stage_workers: dict[str, int] | None = None,
+        download_cache: DownloadCache | None = None,
+        reject_cache: RejectCache | None = None,
     ):
+        """`hash_types`: perceptual hashes to compute for every new image, e.g. to
+        store them in `db`, besides those the filters need. All of them by default
+        with a `db`, none without.
+
+        `stream`: stream downloads, and stop them as soon as the image is rejected:
+        on a text Content-Type (e.g. HTML error pages), on a Content-Length above
+        `max_bytes`, or by the "contents" filters that only need the image size
+        and format (e.g. `ImageFilter`), parsed from the first bytes.
+        `max_bytes`: reject larger downloads (as errors).
+
+        `stage_workers`: process links in a pipeline of stages (see
+        `PIPELINE_STAGES`), each with its own number of workers (by default,
+        `concurrency`): "download" filters on URLs and downloads, "hash" decodes,
+        hashes and runs the "contents" and "hashes" filters, "expensive" runs the
+        expensive filters (e.g. LLMs) and saves images. Stages are connected by
+        queues as long as the next stage has workers, so that at most a few
+        downloaded images wait in memory. Without `stage_workers`, each link goes
+        through all stages at once, `concurrency` links at a time.
+
+        `download_cache`: cache of downloads used by the client of `image_source`
+        (not by `client`).
+
+        `reject_cache`: remember the URLs rejected by the "contents" filters other
+        than database filters (e.g. too small images), or that failed, and skip
+        them (as "cache:reject") before downloading them, unless the filters that
+        only need the image size would now keep it.
+
+        `profile`: log the CPU time spent on each link (at debug level), and the
+        average per downloaded link after each query. Exact with `concurrency=1`
+        and no `hash_workers`; otherwise it includes other links processed
+        meanwhile on the event loop."""
         self.image_source = image_source
-        self.client = client or image_source.get_client()
+        self.client = client or image_source.get_client(download_cache)
         self.db = db
         self.outdir = outdir
         self.debug_outdir = debug_outdir
         self.stage2filters: dict[str, list[Filter]] = defaultdict(list)
         self.semaphore = asyncio.Semaphore(concurrency or 1)
         self.count = count
-        if filters:
-            for filter in filters:
-                self.stage2filters[filter.stage()].append(filter)
+        self.hasher = Hasher(hash_workers)
+        if hash_types is None:
+            hash_types = HASH_TYPES if db is not None else []
+        self.hash_types = hash_types
+        self.profile = profile
+        self.timings: dict[str, float] = defaultdict(float)  # with profile
+        self.profiled_links = 0
+        self.stream = stream
+        # Duplicates are also looked for among links in flight, by the database
+        # filters
+        self.in_flight = InFlight()
+        self.in_flight_filters: dict[str, Filter] = {}
+        for filter in filters or []:
+            match filter:
+                case DbUrlFilter():
+                    self.in_flight_filters["url"] = filter
+                case DbExactDupFilter():
+                    self.in_flight_filters["hashstr"] = filter
+                case DbNearDupFilter():
+                    self.in_flight_filters["hashes"] = filter
+        self.stage_workers: dict[str, int] | None = None
+        if stage_workers is not None:
+            assert set(stage_workers) <= set(PIPELINE_STAGES), stage_workers
+            self.stage_workers = {
+                stage: stage_workers.get(stage) or concurrency or 1
+                for stage in PIPELINE_STAGES
+            }
+        self.max_bytes = max_bytes
+        filters = filters or []
+        # Also run on the image header when streaming, and again on the image
+        self.header_filters = [
+            filter
+            for filter in filters
+            if filter.stage() == "contents" and filter.inputs() <= _HEADER_INPUTS
+        ]
+        self.reject_cache = reject_cache
+        if reject_cache is not None:
+            filters = [RejectCacheFilter(reject_cache, self.header_filters)] + filters
+        for filter in filters:
+            self.stage2filters[filter.stage()].append(filter)
+        # Rejections remembered by reject_cache
+        self.cached_rejects = {"err"} | {
+            filter.stat_name()
+            for filter in self.stage2filters["contents"]
+            if not isinstance(filter, DbFilter)
+        }
 
     def sync_scrape(self) -> set[str]:
         return asyncio.run(self.async_scrape())
 
     async def async_scrape(self) -> set[str]:
+        try:
+            return await self._async_scrape()
+        finally:
+            self.hasher.close()
+
+    async def _async_scrape(self) -> set[str]:
         downloaded_links: set[str] = set()
         run_stats = _empty_stats(self.stage2filters)
+        self.quota = _Quota(self.count)
         q = 0
         async for query in self.image_source.batches():
             q += 1
             q_stats = _empty_stats(self.stage2filters)
+            filter_stats = self._filter_stats()
             try:
-                async with asyncio.TaskGroup() as tg:
-                    async for link in self.image_source.images(query):
-                        tg.create_task(
-                            self.process_link_task(
-                                link, query, downloaded_links, q_stats
-                            )
-                        )
+                if self.stage_workers is not None:
+                    await self.scrape_pipeline(query, downloaded_links, q_stats)
+                else:
+                    await self.scrape_tasks(query, downloaded_links, q_stats)
             except Exception as ex:
                 logger.warning(f"Exception while processing {query=}: {type(ex)} {ex}")
+            finally:
+                # Links cancelled in flight
+                self.in_flight.clear()
+            for stat_name, count in self._filter_stats().items():
+                q_stats[stat_name] += count - filter_stats[stat_name]
             logger.info(f"Done {query=} | {_print_stats(q_stats)}")
             _add_stats(run_stats, q_stats)
             logger.info(f"Cumulative n={q} | {_print_stats(run_stats)}")
-            if self.count is not None and len(downloaded_links) >= self.count:
+            if self.profile:
+                timings = _print_timings(self.timings, self.profiled_links)
+                logger.info(f"CPU per link n={self.profiled_links} | {timings}")
+            if self.db is not None:
+                self.db.flush()
+            if self.quota.reached():
                 break  # collected enough images
         return downloaded_links
 
+    def _filter_stats(self) -> dict[str, int]:
+        stats: dict[str, int] = defaultdict(int)
+        for filters in self.stage2filters.values():
+            for filter in filters:
+                _add_stats(stats, filter.stats())
+        return stats
+
+    async def scrape_tasks(
+        self, query: str, downloaded_links: set[str], q_stats: dict[str, int]
+    ) -> None:
+        """Process each link of `query` in its own task."""
+        async with asyncio.TaskGroup() as tg:
+
+            async def produce() -> None:
+                async with contextlib.aclosing(self.image_source.images(query)) as urls:
+                    async for link in urls:
+                        self.quota.track(
+                            tg.create_task(
+                                self.process_link_task(
+                                    link, query, downloaded_links, q_stats
+                                )
+                            )
+                        )
+
+            self.quota.track(tg.create_task(produce()))
+
     async def process_link_task(
         self, link: str, query: str, downloaded_links: set[str], q_stats: dict[str, int]
     ) -> None:
         async with self.semaphore:
-            if self.count is not None and q_stats["new"] >= self.count:
+            if self.quota.reached():
                 return  # collected enough images
             link, code = await self.process_link(link, query)
-            q_stats["links"] += 1
-            if link:
-                downloaded_links.add(link)
-            if code:
-                q_stats[code] += 1
+            self._count_link(link, code, downloaded_links, q_stats)
+
+    def _count_link(
+        self,
+        link: str | None,
+        code: str,
+        downloaded_links: set[str],
+        q_stats: dict[str, int],
+    ) -> None:
+        q_stats["links"] += 1
+        if link:
+            downloaded_links.add(link)
+        if code:
+            q_stats[code] += 1
+        if code == "new":
+            self.quota.add_new()
+
+    async def scrape_pipeline(
+        self, query: str, downloaded_links: set[str], q_stats: dict[str, int]
+    ) -> None:
+        """Process the links of `query` through the stages of the pipeline."""
+        workers = self.stage_workers
+        links: asyncio.Queue[str | None] = asyncio.Queue(workers["download"])
+        fetched: asyncio.Queue[_LinkInputs | None] = asyncio.Queue(workers["hash"])
+        filtered: asyncio.Queue[_LinkInputs | None] = asyncio.Queue(
+            workers["expensive"]
+        )
+
+        def done(link: str | None, code: str) -> None:
+            self._count_link(link, code, downloaded_links, q_stats)
+
+        async def produce() -> None:
+            async with contextlib.aclosing(self.image_source.images(query)) as urls:
+                async for link in urls:
+                    await links.put(link)
+            for _ in range(workers["download"]):
+                await links.put(None)
+
+        async def fetch(link: str) -> _LinkInputs | None:
+            if self.quota.reached():
+                return None  # collected enough images
+            inputs, code = await self.fetch_link(link, query)
+            if inputs is None:
+                done(None, code)
+            return inputs
+
+        async def filter(inputs: _LinkInputs) -> _LinkInputs | None:
+            keep, code = await self.filter_link(inputs)
+            if keep:
+                return inputs
+            done(*self._done(inputs, (None, code)))
+            return None
+
+        async def finish(inputs: _LinkInputs) -> None:
+            done(*self._done(inputs, await self.finish_link(inputs)))
+
+        async with asyncio.TaskGroup() as tg:
+            for coro in [
+                produce(),
+                _run_stage(workers["download"], links, fetch, fetched, workers["hash"]),
+                _run_stage(
+                    workers["hash"], fetched, filter, filtered, workers["expensive"]
+                ),
+                _run_stage(workers["expensive"], filtered, finish),
+            ]:
+                self.quota.track(tg.create_task(coro))
 
     async def process_link(self, link: str, query: str) -> tuple[str | None, str]:
+        inputs, code = await self.fetch_link(link, query)
+        if inputs is None:
+            return (None, code)
+        keep, code = await self.filter_link(inputs)
+        if not keep:
+            return self._done(inputs, (None, code))
+        return self._done(inputs, await self.finish_link(inputs))
+
+    async def fetch_link(
+        self, link: str, query: str
+    ) -> tuple[_LinkInputs | None, str | None]:
+        """Filter `link` on its URL and download it."""
+        inputs, code = await self._fetch_link(link, query)
+        if code == "err":
+            self._remember_reject(link, code)
+        return (inputs, code)
+
+    async def _fetch_link(
+        self, link: str, query: str
+    ) -> tuple[_LinkInputs | None, str | None]:
+        claims: list[Claim] = []
+        code = None  # of the outcome, for links waiting for this one
         try:
-            filter_data = {"query": query, "url": link}
-            # Filter based on URL
-            keep, code = await _apply_filters(
-                **filter_data, filters=self.stage2filters["url"]
-            )
-            if not keep:
-                return (None, code)
+            inputs, code = await self._download_link(link, query, claims)
+            return (inputs, code)
+        except Exception as e:
+            self._log_error(link, e)
+            code = "err"
+            return (None, "err")
+        finally:
+            self.in_flight.release(claims, stored=False, code=code)
 
-            # Download image (do not save to disk yet)
+    async def _download_link(
+        self, link: str, query: str, claims: list[Claim]
+    ) -> tuple[_LinkInputs | None, str | None]:
+        """Download `link`, holding its URL in `claims` until it is handed over to
+        the inputs returned."""
+        filter_data = {"query": query, "url": link}
+        # Filter based on URL
+        keep, code = await _apply_filters(
+            **filter_data, filters=self.stage2filters["url"]
+        )
+        if not keep:
+            return (None, code)
+        if code := await self._claim(claims, "url", link):
+            return (None, code)
+
+        # Download image (do not save to disk yet)
+        if self.stream:
+            contents, code = await self._stream(link, query)
+            if contents is None:
+                return (None, code)
+        else:
             response = await self.client.get(link)
             response.raise_for_status()
             contents = response.content
-            if not contents:
-                logger.debug(f"Failed to fetch {link}: no contents")
+            if self.max_bytes is not None and len(contents) > self.max_bytes:
+                logger.debug(f"Failed to fetch {link}: {len(contents)} bytes")
                 return (None, "err")
+        if not contents:
+            logger.debug(f"Failed to fetch {link}: no contents")
+            return (None, "err")
 
-            # Get image "identity"
-            # https://stackoverflow.com/a/64994148
-            hashstr = hashlib.sha256(contents).hexdigest()
+        inputs = _LinkInputs(
+            self.hasher, query, link, contents, self.profile, list(claims)
+        )
+        # Fail early if this is not an image (only reads the header)
+        inputs.img()
+        claims.clear()  # released with inputs from now on
+        return (inputs, None)
 
-            img = Image.open(io.BytesIO(contents))
+    async def filter_link(self, inputs: _LinkInputs) -> tuple[bool, str | None]:
+        """Filter a downloaded link on its contents, then on its hashes."""
+        try:
+            for stage in ["contents", "hashes"]:
+                keep, code = await inputs.apply_filters(
+                    stage, self.stage2filters[stage], self.debug_outdir
+                )
+                if not keep:
+                    self._remember_reject(inputs.data["url"], code, inputs.img())
+                    return (False, code)
+                field = "hashstr" if stage == "contents" else "hashes"
+                if code := await self._claim_inputs(inputs, field):
+                    return (False, code)
+            return (True, None)
+        except Exception as e:
+            self._log_error(inputs.data["url"], e)
+            self._remember_reject(inputs.data["url"], "err")
+            return (False, "err")
 
-            # Filter based on image contents
-            filter_data.update(
-                {
-                    "contents": contents,
-                    "hashstr": hashstr,
-                    "img": img,
-                }
-            )
-            keep, code = await _apply_filters(
-                **filter_data,
-                filters=self.stage2filters["contents"],
-                debug_outdir=self.debug_outdir,
-            )
-            if not keep:
-                return (None, code)
+    async def finish_link(self, inputs: _LinkInputs) -> tuple[str | None, str]:
+        """Run the expensive filters on a link, then save it."""
+        try:
+            return await self._finish_link(inputs)
+        except Exception as e:
+            self._log_error(inputs.data["url"], e)
+            return (None, "err")
 
-            # Filter based on hashes
-            hashes = {
-                "a": str(imagehash.average_hash(img)),
-                "p": str(imagehash.phash(img)),
-                "d": str(imagehash.dhash(img)),
-                "dv": str(imagehash.dhash_vertical(img)),
-                "w": str(imagehash.whash(img)),
-            }
-            filter_data.update(
-                {
-                    "hashes": hashes,
-                }
-            )
-            keep, code = await _apply_filters(
-                **filter_data,
-                filters=self.stage2filters["hashes"],
-                debug_outdir=self.debug_outdir,
-            )
-            if not keep:
-                return (None, code)
+    def _done(
+        self, inputs: _LinkInputs, outcome: tuple[str | None, str]
+    ) -> tuple[str | None, str]:
+        if inputs.timings is not None:
+            self._add_timings(inputs.data["url"], inputs.timings)
+        self.in_flight.release(inputs.claims, inputs.stored, outcome[1])
+        return outcome
 
-            # Run expensive filters (e.g. LLMs)
-            keep, code = await _apply_filters(
-                **filter_data,
-                filters=self.stage2filters["expensive"],
-                debug_outdir=self.debug_outdir,
-            )
-            if not keep:
-                if self.db:
-                    # Remember this image to avoid performing expensive computations again
-                    self.db.put(
-                        Result(
-                            url=link,
-                            hashstr=hashstr,
-                            ts=datetime.datetime.now(),
-                            path="",
-                            query=query,
-                            hashes=hashes,
-                        )
+    async def _claim(self, claims: list[Claim], field: str, value) -> str | None:
+        """Reserve `value` of `field` while the link is in flight, or return the stat
+        name of the database filter it is a duplicate for, or the code of the outcome
+        of the link in flight it shares it with (see `InFlight`)."""
+        filter = self.in_flight_filters.get(field)
+        if filter is None:
+            return None
+        outcome = await self.in_flight.claim(field, value, claims)
+        if outcome is None:
+            return None
+        stored, code = outcome
+        if stored:
+            logger.debug(f"Already in flight ({filter.stat_name()}): {value}")
+            return filter.stat_name()
+        logger.debug(f"Same as a link in flight ({code}): {value}")
+        return code
+
+    async def _claim_inputs(self, inputs: _LinkInputs, field: str) -> str | None:
+        filter = self.in_flight_filters.get(field)
+        if filter is None:
+            return None
+        if field == "hashstr":
+            value = await inputs.hashstr()
+        else:
+            hash_types = filter.hash_types()
+            await inputs.add_hashes(hash_types)
+            value = {k: inputs.hashes[k] for k in hash_types if k in inputs.hashes}
+        return await self._claim(inputs.claims, field, value)
+
+    def _remember_reject(
+        self, link: str, code: str, img: Image.Image | None = None
+    ) -> None:
+        if self.reject_cache is not None and code in self.cached_rejects:
+            self.reject_cache.put(link, code, img.size if img is not None else None)
+
+    def _log_error(self, link: str, e: Exception) -> None:
+        str_e = str(e)
+        if m := re.match("(.*) for url .*", str_e):
+            str_e = m.group(1)
+        logger.debug(f"Failed to download {link}: {type(e).__name__} {str_e}")
+
+    async def _stream(self, link: str, query: str) -> tuple[bytes | None, str]:
+        """Download `link`, or return the code of its rejection."""
+        async with self.client.stream("GET", link) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("content-type", "")
+            if content_type.startswith("text/"):
+                logger.debug(f"Failed to fetch {link}: {content_type}")
+                return (None, "err")
+            length = int(response.headers.get("content-length", 0))
+            if self.max_bytes is not None and length > self.max_bytes:
+                logger.debug(f"Failed to fetch {link}: {length} bytes")
+                return (None, "err")
+            parser = ImageFile.Parser() if self.header_filters else None
+            chunks = []
+            size = 0
+            async for chunk in response.aiter_bytes():
+                chunks.append(chunk)
+                size += len(chunk)
+                if self.max_bytes is not None and size > self.max_bytes:
+                    logger.debug(f"Failed to fetch {link}: over {self.max_bytes} bytes")
+                    return (None, "err")
+                if parser is None:
+                    continue
+                parser.feed(chunk)
+                if parser.image is not None:
+                    keep, code = await _apply_filters(
+                        query=query,
+                        url=link,
+                        img=parser.image,
+                        filters=self.header_filters,
                     )
-                return (None, code)
+                    if not keep:
+                        self._remember_reject(link, code, parser.image)
+                        return (None, code)
+                    parser = None
+                elif size >= _HEADER_MAX_BYTES:
+                    parser = None
+        return (b"".join(chunks), None)
 
-            image_path = None
-            if self.outdir:
-                image_path = _save_file(link, contents, hashstr, img, self.outdir)
+    async def _finish_link(self, inputs: _LinkInputs) -> tuple[str | None, str]:
+        link = inputs.data["url"]
+        query = inputs.data["query"]
+        contents = inputs.data["contents"]
 
-            # Update DB
-            if self.db:
+        # Run expensive filters (e.g. LLMs)
+        keep, code = await inputs.apply_filters(
+            "expensive", self.stage2filters["expensive"], self.debug_outdir
+        )
+        hashstr = await inputs.hashstr()
+        await inputs.add_hashes(self.hash_types)
+        hashes = inputs.hashes or None
+        if not keep:
+            if self.db is not None:
+                # Remember this image to avoid performing expensive computations again
                 self.db.put(
                     Result(
                         url=link,
                         hashstr=hashstr,
                         ts=datetime.datetime.now(),
-                        path=image_path,
+                        path="",
                         query=query,
                         hashes=hashes,
                     )
                 )
+                inputs.stored = True
+            return (None, code)
 
-            return (image_path, "new")
+        image_path = None
+        if self.outdir:
+            image_path = _save_file(link, contents, hashstr, inputs.img(), self.outdir)
 
-        except Exception as e:
-            str_e = str(e)
-            if m := re.match("(.*) for url .*", str_e):
-                str_e = m.group(1)
-            logger.debug(f"Failed to download {link}: {type(e).__name__} {str_e}")
-            return (None, "err")
+        # Update DB
+        if self.db is not None:
+            self.db.put(
+                Result(
+                    url=link,
+                    hashstr=hashstr,
+                    ts=datetime.datetime.now(),
+                    path=image_path,
+                    query=query,
+                    hashes=hashes,
+                )
+            )
+            inputs.stored = True
+
+        return (image_path, "new")
+
+    def _add_timings(self, link: str, timings: dict[str, float]) -> None:
+        logger.debug(f"CPU {link} | {_print_timings(timings, 1)}")
+        _add_stats(self.timings, timings)
+        self.profiled_links += 1
@@ -0,0 +1,154 @@
+import json
+import sqlite3
+import time
+import weakref
+from array import array
+
+from similar_images.crappy_db import DEFAULT_BUFFER_SIZE
+from similar_images.database import INDEX_FIELDS, Database
+from similar_images.hash_index import HASH_TYPES, HashMatrix
+from similar_images.types import Result
+
+SQLITE_DB_EXTENSIONS = (".sqlite", ".sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    hashstr TEXT NOT NULL,
+    ts TEXT,
+    query TEXT,
+    hashes TEXT
+);
+CREATE INDEX IF NOT EXISTS results_url ON results (url);
+CREATE INDEX IF NOT EXISTS results_hashstr ON results (hashstr);
+"""
+_COLUMNS = "url, hashstr, ts, query, hashes"
+
+
+def _close(conn: sqlite3.Connection) -> None:
+    conn.commit()
+    conn.close()
+
+
+class SqliteDB(Database):
+    """Storage in a SQLite database file, with indexed `url` and `hashstr` columns.
+
+    Nothing is loaded in memory when opening the database, and `scan` streams rows
+    from a cursor. Writes go through a write-ahead log (WAL). By default, each `put`
+    is committed right away. With `buffer_size` and/or `flush_interval`, records are
+    committed in groups, as in CrappyDB; uncommitted records are visible to `get`.
+    With `fsync`, commits are synchronous (`PRAGMA synchronous=FULL`).
+
+    `near_duplicate` packs the hashes in a `HashMatrix` on first use, and keeps it
+    up to date with `put`.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        buffer_size: int | None = None,
+        flush_interval: float | None = None,
+        fsync: bool = False,
+    ):
+        self.filename = str(filename)
+        if buffer_size is None:
+            buffer_size = DEFAULT_BUFFER_SIZE if flush_interval is not None else 1
+        assert buffer_size >= 1
+        self._buffer_size = buffer_size
+        self._flush_interval = flush_interval
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._conn = sqlite3.connect(self.filename)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        self._conn.executescript(_SCHEMA)
+        self._finalizer = weakref.finalize(self, _close, self._conn)
+        self._hash_matrix: HashMatrix | None = None
+        self._rowids = array("q")  # position in _hash_matrix -> row id
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def put(self, r: Result) -> None:
+        cursor = self._conn.execute(
+            f"INSERT INTO results ({_COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+            (
+                r.url,
+                r.hashstr,
+                r.ts.isoformat() if r.ts is not None else None,
+                r.query,
+                json.dumps(r.hashes) if r.hashes is not None else None,
+            ),
+        )
+        if self._hash_matrix is not None:
+            self._hash_matrix.set(len(self._rowids), r.hashes or {})
+            self._rowids.append(cursor.lastrowid)
+        self._pending += 1
+        if self._pending >= self._buffer_size or (
+            self._flush_interval is not None
+            and time.monotonic() - self._last_flush >= self._flush_interval
+        ):
+            self.flush()
+
+    def get(self, field: str, value: str) -> Result | None:
+        if field not in INDEX_FIELDS:
+            return None
+        row = self._conn.execute(
+            f"SELECT {_COLUMNS} FROM results WHERE {field} = ? ORDER BY id DESC LIMIT 1",
+            (value,),
+        ).fetchone()
+        return self._result(row) if row is not None else None
+
+    def get_by_hashstr_prefix(self, prefix: str) -> Result | None:
+        # A range on the hashstr index; strings compare as UTF-8 bytes
+        row = self._conn.execute(
+            f"SELECT {_COLUMNS} FROM results WHERE hashstr >= ? AND hashstr < ? "
+            "ORDER BY id LIMIT 1",
+            (prefix, prefix + "\U0010ffff"),
+        ).fetchone()
+        return self._result(row) if row is not None else None
+
+    def scan(self):
+        for row in self._conn.execute(f"SELECT {_COLUMNS} FROM results ORDER BY id"):
+            yield self._result(row)
+
+    def near_duplicate(
+        self, hashes: dict[str, str], max_distance: int = 2
+    ) -> Result | None:
+        if self._hash_matrix is None:
+            matrix = HashMatrix(HASH_TYPES)
+            rowids = array("q")
+            hashes_list = []
+            for rowid, h in self._conn.execute(
+                "SELECT id, hashes FROM results ORDER BY id"
+            ):
+                rowids.append(rowid)
+                hashes_list.append(json.loads(h) if h is not None else None)
+            matrix.extend_hashes(hashes_list)
+            self._hash_matrix, self._rowids = matrix, rowids
+        pos = self._hash_matrix.find(hashes, max_distance)
+        if pos is None:
+            return None
+        row = self._conn.execute(
+            f"SELECT {_COLUMNS} FROM results WHERE id = ?", (self._rowids[pos],)
+        ).fetchone()
+        return self._result(row)
+
+    def flush(self) -> None:
+        self._conn.commit()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        self._finalizer()
+
+    def _result(self, row: tuple) -> Result:
+        url, hashstr, ts, query, hashes = row
+        return Result(
+            url=url,
+            hashstr=hashstr,
+            ts=ts,
+            query=query,
+            hashes=json.loads(hashes) if hashes is not None else None,
+        )
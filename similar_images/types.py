@@ -12,13 +12,41 @@ class BingSeleniumConfiguration(BaseModel):
     safe_search: bool | None = None
 
 
+class DatabaseConfiguration(BaseModel):
+    buffer_size: int | None = None
+    flush_interval: float | None = None
+    fsync: bool = False
+    shared: bool = False
+
+
+class DownloadCacheConfiguration(BaseModel):
+    max_bytes: int | None = None
+    negative_ttl: float | None = None
+
+
+class RejectCacheConfiguration(BaseModel):
+    ttl: float | None = None
+    err_ttl: float | None = None
+
+
 class CommonConfiguration(BaseModel):
     outdir: str | None = None
     database: str | None = None
+    database_config: DatabaseConfiguration | None = None
     count: int | None = None
     filters: list[dict[str, Any]] | None = None
     debug_outdir: str | None = None
     concurrency: int | None = None
+    hash_workers: int | None = None
+    hash_types: list[str] | None = None
+    profile: bool | None = None
+    stream: bool | None = None
+    max_bytes: int | None = None
+    stage_workers: dict[str, int] | None = None
+    download_cache: str | None = None
+    download_cache_config: DownloadCacheConfiguration | None = None
+    reject_cache: str | None = None
+    reject_cache_config: RejectCacheConfiguration | None = None
     bing_selenium: BingSeleniumConfiguration | None = None
 
 
@@ -29,10 +57,21 @@ class RunConfiguration(CommonConfiguration):
         fields_to_resolve = [
             "outdir",
             "database",
+            "database_config",
             "count",
             "filters",
             "debug_outdir",
             "concurrency",
+            "hash_workers",
+            "hash_types",
+            "profile",
+            "stream",
+            "max_bytes",
+            "stage_workers",
+            "download_cache",
+            "download_cache_config",
+            "reject_cache",
+            "reject_cache_config",
             "bing_selenium",
         ]
         for field in fields_to_resolve:
@@ -1,26 +1,57 @@
 import os
 from typing import Generator
 
+from similar_images.binary_db import BINARY_DB_EXTENSION, BinaryDB
 from similar_images.crappy_db import CrappyDB
+from similar_images.database import Database
+from similar_images.sqlite_db import SQLITE_DB_EXTENSIONS, SqliteDB
+from similar_images.types import DatabaseConfiguration
+
+
+def get_database(
+    filename: str, config: DatabaseConfiguration | None = None
+) -> Database:
+    """Open the database stored in `filename`, picking the storage from its extension.
+
+    `.sidb`: BinaryDB. `.sqlite`, `.sqlite3`: SqliteDB.
+    Anything else (including `.db`, used by older JSONL databases): CrappyDB (JSONL).
+    `config` sets up write buffering of CrappyDB and SqliteDB; BinaryDB always writes
+    through. `config.shared` lets several processes share a CrappyDB; SqliteDB does
+    its own locking."""
+    if str(filename).endswith(BINARY_DB_EXTENSION):
+        return BinaryDB(filename)
+    config = config or DatabaseConfiguration()
+    if str(filename).endswith(SQLITE_DB_EXTENSIONS):
+        return SqliteDB(
+            filename,
+            buffer_size=config.buffer_size,
+            flush_interval=config.flush_interval,
+            fsync=config.fsync,
+        )
+    return CrappyDB(
+        filename,
+        buffer_size=config.buffer_size,
+        flush_interval=config.flush_interval,
+        fsync=config.fsync,
+        shared=config.shared,
+    )
 
 
 def is_url(s: str) -> bool:
     return s.startswith("http://") or s.startswith("https://")
 
 
-def get_url_from_db(path: str, db: CrappyDB | None) -> str | None:
-    if not db:
+def get_url_from_db(path: str, db: Database | None) -> str | None:
+    if db is None:
         return None
     _, file = os.path.split(path)
     name, _ = os.path.splitext(file)
-    for r in db.scan():
-        if r.hashstr.startswith(name):
-            return r.url
-    return None
+    r = db.get_by_hashstr_prefix(name)
+    return r.url if r is not None else None
 
 
 def get_urls_or_files(
-    paths: list[str], db: CrappyDB | None = None
+    paths: list[str], db: Database | None = None
 ) -> Generator[str, None, None]:
     """From a list of URLs, directories and files, produce a list of URLs and files.
 
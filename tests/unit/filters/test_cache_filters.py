@@ -0,0 +1,33 @@
+import pytest
+
+from similar_images.filters.cache_filters import RejectCacheFilter
+from similar_images.filters.image_filters import ImageFilter
+from similar_images.reject_cache import RejectCache
+
+
+@pytest.mark.parametrize(
+    "url,min_size,expected_keep,expected_explanation",
+    [
+        ("http1", None, False, "Rejected before (small): http1: (10, 20)"),
+        ("http1", (20, 20), False, "Rejected before (small): http1: (10, 20)"),
+        ("http1", (10, 20), True, None),
+        ("http2", None, False, "Rejected before (err): http2"),
+        ("http2", (10, 20), False, "Rejected before (err): http2"),
+        ("http3", None, True, None),
+    ],
+)
+@pytest.mark.asyncio
+async def test_reject_cache_filter(
+    tmp_path, url, min_size, expected_keep, expected_explanation
+):
+    # GIVEN
+    cache = RejectCache(tmp_path / "rejects.sqlite")
+    cache.put("http1", "small", (10, 20))
+    cache.put("http2", "err")
+    size_filters = [ImageFilter(min_size, 0)] if min_size else []
+    reject_filter = RejectCacheFilter(cache, size_filters)
+    # WHEN
+    result = await reject_filter.filter(url=url)
+    # THEN
+    assert result.keep == expected_keep
+    assert result.explanation == expected_explanation
@@ -77,6 +77,23 @@ async def test_db_filter_exact_dup(db, contents, expected):
     assert result.keep == expected
 
 
+@pytest.mark.parametrize(
+    "hashstr,expected",
+    [
+        ("2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824", False),
+        ("2cf24dba", True),
+    ],
+)
+@pytest.mark.asyncio
+async def test_db_filter_exact_dup_hashstr(db, hashstr, expected):
+    # GIVEN
+    db_filter = DbExactDupFilter(db=db)
+    # WHEN
+    result = await db_filter.filter(hashstr=hashstr, contents=b"ignored", url="extra")
+    # THEN
+    assert result.keep == expected
+
+
 @pytest.mark.parametrize(
     "hashes,expected",
     [
@@ -96,6 +113,25 @@ async def test_db_filter_near_dup(db, hashes, expected):
     assert result.keep == expected
 
 
+@pytest.mark.parametrize(
+    "hash_types,hashes,expected",
+    [
+        (["p"], {"a": "0f2787ff93c5c3c1", "p": "0000000000000000"}, True),
+        (["a"], {"a": "0f2787ff93c5c3c1", "p": "0000000000000000"}, False),
+        (["a", "p"], {"p": "b617333949f8383c"}, False),
+    ],
+)
+@pytest.mark.asyncio
+async def test_db_filter_near_dup_hash_types(db, hash_types, hashes, expected):
+    # GIVEN
+    db_filter = DbNearDupFilter(db=db, hash_types=hash_types)
+    # WHEN
+    result = await db_filter.filter(hashes=hashes, url="extra")
+    # THEN
+    assert db_filter.hash_types() == hash_types
+    assert result.keep == expected
+
+
 @pytest.mark.parametrize(
     "hash1,hash2,expected",
     [
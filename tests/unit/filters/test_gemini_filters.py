@@ -0,0 +1,58 @@
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+from PIL import Image
+
+from similar_images.filters.gemini_filters import GeminiFilter
+from similar_images.rate_limiter import RateLimiter
+
+
+@pytest.mark.parametrize(
+    "status_code,text,expected_keep",
+    [(200, "yes", True), (200, "no", False), (503, None, None)],
+)
+@pytest.mark.asyncio
+async def test_gemini_filter(status_code, text, expected_keep):
+    # GIVEN
+    httpx_client = AsyncMock()
+    httpx_client.post = AsyncMock(
+        return_value=httpx.Response(
+            request=httpx.Request("POST", url="goo.gell.com"),
+            status_code=status_code,
+            json={
+                "candidates": [{"content": {"parts": [{"text": text}]}}],
+                "usageMetadata": {"totalTokenCount": 260},
+            },
+        )
+    )
+    with patch(
+        "similar_images.filters.gemini_filters.httpx.AsyncClient",
+        return_value=httpx_client,
+    ):
+        gemini_filter = GeminiFilter(
+            query="Cat?",
+            keep_responses=["yes"],
+            model="hello",
+            api_key="key",
+            rate_limiter=RateLimiter(),
+            retry_policy={"tries": 2, "base_sleep": 0, "max_sleep": 0},
+        )
+    image_path = "tests/integration/data/google-logo.png"
+    with open(image_path, "rb") as f:
+        contents = f.read()
+    img = Image.open(image_path)
+    # WHEN
+    if expected_keep is None:
+        # All tries failed: an error, not a rejection
+        with pytest.raises(RuntimeError, match="gave up for url http"):
+            await gemini_filter.filter(url="http", contents=contents, img=img)
+        got = None
+    else:
+        got = await gemini_filter.filter(url="http", contents=contents, img=img)
+    # THEN
+    assert httpx_client.post.call_count == (1 if expected_keep is not None else 2)
+    if got is not None:
+        assert got.keep == expected_keep
+    stats = gemini_filter.stats()
+    assert stats["llm:gave_up"] == (1 if expected_keep is None else 0)
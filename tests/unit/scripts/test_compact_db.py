@@ -0,0 +1,118 @@
+import datetime
+import fcntl
+import os
+import stat
+from unittest.mock import patch
+
+import pytest
+
+from scripts.compact_db import _plan, compact
+from similar_images.crappy_db import CrappyDB
+from similar_images.types import Result
+
+
+def test_compact(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "db.jsonl"
+    records = [
+        Result(url="http1", hashstr="abc", hashes={"a": "0f2787ff93c5c3c1"}),
+        Result(url="http2", hashstr="def", query="cats"),
+        Result(url="http1", hashstr="abc", ts=datetime.datetime(2000, 1, 2)),
+        Result(url="http3", hashstr="abc", hashes={"a": "0000000000000000"}),
+        Result(url="http2", hashstr="def", hashes={"a": "1111111111111111"}),
+        Result(url="http2", hashstr="def", query="dogs", hashes={}),
+    ]
+    db = CrappyDB(db_file)
+    for r in records:
+        db.put(r)
+    db.close()
+    db_file.write_text(db_file.read_text() + "\n")
+    output_file = tmp_path / "compacted.jsonl"
+    # WHEN
+    n = compact(str(db_file), str(output_file))
+    # THEN
+    expected = [
+        Result(
+            url="http1",
+            hashstr="abc",
+            ts=datetime.datetime(2000, 1, 2),
+            hashes={"a": "0f2787ff93c5c3c1"},
+        ),
+        Result(url="http3", hashstr="abc", hashes={"a": "0000000000000000"}),
+        Result(
+            url="http2", hashstr="def", query="dogs", hashes={"a": "1111111111111111"}
+        ),
+    ]
+    assert n == 3
+    compacted = CrappyDB(output_file)
+    assert list(compacted.scan()) == expected
+    for field, value in [
+        ("url", "http1"),
+        ("url", "http2"),
+        ("url", "http3"),
+        ("hashstr", "abc"),
+        ("hashstr", "def"),
+    ]:
+        got = compacted.get(field, value)
+        before = CrappyDB(db_file).get(field, value)
+        assert (got.url, got.hashstr) == (before.url, before.hashstr)
+    assert {p.name for p in tmp_path.iterdir()} == {"db.jsonl", "compacted.jsonl"}
+
+
+def test_compact_in_place(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "db.jsonl"
+    db = CrappyDB(db_file)
+    for _ in range(3):
+        db.put(Result(url="http1", hashstr="abc"))
+    db.close()
+    # WHEN
+    n = compact(str(db_file), str(db_file))
+    # THEN
+    assert n == 1
+    assert list(CrappyDB(db_file).scan()) == [Result(url="http1", hashstr="abc")]
+
+
+def test_compact_empty(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "db.jsonl"
+    db_file.write_text("")
+    # WHEN
+    n = compact(str(db_file), str(db_file))
+    # THEN
+    assert n == 0
+    assert db_file.read_text() == ""
+
+
+@pytest.mark.parametrize("mode", [0o644, 0o600, 0o664])
+def test_compact_mode(tmp_path, mode):
+    # GIVEN
+    db_file = tmp_path / "db.jsonl"
+    db_file.write_text(f"{Result(url='http1', hashstr='abc').dump()}\n")
+    os.chmod(db_file, mode)
+    # WHEN
+    compact(str(db_file), str(db_file))
+    # THEN
+    assert stat.S_IMODE(os.stat(db_file).st_mode) == mode
+
+
+def test_compact_locked(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "db.jsonl"
+    db_file.write_text(f"{Result(url='http1', hashstr='abc').dump()}\n")
+    locked = []
+
+    def plan(path):
+        with open(path, "rb") as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                locked.append(False)
+            except BlockingIOError:
+                locked.append(True)
+        return _plan(path)
+
+    # WHEN
+    with patch("scripts.compact_db._plan", side_effect=plan):
+        compact(str(db_file), str(db_file))
+    # THEN
+    assert locked == [True]
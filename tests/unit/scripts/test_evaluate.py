@@ -0,0 +1,34 @@
+from scripts.evaluate import evaluate_dataset
+from similar_images.gemini import Decision
+
+
+def _decision(decision: str | None, status_code: int = 200) -> Decision:
+    return Decision(
+        image_path="",
+        content={},
+        block=None,
+        text=decision,
+        decision=decision,
+        status_code=status_code,
+        usage=None,
+    )
+
+
+def test_evaluate_dataset():
+    # GIVEN
+    positive = [_decision("yes"), _decision("no"), _decision(None, 400)]
+    negative = [_decision("yes"), _decision("no"), _decision("no")]
+    # WHEN
+    got = evaluate_dataset(positive, negative, ["yes"], outdir=None)
+    # THEN
+    assert got == {
+        "precision": 0.5,
+        "recall": 0.5,
+        "TP": 1,
+        "FP": 1,
+        "TN": 2,
+        "FN": 1,
+        "P": 2,
+        "N": 3,
+        "ERR": 1,
+    }
@@ -1,6 +1,7 @@
 from unittest.mock import Mock
 
 from scripts.scrape import get_filters
+from similar_images.crappy_db import CrappyDB
 from similar_images.types import CommonConfiguration, ScrapeConfiguration
 
 
@@ -33,3 +34,20 @@ def test_scrape_filters():
     assert got == expected
     assert filters[3]._min_size == (600, 800)
     assert filters[3]._min_area == 550_000
+
+
+def test_scrape_filters_empty_db(tmp_path):
+    # GIVEN
+    db = CrappyDB(tmp_path / "empty.jsonl")
+    common_config = CommonConfiguration(
+        filters=[{"DbUrlFilter": {}}, {"DbExactDupFilter": {}}, {"DbNearDupFilter": {}}]
+    )
+    # WHEN
+    filters = get_filters(common_config, db=db)
+    # THEN
+    assert len(db) == 0
+    assert [type(f).__name__ for f in filters] == [
+        "DbUrlFilter",
+        "DbExactDupFilter",
+        "DbNearDupFilter",
+    ]
@@ -0,0 +1,170 @@
+import datetime
+import mmap
+from unittest.mock import patch
+
+import pytest
+
+from similar_images.binary_db import BinaryDB
+from similar_images.crappy_db import CrappyDB
+from similar_images.types import Result
+
+SHA256 = "2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824"
+
+
+@pytest.fixture
+def results():
+    return [
+        Result(url="https://image.com/a.jpeg", hashstr="abc"),
+        Result(
+            url="https://example.com/b.png",
+            hashstr=SHA256,
+            ts=datetime.datetime(2000, 10, 5, 12, 13, 14, 15),
+            query="cats and dogs",
+            hashes={"a": "0f2787ff93c5c3c1", "p": "03200040006", "dv": "00ff"},
+        ),
+        Result(
+            url="http://images.bing.com/extra-1800.png",
+            hashstr="xxx",
+            ts=datetime.datetime(2020, 1, 2, tzinfo=datetime.UTC),
+            query="",
+            hashes={"a": "ffffffffffffffffffff", "x": "12", "w": "ABCD"},
+        ),
+        Result(url="https://image.com/a.jpeg", hashstr=SHA256, hashes={}),
+    ]
+
+
+def test_binary_db_new(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "db.sidb"
+    # WHEN
+    db = BinaryDB(db_file)
+    # THEN
+    assert not list(db.scan())
+    assert not db.get("url", "https://image.com/a.jpeg")
+    assert not db.near_duplicate({"a": "0f2787ff93c5c3c1"})
+
+
+@pytest.mark.parametrize("reopen", [False, True])
+def test_binary_db_put(tmp_path, results, reopen):
+    # GIVEN
+    db_file = tmp_path / "db.sidb"
+    db = BinaryDB(db_file)
+    db.put(results[0])
+    db.put(results[1])
+    if reopen:
+        db.close()
+        db = BinaryDB(db_file)
+    # WHEN
+    assert db.get("url", "https://example.com/b.png") == results[1]
+    db.put(results[2])
+    db.put(results[3])
+    # THEN
+    assert list(db.scan()) == results
+    assert db.get("url", "https://image.com/a.jpeg") == results[3]
+    assert db.get("url", "http://images.bing.com/extra-1800.png") == results[2]
+    assert not db.get("url", "https://image.com/b.jpeg")
+    assert db.get("hashstr", "abc") == results[0]
+    assert db.get("hashstr", SHA256) == results[3]
+    assert not db.get("hashstr", "yyy")
+    assert db.near_duplicate({"p": "02200040006"}) == results[1]
+    assert db.near_duplicate({"a": "fffffffffffffffffffe"}) == results[2]
+    assert db.near_duplicate({"w": "abcf"}) == results[2]
+    assert not db.near_duplicate({"x": "ff"})
+
+
+def test_binary_db_partial_record(tmp_path, results):
+    # GIVEN
+    db_file = tmp_path / "db.sidb"
+    db = BinaryDB(db_file)
+    for r in results:
+        db.put(r)
+    db.close()
+    with open(db_file, "ab") as f:
+        f.write(b"garbage")
+    # WHEN
+    db = BinaryDB(db_file)
+    db.put(results[0])
+    # THEN
+    assert list(db.scan()) == results + [results[0]]
+
+
+def test_binary_db_not_binary(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "db.sidb"
+    db_file.write_text('{"url":"http","hashstr":"abcdef"}\n')
+    # WHEN / THEN
+    with pytest.raises(ValueError):
+        BinaryDB(db_file)
+
+
+def test_binary_db_convert(tmp_path, results):
+    # GIVEN
+    jsonl_db = CrappyDB(tmp_path / "db.jsonl")
+    for r in results:
+        jsonl_db.put(r)
+    # WHEN
+    binary_db = BinaryDB(tmp_path / "db.sidb")
+    for r in jsonl_db.scan():
+        binary_db.put(r)
+    jsonl_db2 = CrappyDB(tmp_path / "db2.jsonl")
+    for r in BinaryDB(tmp_path / "db.sidb").scan():
+        jsonl_db2.put(r)
+    # THEN
+    assert list(CrappyDB(tmp_path / "db2.jsonl").scan()) == results
+
+
+def test_binary_db_hashstr_prefix(tmp_path, results):
+    # GIVEN
+    db = BinaryDB(tmp_path / "db.sidb")
+    for r in results:
+        db.put(r)
+    # WHEN / THEN
+    assert db.get_by_hashstr_prefix("2cf24dba") == results[1]
+    assert db.get_by_hashstr_prefix("xx") == results[2]
+    assert not db.get_by_hashstr_prefix("2cf24dbb")
+
+
+@pytest.mark.parametrize("reopen", [False, True])
+def test_binary_db_indexes(tmp_path, results, reopen):
+    # GIVEN
+    db_file = tmp_path / "db.sidb"
+    db = BinaryDB(db_file)
+    db.put(results[0])
+    db.put(results[1])
+    if reopen:
+        db.close()
+        db = BinaryDB(db_file)
+    # WHEN
+    with (
+        patch("similar_images.hash_index.HashMatrix.find", side_effect=AssertionError),
+        patch(
+            "similar_images.database.Database.get_by_hashstr_prefix",
+            side_effect=AssertionError,
+        ),
+    ):
+        assert db.near_duplicate({"a": "0f2787ff93c5c3c0"}) == results[1]
+        assert db.get_by_hashstr_prefix("2cf2") == results[1]
+        db.put(results[2])
+        db.put(results[3])
+        # THEN
+        assert db.near_duplicate({"a": "fffffffffffffffffffe"}) == results[2]
+        assert db.near_duplicate({"w": "abcf"}) == results[2]
+        assert not db.near_duplicate({"p": "fffffffffff"})
+        assert db.get_by_hashstr_prefix("xx") == results[2]
+        assert db.get_by_hashstr_prefix("2cf2") == results[1]
+        assert not db.get_by_hashstr_prefix("2cf3")
+
+
+def test_binary_db_close(tmp_path, results):
+    # GIVEN
+    db = BinaryDB(tmp_path / "db.sidb")
+    for r in results:
+        db.put(r)
+    assert db.get("url", "https://example.com/b.png") == results[1]
+    heap = db._heap
+    assert isinstance(heap, mmap.mmap)
+    # WHEN
+    db.close()
+    # THEN
+    assert heap.closed
+    assert len(db._records) == 0
@@ -1,5 +1,12 @@
+import datetime
+import gc
+import multiprocessing
+from unittest.mock import patch
+
 import pytest
+from pydantic import ValidationError
 
+from scripts.compact_db import compact
 from similar_images.crappy_db import CrappyDB
 from similar_images.types import Result
 
@@ -55,3 +62,245 @@ def test_crappy_db_existing(tmp_path):
     assert db2.get("hashstr", "abc") == r1
     assert db2.get("hashstr", "def") == r2
     assert not db2.get("hashstr", "yyy")
+
+
+@pytest.mark.parametrize("max_distance", [2, 5])
+def test_crappy_db_near_duplicate(tmp_path, max_distance):
+    # GIVEN
+    db_file = tmp_path / "test_crappy_db_near_duplicate.jsonl"
+    db1 = CrappyDB(db_file)
+    r1 = Result(url="http1", hashstr="abc")
+    r2 = Result(url="http2", hashstr="def", hashes={"a": "0f2787ff93c5c3c1"})
+    r3 = Result(url="http3", hashstr="ghi", hashes={"a": "0f2787ff93c5c3c1"})
+    for r in (r1, r2, r3):
+        db1.put(r)
+    db2 = CrappyDB(db_file)
+    # WHEN
+    got = [
+        db.near_duplicate(hashes, max_distance=max_distance)
+        for db in (db1, db2)
+        for hashes in ({"a": "0f2787ff93c5c3c3"}, {"a": "f0f0f0f0f0f0f0f0"}, {})
+    ]
+    # THEN
+    assert got == [r2, None, None, r2, None, None]
+
+
+def _lines(db_file) -> int:
+    with open(db_file, "rt") as f:
+        return len(f.readlines())
+
+
+def test_crappy_db_buffer_size(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "test_crappy_db_buffer_size.jsonl"
+    db = CrappyDB(db_file, buffer_size=3)
+    results = [Result(url=f"http{i}", hashstr=f"{i}") for i in range(7)]
+    # WHEN
+    got = []
+    for r in results:
+        db.put(r)
+        got.append(_lines(db_file))
+    # THEN
+    assert got == [0, 0, 3, 3, 3, 6, 6]
+    assert db.get("url", "http6") == results[6]
+    db.close()
+    assert _lines(db_file) == 7
+    assert list(CrappyDB(db_file).scan()) == results
+
+
+@patch("similar_images.crappy_db.time")
+def test_crappy_db_flush_interval(mock_time, tmp_path):
+    # GIVEN
+    mock_time.monotonic.return_value = 100.0
+    mock_time.perf_counter.return_value = 0.0
+    db_file = tmp_path / "test_crappy_db_flush_interval.jsonl"
+    db = CrappyDB(db_file, flush_interval=5.0, fsync=True)
+    # WHEN
+    got = []
+    for i, now in enumerate([101.0, 104.0, 105.0, 106.0, 112.0]):
+        mock_time.monotonic.return_value = now
+        db.put(Result(url=f"http{i}", hashstr=f"{i}"))
+        got.append(_lines(db_file))
+    db.flush()
+    # THEN
+    assert got == [0, 0, 3, 3, 5]
+    assert _lines(db_file) == 5
+
+
+def test_crappy_db_flush_at_exit(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "test_crappy_db_flush_at_exit.jsonl"
+    db = CrappyDB(db_file, buffer_size=100)
+    db.put(Result(url="http", hashstr="abc"))
+    # WHEN
+    del db
+    # THEN
+    assert _lines(db_file) == 1
+
+
+def test_crappy_db_closed(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "test_crappy_db_closed.jsonl"
+    db = CrappyDB(db_file, buffer_size=10)
+    db.put(Result(url="http1", hashstr="abc"))
+    db.close()
+    # WHEN / THEN
+    with pytest.raises(ValueError, match="CrappyDB is closed"):
+        db.put(Result(url="http2", hashstr="def"))
+    with pytest.raises(ValueError, match="CrappyDB is closed"):
+        db.flush()
+    db.close()
+    assert list(CrappyDB(db_file).scan()) == [Result(url="http1", hashstr="abc")]
+
+
+def test_crappy_db_load(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "test_crappy_db_load.jsonl"
+    db_file.write_text(
+        '{"url":"http1","hashstr":"abc","ts":"2000-10-05T12:13:14","hashes":{"a":"0f2787ff93c5c3c1"}}\n'
+        "\n"
+        '{"url":"http2","hashstr":"def","query":"cats"}\n'
+        '{"url":"http1","hashstr":"ghi","ts":"not a date"}\n'
+    )
+    # WHEN
+    db = CrappyDB(db_file)
+    # THEN
+    assert db.load_stats["rows"] == 3
+    assert gc.isenabled()
+    assert db.get("url", "http2") == Result(url="http2", hashstr="def", query="cats")
+    assert db.get("hashstr", "abc") == Result(
+        url="http1",
+        hashstr="abc",
+        ts=datetime.datetime(2000, 10, 5, 12, 13, 14),
+        hashes={"a": "0f2787ff93c5c3c1"},
+    )
+    assert db.near_duplicate({"a": "0f2787ff93c5c3c0"}).hashstr == "abc"
+    assert db.get("url", "http1").hashstr == "ghi"
+    with pytest.raises(ValidationError):
+        db.get("url", "http1").ts  # validated on demand
+
+
+def test_crappy_db_load_invalid(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "test_crappy_db_load_invalid.jsonl"
+    db_file.write_text('{"url":"http1"}\n')
+    # WHEN / THEN
+    with pytest.raises(ValidationError):
+        CrappyDB(db_file)
+    assert gc.isenabled()
+
+
+def test_crappy_db_shared(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "test_crappy_db_shared.jsonl"
+    db1 = CrappyDB(db_file, shared=True)
+    db2 = CrappyDB(db_file, shared=True)
+    r1 = Result(url="http1", hashstr="abc", hashes={"a": "0f2787ff93c5c3c1"})
+    r2 = Result(url="http2", hashstr="def")
+    # WHEN
+    db1.put(r1)
+    db2.put(r2)
+    # THEN
+    assert db2.get("url", "http1") == r1
+    assert db2.near_duplicate({"a": "0f2787ff93c5c3c0"}) == r1
+    assert db1.get("hashstr", "def") == r2
+    assert list(db1.scan()) == [r1, r2]
+    assert list(db2.scan()) == [r2, r1]  # own records first
+    assert _lines(db_file) == 2
+
+
+def test_crappy_db_shared_buffered(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "test_crappy_db_shared_buffered.jsonl"
+    db1 = CrappyDB(db_file, buffer_size=2, shared=True)
+    db2 = CrappyDB(db_file, shared=True)
+    # WHEN
+    db1.put(Result(url="http1", hashstr="abc"))
+    db2.put(Result(url="http2", hashstr="def"))
+    # THEN
+    assert not db2.get("url", "http1")  # not written yet
+    db1.put(Result(url="http3", hashstr="ghi"))
+    assert db2.get("url", "http1")
+    assert db2.get("url", "http3")
+    assert len(db1) == 3
+    assert len(db2) == 3
+    assert _lines(db_file) == 3
+
+
+def test_crappy_db_shared_interleaved(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "test_crappy_db_shared_interleaved.jsonl"
+    db1 = CrappyDB(db_file, shared=True)
+    db2 = CrappyDB(db_file, shared=True)
+    # WHEN
+    db1.put(Result(url="http1", hashstr="abc"))
+    db2.put(Result(url="http1", hashstr="def"))
+    db2.put(Result(url="http2", hashstr="abc"))
+    # THEN the last record put wins, whoever put it
+    assert db1.get("url", "http1").hashstr == "def"
+    assert db1.get("hashstr", "abc").url == "http2"
+    db1.put(Result(url="http3", hashstr="def"))
+    assert db1.get("hashstr", "def").url == "http3"
+    assert db2.get("hashstr", "def").url == "http3"
+
+
+@pytest.mark.parametrize("buffer_size", [1, 3])
+def test_crappy_db_shared_compacted(tmp_path, buffer_size):
+    # GIVEN
+    db_file = tmp_path / "test_crappy_db_shared_compacted.jsonl"
+    db1 = CrappyDB(db_file, buffer_size=buffer_size, shared=True)
+    db2 = CrappyDB(db_file, shared=True)
+    r1 = Result(url="http1", hashstr="abc")
+    r2 = Result(url="http2", hashstr="def")
+    r3 = Result(url="http3", hashstr="ghi")
+    for _ in range(3):
+        db2.put(r1)
+    db1.put(r2)
+    # WHEN
+    compact(str(db_file), str(db_file))
+    db1.put(r3)
+    db1.close()
+    # THEN
+    assert db2.get("url", "http3") == r3
+    db2.put(r1)
+    assert list(CrappyDB(db_file).scan()) == [r1, r2, r3, r1]
+
+
+def test_crappy_db_not_shared(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "test_crappy_db_not_shared.jsonl"
+    db1 = CrappyDB(db_file)
+    db2 = CrappyDB(db_file)
+    # WHEN
+    db1.put(Result(url="http1", hashstr="abc"))
+    # THEN
+    assert not db2.get("url", "http1")
+
+
+def _put_many(db_file, prefix: str, n: int) -> None:
+    db = CrappyDB(db_file, shared=True)
+    for i in range(n):
+        db.put(Result(url=f"{prefix}{i}", hashstr=f"{prefix}{i}"))
+        db.get("url", f"{prefix}{i}")
+    db.close()
+
+
+def test_crappy_db_shared_processes(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "test_crappy_db_shared_processes.jsonl"
+    db = CrappyDB(db_file, shared=True)
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=_put_many, args=(db_file, prefix, 50))
+        for prefix in ["a", "b", "c"]
+    ]
+    # WHEN
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    # THEN
+    assert all(p.exitcode == 0 for p in processes)
+    assert len(list(db.scan())) == 150
+    assert db.get("url", "b49")
+    assert len(CrappyDB(db_file)) == 150
@@ -0,0 +1,39 @@
+import pytest
+
+from similar_images.decision_cache import DecisionCache, decision_key
+
+
+def test_decision_cache(tmp_path):
+    # GIVEN
+    cache = DecisionCache(tmp_path / "decisions.sqlite")
+    # WHEN
+    cache.put("key1", "model", '{"decision": "yes"}')
+    cache.put("key2", "model", '{"decision": "no"}')
+    cache.put("key1", "model", '{"decision": "maybe"}')
+    # THEN
+    assert len(cache) == 2
+    assert cache.get("key1") == '{"decision": "maybe"}'
+    assert cache.get("key3") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+    assert DecisionCache(tmp_path / "decisions.sqlite").get("key2") is not None
+
+
+@pytest.mark.parametrize(
+    "model,query,config,sha256s,expected_same",
+    [
+        ("m", "q", {"a": 1, "b": 2}, ["s"], True),
+        ("m2", "q", {"a": 1, "b": 2}, ["s"], False),
+        ("m", "q2", {"a": 1, "b": 2}, ["s"], False),
+        ("m", "q", {"a": 2, "b": 2}, ["s"], False),
+        ("m", "q", {"a": 1, "b": 2}, ["s2"], False),
+        ("m", "q", {"b": 2, "a": 1}, ["s"], True),
+    ],
+)
+def test_decision_key(model, query, config, sha256s, expected_same):
+    # GIVEN
+    key = decision_key("m", "q", {"a": 1, "b": 2}, ["s"])
+    # WHEN
+    got = decision_key(model, query, config, sha256s)
+    # THEN
+    assert (got == key) == expected_same
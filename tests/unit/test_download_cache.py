@@ -0,0 +1,128 @@
+import httpx
+import pytest
+
+from similar_images.download_cache import TIMEOUT, CachingTransport, DownloadCache
+
+
+def test_download_cache(tmp_path):
+    # GIVEN
+    cache = DownloadCache(tmp_path / "cache")
+    # WHEN
+    cache.put("http1", 200, {"content-type": "image/png"}, b"abc")
+    cache.put("http2", 200, {}, b"abc")
+    cache.put("http3", 301, {"location": "http1"})
+    cache.put("http4", 404)
+    # THEN
+    assert len(cache) == 4
+    assert cache.size() == 3  # shared contents
+    got = cache.get("http1")
+    assert (got.status, got.headers, got.contents) == (
+        200,
+        {"content-type": "image/png"},
+        b"abc",
+    )
+    assert cache.get("http2").contents == b"abc"
+    assert cache.get("http3").headers == {"location": "http1"}
+    assert cache.get("http4").status == 404
+    assert cache.get("http5") is None
+    cache.close()
+    assert DownloadCache(tmp_path / "cache").get("http1").contents == b"abc"
+
+
+@pytest.mark.parametrize("negative_ttl,expected", [(3600, True), (-1, False)])
+def test_download_cache_negative_ttl(tmp_path, negative_ttl, expected):
+    # GIVEN
+    cache = DownloadCache(tmp_path, negative_ttl=negative_ttl)
+    # WHEN
+    cache.put("http1", 404)
+    cache.put("http2", TIMEOUT)
+    cache.put("http3", 200, {}, b"abc")
+    # THEN
+    assert (cache.get("http1") is not None) == expected
+    assert (cache.get("http2") is not None) == expected
+    assert cache.get("http3") is not None
+
+
+def test_download_cache_eviction(tmp_path):
+    # GIVEN
+    cache = DownloadCache(tmp_path, max_bytes=25)
+    cache.put("http1", 200, {}, b"1" * 10)
+    cache.put("http2", 200, {}, b"2" * 10)
+    # WHEN
+    cache.get("http1")  # http2 is now the least recently used
+    cache.put("http3", 200, {}, b"3" * 10)
+    # THEN
+    assert cache.size() == 20
+    assert cache.get("http1") is not None
+    assert cache.get("http2") is None
+    assert cache.get("http3") is not None
+
+
+@pytest.fixture
+def requests():
+    return []
+
+
+@pytest.fixture
+def client(tmp_path, requests):
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(str(request.url))
+        match request.url.path:
+            case "/image.png":
+                return httpx.Response(200, content=b"x" * 1000)
+            case "/moved.png":
+                return httpx.Response(301, headers={"location": "/image.png"})
+            case "/slow.png":
+                raise httpx.ReadTimeout("timeout", request=request)
+            case _:
+                return httpx.Response(404)
+
+    transport = CachingTransport(
+        DownloadCache(tmp_path), transport=httpx.MockTransport(handler)
+    )
+    return httpx.AsyncClient(transport=transport, follow_redirects=True)
+
+
+@pytest.mark.parametrize(
+    "url,expected_status,expected_requests",
+    [
+        ("http://images.com/image.png", 200, ["http://images.com/image.png"]),
+        (
+            "http://images.com/moved.png",
+            200,
+            ["http://images.com/moved.png", "http://images.com/image.png"],
+        ),
+        ("http://images.com/missing.png", 404, ["http://images.com/missing.png"]),
+        ("http://images.com/slow.png", None, ["http://images.com/slow.png"]),
+    ],
+)
+@pytest.mark.asyncio
+async def test_caching_transport(
+    client, requests, url, expected_status, expected_requests
+):
+    for _ in range(2):
+        # WHEN
+        try:
+            response = await client.get(url)
+            status = response.status_code
+        except httpx.TimeoutException:
+            status = None
+        # THEN
+        assert status == expected_status
+        if status == 200:
+            assert response.content == b"x" * 1000
+        assert requests == expected_requests  # only the first time
+
+
+@pytest.mark.asyncio
+async def test_caching_transport_stream_stopped(client, requests):
+    # GIVEN
+    url = "http://images.com/image.png"
+    # WHEN
+    async with client.stream("GET", url) as response:
+        async for chunk in response.aiter_bytes(chunk_size=10):
+            break
+    response = await client.get(url)
+    # THEN
+    assert response.content == b"x" * 1000
+    assert requests == [url, url]  # not cached when stopped early
@@ -1,9 +1,12 @@
-from unittest.mock import AsyncMock
+import hashlib
+from unittest.mock import AsyncMock, patch
 
 import httpx
 import pytest
+from PIL import Image
 
-from similar_images.gemini import Decision, Gemini
+from similar_images.decision_cache import DecisionCache
+from similar_images.gemini import Decision, Gemini, parse_batch_answers
 
 
 @pytest.mark.parametrize(
@@ -104,6 +107,118 @@ async def test_gemini_ok(text_before_image):
     )
 
 
+@pytest.mark.parametrize("image_formats", [None, ["PNG"]])
+@pytest.mark.asyncio
+async def test_gemini_image_contents(image_formats):
+    # GIVEN
+    httpx_client = AsyncMock()
+    httpx_client.post = AsyncMock(
+        return_value=httpx.Response(
+            request=httpx.Request("POST", url="goo.gell.com"),
+            status_code=200,
+            json={
+                "candidates": [{"content": {"parts": [{"text": "yes"}]}}],
+                "usageMetadata": {"totalTokenCount": 260},
+            },
+        )
+    )
+    gemini = Gemini(httpx_client=httpx_client, model="hello", api_key="key")
+    with open("tests/integration/data/google-logo.png", "rb") as f:
+        contents = f.read()
+    # WHEN
+    with patch("similar_images.gemini.Image.open", wraps=Image.open) as mock_open:
+        got = await gemini.chat(
+            "Yes?", image_contents=[contents], image_formats=image_formats
+        )
+    # THEN
+    assert got.decision == "yes"
+    assert mock_open.call_count == (0 if image_formats else 1)
+    parts = httpx_client.post.call_args.kwargs["json"]["contents"]["parts"]
+    assert parts[1]["inline_data"]["mime_type"] == "image/PNG"
+
+
+@pytest.mark.parametrize("status_code,expected_posts", [(200, 2), (500, 4)])
+@pytest.mark.asyncio
+async def test_gemini_decision_cache(tmp_path, status_code, expected_posts):
+    # GIVEN
+    httpx_client = AsyncMock()
+    httpx_client.post = AsyncMock(
+        return_value=httpx.Response(
+            request=httpx.Request("POST", url="goo.gell.com"),
+            status_code=status_code,
+            json={
+                "candidates": [{"content": {"parts": [{"text": "yes"}]}}],
+                "usageMetadata": {"totalTokenCount": 260},
+            },
+        )
+    )
+    cache = DecisionCache(tmp_path / "decisions.sqlite")
+    gemini = Gemini(
+        httpx_client=httpx_client,
+        model="hello",
+        api_key="key",
+        tries=1,
+        decision_cache=cache,
+    )
+    image_path = "tests/integration/data/google-logo.png"
+    with open(image_path, "rb") as f:
+        contents = f.read()
+    # WHEN
+    got = [
+        await gemini.chat("Yes?", image_paths=[image_path]),
+        await gemini.chat("Yes?", image_contents=[contents]),
+        await gemini.chat("Yes?", image_paths=[image_path]),
+        await gemini.chat("No?", image_paths=[image_path]),
+    ]
+    # THEN
+    assert httpx_client.post.call_count == expected_posts
+    if status_code == 200:
+        assert [d.decision for d in got] == ["yes"] * 4
+        assert [d.image_path for d in got] == [image_path, "", image_path, image_path]
+        assert (cache.hits, cache.misses) == (2, 2)
+    else:
+        assert len(cache) == 0  # failures are not cached
+
+
+@pytest.mark.asyncio
+async def test_gemini_decision_cache_sha256s(tmp_path):
+    # GIVEN
+    httpx_client = AsyncMock()
+    httpx_client.post = AsyncMock(
+        return_value=httpx.Response(
+            request=httpx.Request("POST", url="goo.gell.com"),
+            status_code=200,
+            json={
+                "candidates": [{"content": {"parts": [{"text": "yes"}]}}],
+                "usageMetadata": {"totalTokenCount": 260},
+            },
+        )
+    )
+    cache = DecisionCache(tmp_path / "decisions.sqlite")
+    gemini = Gemini(
+        httpx_client=httpx_client,
+        model="hello",
+        api_key="key",
+        tries=1,
+        decision_cache=cache,
+    )
+    image_path = "tests/integration/data/google-logo.png"
+    with open(image_path, "rb") as f:
+        contents = f.read()
+    sha256 = hashlib.sha256(contents).hexdigest()
+    # WHEN
+    await gemini.chat("Yes?", image_paths=[image_path])
+    with patch("similar_images.gemini.sha256") as hasher:
+        got = await gemini.chat(
+            "Yes?", image_contents=[contents], image_sha256s=[sha256]
+        )
+    # THEN
+    hasher.assert_not_called()
+    assert got.decision == "yes"
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert httpx_client.post.call_count == 1
+
+
 def test_decision_answer():
     # GIVEN
     decision = Decision(
@@ -119,3 +234,36 @@ def test_decision_answer():
     got = decision.answer()
     # THEN
     assert got == "no"
+
+
+def test_decision_answer_failed():
+    # GIVEN
+    decision = Decision(
+        image_path="",
+        content={},
+        block=None,
+        text=None,
+        decision=None,
+        status_code=400,
+        usage=None,
+    )
+    # WHEN / THEN
+    assert decision.failed()
+    assert decision.answer() is None
+
+
+@pytest.mark.parametrize(
+    "text,n,expected",
+    [
+        ('{"1": "yes", "2": "no"}', 2, ["yes", "no"]),
+        ('Sure! ```json\n{"2": "no", "1": "yes"}\n```', 2, ["yes", "no"]),
+        ('{"1": {"answer": "yes"}}', 1, ['{"answer": "yes"}']),
+        ('{"1": "yes"}', 2, None),
+        ('{"1": "yes", "2": "no", "3": "no"}', 2, None),
+        ('["yes", "no"]', 2, None),
+        ("yes", 1, None),
+        (None, 1, None),
+    ],
+)
+def test_parse_batch_answers(text, n, expected):
+    assert parse_batch_answers(text, n) == expected
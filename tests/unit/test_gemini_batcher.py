@@ -0,0 +1,192 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+
+from similar_images.decision_cache import DecisionCache
+from similar_images.gemini import Gemini
+from similar_images.gemini_batcher import GeminiBatcher
+from similar_images.rate_limiter import RateLimiter
+from similar_images.retry_policy import RetryPolicy
+
+
+def _response(text: str) -> httpx.Response:
+    return httpx.Response(
+        request=httpx.Request("POST", url="goo.gell.com"),
+        status_code=200,
+        json={
+            "candidates": [{"content": {"parts": [{"text": text}]}}],
+            "usageMetadata": {"totalTokenCount": 300},
+        },
+    )
+
+
+def _gemini(batch_text: str, decision_cache=None) -> tuple[Gemini, AsyncMock]:
+    async def post(url, json):
+        images = len(json["contents"]["parts"]) - 1
+        return _response(batch_text if images > 1 else "single")
+
+    httpx_client = AsyncMock()
+    httpx_client.post = AsyncMock(side_effect=post)
+    gemini = Gemini(
+        httpx_client=httpx_client,
+        model="hello",
+        api_key="key",
+        rate_limiter=RateLimiter(),
+        decision_cache=decision_cache,
+    )
+    return gemini, httpx_client
+
+
+@pytest.mark.asyncio
+async def test_gemini_chat_batch(tmp_path):
+    # GIVEN
+    cache = DecisionCache(tmp_path / "decisions.sqlite")
+    gemini, httpx_client = _gemini('```json\n{"1": "Yes", "2": "no"}\n```', cache)
+    # WHEN
+    got = await gemini.chat_batch("Cat?", [b"image1", b"image2"], ["PNG", "PNG"])
+    # THEN
+    assert [d.decision for d in got] == ["yes", "no"]
+    assert [d.usage for d in got] == [{"totalTokenCount": 150}] * 2
+    request = httpx_client.post.call_args.kwargs["json"]
+    assert request["generationConfig"] == {"max_output_tokens": 1000}
+    assert request["contents"]["parts"][0]["text"].startswith("Cat?\n\n")
+    # Cached as if asked one by one
+    single = await gemini.chat("Cat?", image_contents=[b"image2"])
+    assert single.decision == "no"
+    assert httpx_client.post.call_count == 1
+
+
+@pytest.mark.parametrize(
+    "batch_size,expected_posts,expected_decisions",
+    [
+        (1, 3, ["single"] * 3),
+        (2, 2, ["yes", "no", "single"]),
+        (3, 1, ["yes", "no", "maybe"]),
+        (4, 1, ["yes", "no", "maybe"]),  # sent after `max_wait`
+    ],
+)
+@pytest.mark.asyncio
+async def test_gemini_batcher(batch_size, expected_posts, expected_decisions):
+    # GIVEN
+    gemini, httpx_client = _gemini(
+        '{"1": "yes", "2": "no", "3": "maybe"}'
+        if batch_size > 2
+        else '{"1": "yes", "2": "no"}'
+    )
+    batcher = GeminiBatcher(gemini, batch_size=batch_size, max_wait=0.01)
+    # WHEN
+    got = await asyncio.gather(
+        *(batcher.chat("Cat?", f"image{i}".encode(), "PNG") for i in range(3))
+    )
+    # THEN
+    assert [d.decision for d in got] == expected_decisions
+    assert httpx_client.post.call_count == expected_posts
+    assert batcher.fell_back == 0
+
+
+@pytest.mark.parametrize(
+    "batch_text",
+    ["yes", '{"1": "yes"}', '{"1": "yes", "2": "no", "3": "maybe"}', "{1: yes}"],
+)
+@pytest.mark.asyncio
+async def test_gemini_batcher_fall_back(batch_text):
+    # GIVEN
+    gemini, httpx_client = _gemini(batch_text)
+    batcher = GeminiBatcher(gemini, batch_size=2)
+    # WHEN
+    got = await asyncio.gather(
+        batcher.chat("Cat?", b"image1", "PNG"), batcher.chat("Cat?", b"image2", "PNG")
+    )
+    # THEN
+    assert [d.decision for d in got] == ["single", "single"]
+    assert httpx_client.post.call_count == 3
+    assert (batcher.batches, batcher.fell_back) == (1, 1)
+
+
+def test_gemini_batcher_loops():
+    # GIVEN
+    gemini, httpx_client = _gemini('{"1": "yes", "2": "no"}')
+    batcher = GeminiBatcher(gemini, batch_size=3, max_wait=0.01)
+
+    async def cancelled():
+        task = asyncio.create_task(batcher.chat("Cat?", b"image1", "PNG"))
+        await asyncio.sleep(0)
+        task.cancel()
+
+    async def chat():
+        return await asyncio.wait_for(batcher.chat("Cat?", b"image2", "PNG"), 1)
+
+    # WHEN
+    asyncio.run(cancelled())
+    got = asyncio.run(chat())
+    # THEN
+    assert got.decision == "single"
+    assert httpx_client.post.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_gemini_batcher_failed():
+    # GIVEN
+    httpx_client = AsyncMock()
+    httpx_client.post = AsyncMock(
+        return_value=httpx.Response(
+            request=httpx.Request("POST", url="goo.gell.com"), status_code=503
+        )
+    )
+    gemini = Gemini(
+        httpx_client=httpx_client,
+        model="hello",
+        api_key="key",
+        rate_limiter=RateLimiter(),
+        retry_policy=RetryPolicy(tries=2, base_sleep=0, max_sleep=0),
+    )
+    batcher = GeminiBatcher(gemini, batch_size=2)
+    # WHEN
+    got = await asyncio.gather(
+        batcher.chat("Cat?", b"image1", "PNG"), batcher.chat("Cat?", b"image2", "PNG")
+    )
+    # THEN no fall back to single images
+    assert [d.failed() for d in got] == [True, True]
+    assert httpx_client.post.call_count == 2
+    assert (batcher.batches, batcher.fell_back) == (1, 0)
+
+
+@pytest.mark.asyncio
+async def test_gemini_batcher_cancel_sent():
+    # GIVEN
+    cancelled = asyncio.Event()
+
+    async def post(url, json):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    httpx_client = AsyncMock()
+    httpx_client.post = AsyncMock(side_effect=post)
+    gemini = Gemini(
+        httpx_client=httpx_client,
+        model="hello",
+        api_key="key",
+        rate_limiter=RateLimiter(),
+    )
+    batcher = GeminiBatcher(gemini, batch_size=2)
+    tasks = [
+        asyncio.create_task(batcher.chat("Cat?", f"image{i}".encode(), "PNG"))
+        for i in range(2)
+    ]
+    while not httpx_client.post.call_count:
+        await asyncio.sleep(0)
+    # WHEN
+    tasks[0].cancel()
+    await asyncio.sleep(0)
+    assert not cancelled.is_set()  # still waited for by the other caller
+    tasks[1].cancel()
+    # THEN
+    await asyncio.wait_for(cancelled.wait(), 1)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert not batcher._tasks
@@ -0,0 +1,172 @@
+import random
+
+import numpy as np
+import pytest
+
+from similar_images.hash_index import (
+    HammingIndex,
+    HashMatrix,
+    KeyIndex,
+    near_duplicate_hash,
+)
+
+
+def _flip_bits(value: int, n: int, rng: random.Random) -> int:
+    for bit in rng.sample(range(64), n):
+        value ^= 1 << bit
+    return value
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+@pytest.mark.parametrize("max_distance", [0, 1, 2, 3, 4])
+def test_hamming_index_matches_linear_scan(max_distance, bulk):
+    # GIVEN
+    rng = random.Random(42)
+    records = []
+    for _ in range(2_000):
+        records.append(
+            {
+                "a": f"{rng.getrandbits(64):016x}",
+                "p": f"{rng.getrandbits(64):016x}",
+            }
+        )
+    index = HammingIndex(max_distance=3)
+    if bulk:
+        index.extend(records[:1_000])
+        for pos, hashes in enumerate(records[1_000:1_500], start=1_000):
+            index.add(pos, hashes)
+        index.extend(records[1_500:])
+    else:
+        for pos, hashes in enumerate(records):
+            index.add(pos, hashes)
+    queries = []
+    for _ in range(300):
+        hashes = rng.choice(records)
+        k = rng.choice(["a", "p"])
+        value = _flip_bits(int(hashes[k], 16), rng.randint(0, 5), rng)
+        queries.append({k: f"{value:016x}"})
+    # WHEN
+    got = [index.find(q, max_distance) for q in queries]
+    # THEN
+    expected = [
+        next(
+            (
+                pos
+                for pos, hashes in enumerate(records)
+                if near_duplicate_hash(hashes, q, max_distance)
+            ),
+            None,
+        )
+        for q in queries
+    ]
+    assert got == expected
+    assert any(pos is not None for pos in got)
+    assert any(pos is None for pos in got)
+
+
+@pytest.mark.parametrize(
+    "hashes,expected",
+    [
+        ({}, None),
+        ({"x": "0f2787ff93c5c3c1"}, None),
+        ({"a": "0f2787ff93c5c3c1"}, 0),
+        ({"a": "0f2787ff93c5c3c0"}, 0),
+        ({"p": "b617333949f8383c"}, 0),
+        ({"a": "02200040006"}, 1),
+        ({"a": "ffffffffffffffffffff"}, 2),
+        ({"a": "fffffffffffffffffffc"}, 2),
+        ({"a": "zzz"}, None),
+    ],
+)
+def test_hamming_index_find(hashes, expected):
+    # GIVEN
+    index = HammingIndex(max_distance=2)
+    index.add(0, {"a": "0f2787ff93c5c3c1", "p": "b617333949f8383c"})
+    index.add(1, {"a": "03200040006"})
+    index.add(2, {"a": "ffffffffffffffffffff"})  # wider than 64 bits
+    index.add(3, {"a": "0f2787ff93c5c3c1", "w": "not hex"})
+    # WHEN
+    got = index.find(hashes)
+    # THEN
+    assert got == expected
+
+
+@pytest.mark.parametrize(
+    "hashes,max_distance,expected",
+    [
+        ({"a": "0f2787ff93c5c3c1"}, 2, 1),
+        ({"a": "0f2787ff93c5c3c1", "p": "0000000000000001"}, 2, 0),
+        ({"a": "0f2787ff93c5c3c1", "p": "000000000000000f"}, 2, 1),
+        ({"a": "0f2787ff93c5c3c1", "p": "000000000000000f"}, 4, 0),
+        ({"a": "10000000000000000"}, 1, 0),  # 65 bits
+        ({"x": "1234"}, 0, 2),
+        ({"x": "1235"}, 0, None),
+    ],
+)
+def test_hash_matrix_find(hashes, max_distance, expected):
+    # GIVEN
+    matrix = HashMatrix()
+    matrix.set(0, {"p": "0000000000000000", "a": "0000000000000000"})
+    matrix.set(1, {"a": "0f2787ff93c5c3c1"})
+    matrix.set(2, {"x": "1234"})
+    # WHEN
+    got = matrix.find(hashes, max_distance)
+    # THEN
+    assert got == expected
+
+
+def test_hash_matrix_grow():
+    # GIVEN
+    matrix = HashMatrix()
+    # WHEN
+    for pos in range(5_000):
+        matrix.set(pos, {"d": f"{pos:016x}"})
+    # THEN
+    assert len(matrix) == 5_000
+    assert matrix.find({"d": f"{4_321:016x}"}, max_distance=0) == 4_321
+    assert matrix.find({"d": f"{4_321:016x}"}, max_distance=1) == 225  # 0x10e1 ^ 0x1000
+
+
+@pytest.mark.parametrize("run_size", [1, 7, 100])
+def test_key_index_matches_linear_scan(run_size):
+    # GIVEN
+    rng = random.Random(42)
+    keys = [rng.randrange(50) for _ in range(3_000)]
+    index = KeyIndex(np.array(keys[:1_000], dtype=np.uint64), max_tail=64)
+    for start in range(1_000, len(keys), run_size):
+        run = keys[start : start + run_size]
+        index.extend(
+            np.array(run, dtype=np.uint64),
+            np.arange(start, start + len(run), dtype=np.uint32),
+        )
+    # WHEN
+    got = [index.positions(key) for key in range(51)]
+    between = index.between(10, 19)
+    # THEN
+    assert got == [
+        [pos for pos in reversed(range(len(keys))) if keys[pos] == key]
+        for key in range(51)
+    ]
+    assert between.tolist() == [pos for pos, k in enumerate(keys) if 10 <= k <= 19]
+    assert index.positions(3) == got[3]
+
+
+def test_key_index_small_runs_keep_sorted_keys():
+    # GIVEN
+    index = KeyIndex(np.arange(10_000, dtype=np.uint64), max_tail=64)
+    sorted_keys = index._keys
+    # WHEN
+    for pos in range(10_000, 10_060):
+        index.extend(np.array([pos % 7], dtype=np.uint64), np.array([pos]))
+    # THEN
+    assert index._keys is sorted_keys
+    assert index.positions(3) == [
+        *(pos for pos in reversed(range(10_000, 10_060)) if pos % 7 == 3),
+        3,
+    ]
+    # WHEN
+    index.extend(np.full(2_000, 3, dtype=np.uint64), np.arange(20_000, 22_000))
+    # THEN
+    assert index._keys is not sorted_keys
+    assert len(index._keys) == 12_060
+    assert index.positions(3)[:2] == [21_999, 21_998]
@@ -0,0 +1,93 @@
+import asyncio
+import io
+
+import imagehash
+import pytest
+from PIL import Image
+
+from similar_images.hashing import Hasher, image_hashes, sha256
+
+
+def _image_bytes(img: Image.Image, fmt: str = "PNG") -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def test_image_hashes():
+    # GIVEN
+    img = Image.radial_gradient(mode="L")
+    # WHEN
+    hashes = image_hashes(img)
+    # THEN
+    assert hashes == {
+        "a": "ffc381818181c3ff",
+        "p": "ee989837e69ac819",
+        "d": "0f0f0f0f0f0f0f0f",
+        "dv": "00000000ffffffff",
+        "w": "ffc381818181c3ff",
+    }
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+@pytest.mark.asyncio
+async def test_hasher(workers):
+    # GIVEN
+    images = [
+        Image.radial_gradient(mode="L"),
+        Image.linear_gradient(mode="L"),
+        Image.new(mode="RGB", size=(500, 500)),
+    ]
+    contents = [_image_bytes(img) for img in images]
+    hasher = Hasher(workers, max_pending=1)
+    # WHEN
+    got_sha256 = await asyncio.gather(*[hasher.sha256(c) for c in contents])
+    got_hashes = await asyncio.gather(
+        *[hasher.image_hashes(c, Image.open(io.BytesIO(c))) for c in contents]
+    )
+    hasher.close()
+    # THEN
+    assert got_sha256 == [sha256(c) for c in contents]
+    assert got_hashes == [image_hashes(img) for img in images]
+
+
+def _imagehash_hashes(img: Image.Image) -> dict[str, str]:
+    return {
+        "a": str(imagehash.average_hash(img)),
+        "p": str(imagehash.phash(img)),
+        "d": str(imagehash.dhash(img)),
+        "dv": str(imagehash.dhash_vertical(img)),
+        "w": str(imagehash.whash(img)),
+    }
+
+
+@pytest.mark.parametrize(
+    "img",
+    [
+        Image.radial_gradient(mode="L"),
+        Image.linear_gradient(mode="L").rotate(30).resize((640, 300)),
+        Image.new(mode="RGB", size=(500, 500), color=(10, 200, 30)),
+        Image.new(mode="RGB", size=(10, 10)),
+        Image.effect_noise((700, 1000), 64).convert("RGB"),
+        Image.effect_mandelbrot((1200, 500), (-2, -1.5, 1, 1.5), 100),
+    ],
+)
+@pytest.mark.parametrize("fmt", ["PNG", "JPEG"])
+def test_image_hashes_same_as_imagehash(img, fmt):
+    # GIVEN
+    img = Image.open(io.BytesIO(_image_bytes(img, fmt)))
+    # WHEN
+    hashes = image_hashes(img)
+    # THEN
+    assert hashes == _imagehash_hashes(img)
+
+
+def test_image_hashes_types():
+    # GIVEN
+    img = Image.radial_gradient(mode="L")
+    # WHEN
+    hashes = image_hashes(img, ["w", "d"])
+    # THEN
+    assert hashes == {"w": "ffc381818181c3ff", "d": "0f0f0f0f0f0f0f0f"}
+    with pytest.raises(ValueError):
+        image_hashes(img, ["x"])
@@ -0,0 +1,149 @@
+import hashlib
+import io
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+from PIL import Image
+
+from similar_images.gemini import Gemini
+from similar_images.image_encoder import (
+    ImageEncoder,
+    encode_image,
+    get_image_encoder,
+)
+from similar_images.rate_limiter import RateLimiter
+
+
+def _image_bytes(size: tuple[int, int], mode: str = "RGB", format: str = "PNG"):
+    img = Image.effect_noise(size, 64).convert(mode)
+    contents = io.BytesIO()
+    img.save(contents, format=format)
+    return contents.getvalue()
+
+
+@pytest.mark.parametrize(
+    "size,mode,format,max_edge,image_format,expected_size,expected_format",
+    [
+        ((400, 200), "RGB", "PNG", 200, "JPEG", (200, 100), "JPEG"),
+        ((400, 200), "RGBA", "PNG", 100, "JPEG", (100, 50), "JPEG"),
+        ((200, 400), "P", "PNG", 100, "WEBP", (50, 100), "WEBP"),
+        ((200, 400), "RGB", "PNG", None, "JPEG", (200, 400), "JPEG"),
+        ((200, 400), "RGB", "PNG", 400, "PNG", (200, 400), "PNG"),
+        ((100, 100), "RGB", "JPEG", 200, "JPEG", (100, 100), "JPEG"),
+    ],
+)
+def test_encode_image(
+    size, mode, format, max_edge, image_format, expected_size, expected_format
+):
+    # GIVEN
+    contents = _image_bytes(size, mode, format)
+    # WHEN
+    got, got_format = encode_image(contents, max_edge, image_format, 80)
+    # THEN
+    img = Image.open(io.BytesIO(got))
+    assert (img.size, img.format, got_format) == (
+        expected_size,
+        expected_format,
+        expected_format,
+    )
+    if format == image_format and max(size) <= (max_edge or 0):
+        assert got == contents  # untouched
+    else:
+        assert len(got) < len(contents)
+
+
+def test_encode_image_exif_orientation():
+    # GIVEN
+    img = Image.effect_noise((400, 200), 64).convert("RGB")
+    exif = Image.Exif()
+    exif[0x0112] = 6  # orientation: rotated 90° clockwise
+    contents = io.BytesIO()
+    img.save(contents, format="JPEG", exif=exif)
+    # WHEN
+    got, _ = encode_image(contents.getvalue(), 100, "JPEG", 80)
+    # THEN
+    got_img = Image.open(io.BytesIO(got))
+    assert got_img.size == (50, 100)
+    assert got_img.getexif().get(0x0112) is None
+
+
+@pytest.mark.asyncio
+async def test_image_encoder_cache():
+    # GIVEN
+    encoder = ImageEncoder(max_edge=100, workers=2, cache_size=1)
+    image1 = _image_bytes((200, 200))
+    image2 = _image_bytes((300, 300))
+    # WHEN
+    with patch(
+        "similar_images.image_encoder.encode_image", wraps=encode_image
+    ) as mock_encode:
+        got = [
+            await encoder.encode(image1),
+            await encoder.encode(image1),
+            await encoder.encode(image2),
+            await encoder.encode(image1),
+        ]
+    # THEN
+    assert mock_encode.call_count == 3  # image1 evicted by image2
+    assert got[0] == got[1] == got[3]
+    assert encoder.bytes_in == 3 * len(image1) + len(image2)
+    assert encoder.bytes_out == 3 * len(got[0][0]) + len(got[2][0])
+    encoder.close()
+
+
+@pytest.mark.asyncio
+async def test_image_encoder_sha256():
+    # GIVEN
+    encoder = ImageEncoder(max_edge=100)
+    image = _image_bytes((200, 200))
+    sha256 = hashlib.sha256(image).hexdigest()
+    # WHEN
+    with patch("similar_images.image_encoder.hashlib.sha256") as hasher:
+        got = [await encoder.encode(image, sha256), await encoder.encode(image, sha256)]
+    # THEN
+    hasher.assert_not_called()
+    assert got[0] == got[1]
+    assert list(encoder._cache) == [sha256]
+
+
+def test_get_image_encoder():
+    # WHEN
+    encoder = get_image_encoder(max_edge=512)
+    # THEN
+    assert get_image_encoder(max_edge=512, image_format="jpeg") is encoder
+    assert get_image_encoder(max_edge=1024) is not encoder
+
+
+@pytest.mark.asyncio
+async def test_gemini_image_encoder():
+    # GIVEN
+    httpx_client = AsyncMock()
+    httpx_client.post = AsyncMock(
+        return_value=httpx.Response(
+            request=httpx.Request("POST", url="goo.gell.com"),
+            status_code=200,
+            json={
+                "candidates": [{"content": {"parts": [{"text": "yes"}]}}],
+                "usageMetadata": {"totalTokenCount": 260},
+            },
+        )
+    )
+    image_path = "tests/integration/data/google-logo.png"
+    gemini = Gemini(
+        httpx_client=httpx_client,
+        model="hello",
+        api_key="key",
+        rate_limiter=RateLimiter(),
+        image_encoder=ImageEncoder(max_edge=16),
+    )
+    # WHEN
+    got = await gemini.chat("Yes?", image_paths=[image_path])
+    # THEN
+    assert got.decision == "yes"
+    assert got.image_path == image_path
+    parts = httpx_client.post.call_args.kwargs["json"]["contents"]["parts"]
+    assert parts[1]["inline_data"]["mime_type"] == "image/JPEG"
+    assert gemini.decision_key("Yes?", [image_path], []) != Gemini(
+        httpx_client=httpx_client, model="hello", api_key="key"
+    ).decision_key("Yes?", [image_path], [])
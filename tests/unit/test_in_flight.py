@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from similar_images.in_flight import InFlight
+
+
+@pytest.mark.parametrize(
+    "field,value1,value2,expected_wait",
+    [
+        ("url", "http1", "http1", True),
+        ("url", "http1", "http2", False),
+        ("hashstr", "abc", "abc", True),
+        ("hashes", {"a": "0f2787ff93c5c3c1"}, {"a": "0f2787ff93c5c3c0"}, True),
+        ("hashes", {"a": "0f2787ff93c5c3c1"}, {"a": "f0d87800936c3c3e"}, False),
+        ("hashes", {"a": "0f2787ff93c5c3c1"}, {"p": "0f2787ff93c5c3c1"}, False),
+    ],
+)
+@pytest.mark.parametrize(
+    "stored,code", [(False, None), (False, "small"), (True, "new"), (True, "llm")]
+)
+@pytest.mark.asyncio
+async def test_in_flight_claim(field, value1, value2, expected_wait, stored, code):
+    # GIVEN
+    in_flight = InFlight()
+    claims1 = []
+    claims2 = []
+    assert await in_flight.claim(field, value1, claims1) is None
+    # WHEN
+    task = asyncio.create_task(in_flight.claim(field, value2, claims2))
+    await asyncio.sleep(0)
+    waiting = not task.done()
+    in_flight.release(claims1, stored=stored, code=code)
+    got = await task
+    # THEN
+    assert waiting == expected_wait
+    reused = expected_wait and (stored or (code is not None and field != "hashes"))
+    assert got == ((stored, code) if reused else None)
+    assert not claims1
+    assert len(claims2) == (0 if reused else 1)
+    assert len(in_flight) == len(claims2)
+
+
+@pytest.mark.asyncio
+async def test_in_flight_clear():
+    # GIVEN
+    in_flight = InFlight()
+    claims = []
+    await in_flight.claim("url", "http1", claims)
+    await in_flight.claim("hashes", {"a": "0f2787ff93c5c3c1"}, claims)
+    task = asyncio.create_task(in_flight.claim("url", "http1", []))
+    await asyncio.sleep(0)
+    # WHEN
+    in_flight.clear()
+    # THEN
+    assert await task is None
+    assert len(in_flight) == 1  # claimed by the waiting task
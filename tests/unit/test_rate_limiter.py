@@ -0,0 +1,118 @@
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+
+from similar_images.gemini import Gemini
+from similar_images.rate_limiter import RateLimiter, TokenBucket, get_rate_limiter
+
+
+@pytest.fixture
+def mock_time():
+    with patch("similar_images.rate_limiter.time") as mock_time:
+        mock_time.monotonic.return_value = 1000.0
+        yield mock_time
+
+
+def test_token_bucket(mock_time):
+    # GIVEN
+    bucket = TokenBucket(60)
+    # WHEN
+    bucket.take(60)
+    # THEN
+    assert bucket.wait_time(1) == 1
+    assert bucket.wait_time(120) == 60  # at most the whole bucket
+    mock_time.monotonic.return_value += 30
+    assert bucket.level() == 30
+    mock_time.monotonic.return_value += 60
+    assert bucket.level() == 60
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_rpm(mock_time):
+    # GIVEN
+    rate_limiter = RateLimiter(rpm=10)
+    # WHEN
+    for _ in range(10):
+        await rate_limiter.acquire()
+    # THEN
+    assert rate_limiter.waited == 0
+    assert rate_limiter.wait_time() == 6
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_tpm(mock_time):
+    # GIVEN
+    rate_limiter = RateLimiter(tpm=3000)
+    # WHEN
+    estimate = await rate_limiter.acquire()
+    rate_limiter.record(estimate, {"totalTokenCount": 1000})
+    estimate = await rate_limiter.acquire()
+    rate_limiter.record(estimate, {"totalTokenCount": 1500})
+    # THEN
+    assert estimate == 1000  # learnt from the first request
+    assert rate_limiter.wait_time() == pytest.approx((1100 - 500) / 3000 * 60)
+
+
+@pytest.mark.parametrize("rpm,expected_rate", [(None, 8), (100, 8), (12, 8)])
+@pytest.mark.asyncio
+async def test_rate_limiter_throttle(mock_time, rpm, expected_rate):
+    # GIVEN
+    rate_limiter = RateLimiter(rpm=rpm)
+    for _ in range(10):
+        mock_time.monotonic.return_value += 5
+        await rate_limiter.acquire()
+    # WHEN
+    rate_limiter.throttle(20)
+    # THEN
+    assert rate_limiter.throttled == 1
+    assert rate_limiter._requests.rate == expected_rate
+    assert rate_limiter.wait_time() >= 20
+    # Successes raise the budget back, up to `rpm`
+    for _ in range(5):
+        rate_limiter.record(0, None)
+    assert rate_limiter._requests.rate == min(expected_rate + 5, rpm or 1000)
+
+
+def test_get_rate_limiter():
+    # WHEN
+    rate_limiter = get_rate_limiter("test_get_rate_limiter")
+    # THEN
+    assert get_rate_limiter("test_get_rate_limiter", rpm=10) is rate_limiter
+    assert rate_limiter.rpm == 10
+    assert get_rate_limiter("test_get_rate_limiter_2") is not rate_limiter
+
+
+@pytest.mark.asyncio
+async def test_gemini_rate_limiter():
+    # GIVEN
+    request = httpx.Request("POST", url="goo.gell.com")
+    httpx_client = AsyncMock()
+    httpx_client.post = AsyncMock(
+        side_effect=[
+            httpx.Response(request=request, status_code=429),
+            httpx.Response(
+                request=request,
+                status_code=200,
+                json={
+                    "candidates": [{"content": {"parts": [{"text": "yes"}]}}],
+                    "usageMetadata": {"totalTokenCount": 260},
+                },
+            ),
+        ]
+    )
+    rate_limiter = RateLimiter()
+    gemini = Gemini(
+        httpx_client=httpx_client,
+        model="hello",
+        api_key="key",
+        retry_sleep=0.01,
+        rate_limiter=rate_limiter,
+    )
+    # WHEN
+    got = await gemini.chat("Yes?", image_contents=[b"contents"], image_formats=["PNG"])
+    # THEN
+    assert got.decision == "yes"
+    assert rate_limiter.throttled == 1
+    assert rate_limiter.waited > 0
+    assert rate_limiter._tokens_per_request == 260
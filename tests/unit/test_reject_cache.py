@@ -0,0 +1,40 @@
+import pytest
+
+from similar_images.reject_cache import RejectCache
+
+
+def test_reject_cache(tmp_path):
+    # GIVEN
+    cache = RejectCache(tmp_path / "rejects.sqlite")
+    # WHEN
+    cache.put("http1", "small", (10, 20))
+    cache.put("http2", "err")
+    cache.put("http1", "small", (10, 30))
+    # THEN
+    assert len(cache) == 2
+    assert cache.get("http1").reason == "small"
+    assert cache.get("http1").size == (10, 30)
+    assert cache.get("http2").reason == "err"
+    assert cache.get("http2").size is None
+    assert cache.get("http3") is None
+    cache.close()
+    assert RejectCache(tmp_path / "rejects.sqlite").get("http1").size == (10, 30)
+
+
+@pytest.mark.parametrize(
+    "ttl,err_ttl,expected_small,expected_err",
+    [
+        (100, 100, True, True),
+        (100, -1, True, False),
+        (-1, 100, False, True),
+    ],
+)
+def test_reject_cache_ttl(tmp_path, ttl, err_ttl, expected_small, expected_err):
+    # GIVEN
+    cache = RejectCache(tmp_path / "rejects.sqlite", ttl=ttl, err_ttl=err_ttl)
+    # WHEN
+    cache.put("http1", "small", (10, 20))
+    cache.put("http2", "err")
+    # THEN
+    assert (cache.get("http1") is not None) == expected_small
+    assert (cache.get("http2") is not None) == expected_err
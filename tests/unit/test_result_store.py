@@ -0,0 +1,236 @@
+import datetime
+import random
+import time
+
+import pytest
+
+from similar_images import result_store
+from similar_images.hash_index import HASH_TYPES
+from similar_images.result_store import ResultStore, ResultView
+from similar_images.types import Result
+
+SHA256 = "2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824"
+
+
+@pytest.fixture
+def results():
+    return [
+        Result(
+            url="https://example.com/b.png",
+            hashstr=SHA256,
+            ts=datetime.datetime(2000, 10, 5, 12, 13, 14, 15),
+            query="cats and dogs",
+            hashes={"a": "0f2787ff93c5c3c1", "p": "ee889927e69a9c31"},
+        ),
+        Result(url="https://image.com/a.jpeg", hashstr="abc"),
+        Result(
+            url="http://images.bing.com/extra-é.png",
+            hashstr="xxx",
+            ts=datetime.datetime(2020, 1, 2, tzinfo=datetime.UTC),
+            query="",
+            hashes={"a": "ffffffffffffffffffff", "x": "12", "w": "ABCD"},
+        ),
+        Result(url="https://image.com/a.jpeg", hashstr=SHA256, hashes={}),
+        Result(url="https://image.com/c.jpeg", hashstr="0" * 64, query="cats and dogs"),
+    ]
+
+
+@pytest.fixture(params=["one by one", "in bulk"])
+def bulk(request, monkeypatch):
+    """Store records one by one, or column by column in chunks of 2."""
+    if request.param == "in bulk":
+        monkeypatch.setattr(result_store, "_MIN_BULK_SIZE", 1)
+        monkeypatch.setattr(result_store, "_CHUNK_SIZE", 2)
+
+
+def test_result_store(results, bulk):
+    # GIVEN
+    store = ResultStore()
+    # WHEN
+    for r in results:
+        store.append(r)
+    # THEN
+    assert len(store) == len(results)
+    assert [store.result(pos) for pos in range(len(store))] == results
+    assert store.get("url", "https://image.com/a.jpeg") == results[3]
+    assert store.get("hashstr", SHA256) == results[3]
+    assert store.get("hashstr", "abc") == results[1]
+    assert store.get("url", "http://images.bing.com/extra-é.png") == results[2]
+    assert store.get("url", "https://image.com/b.jpeg") is None
+    assert store.get("query", "cats and dogs") is None
+    assert store.near_duplicate({"p": "ee889927e69a9c30"}, 2) == results[0]
+    assert store.near_duplicate({"a": "fffffffffffffffffffe"}, 2) == results[2]
+    assert store.near_duplicate({"a": "ffffffffffffffff"}, 2) is None
+
+
+def test_result_store_dict(bulk):
+    # GIVEN
+    store = ResultStore()
+    # WHEN
+    store.append({"url": "http1", "hashstr": SHA256, "ts": "2000-10-05T12:13:14"})
+    store.append({"url": "http2", "hashstr": SHA256, "ts": "not a date"})
+    # THEN
+    assert store.view(0).ts == datetime.datetime(2000, 10, 5, 12, 13, 14)
+    assert store.view(1).url == "http2"
+    assert store.view(1).hashstr == SHA256
+    with pytest.raises(ValueError):
+        store.view(1).ts
+
+
+def test_result_view(results):
+    # GIVEN
+    store = ResultStore()
+    store.append(results[0])
+    # WHEN
+    view = store.get("url", results[0].url)
+    # THEN
+    assert isinstance(view, ResultView)
+    assert view.url == results[0].url
+    assert view.hashstr == results[0].hashstr
+    assert view.ts == results[0].ts
+    assert view.query == results[0].query
+    assert view.hashes == results[0].hashes
+    assert view.path is None
+    assert view.dump() == results[0].dump()
+    assert view.to_result() == results[0]
+    assert view == store.view(0)
+    assert view != results[1]
+
+
+def test_result_store_memory_usage(results):
+    # GIVEN
+    store = ResultStore()
+    # WHEN
+    for r in results:
+        store.append(r)
+    # THEN
+    usage = store.memory_usage()
+    assert usage["sha256"] >= 32 * len(results)
+    assert usage["raw"] > 0
+    assert all(size > 0 for size in usage.values())
+
+
+@pytest.mark.parametrize(
+    "prefix,expected",
+    [
+        ("2cf24dba", 0),
+        ("2cf24dba5fb0a30e26e83b", 0),
+        ("2cf24dbb", None),
+        ("2", 0),
+        ("ab", 1),
+        ("abc", 1),
+        ("abcd", None),
+        ("x", 2),
+        ("00000000", 4),
+        ("", 0),
+    ],
+)
+def test_result_store_hashstr_prefix(results, bulk, prefix, expected):
+    # GIVEN
+    store = ResultStore()
+    for r in results:
+        store.append(r)
+    # WHEN
+    got = store.get_by_hashstr_prefix(prefix)
+    # THEN
+    if expected is None:
+        assert got is None
+    else:
+        assert got == results[expected]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 1_000])
+def test_result_store_bulk_matches_one_by_one(monkeypatch, chunk_size):
+    # GIVEN
+    records = [
+        {"url": "http1", "hashstr": SHA256, "ts": "2000-10-05T12:13:14"},
+        {"url": "http2", "hashstr": SHA256, "ts": "2000-10-05T12:13:14.000015"},
+        {"url": "http3", "hashstr": SHA256, "ts": "2000-10-05 12:13:14"},
+        {"url": "http4", "hashstr": SHA256, "ts": "2000-10-05"},
+        {"url": "http5", "hashstr": SHA256, "ts": "2000-10-05T12:13:14+00:00"},
+        {"url": "http6", "hashstr": SHA256, "ts": "2000-02-30T12:13:14"},
+        {"url": "http7", "hashstr": SHA256, "ts": "0000-10-05T12:13:14"},
+        {"url": "http8", "hashstr": SHA256, "ts": "2000-10-05T12:13:1x"},
+        {"url": "http9", "hashstr": SHA256, "ts": None},
+        {"url": "http10", "hashstr": SHA256, "ts": 12},
+        {"url": "http-é", "hashstr": SHA256.upper()},
+        {"url": "http12", "hashstr": "é" * 64},
+        {"url": "http13", "hashstr": "abc", "query": "cats"},
+        {"url": "http14", "hashstr": SHA256, "query": ["cats"]},
+        {"url": "http15", "hashstr": SHA256, "hashes": {"a": "0f2787ff93c5c3c1"}},
+        {"url": "http16", "hashstr": SHA256, "hashes": {"a": "0F2787FF93C5C3C1"}},
+        {"url": "http17", "hashstr": SHA256, "hashes": {"a": None}},
+        {"url": "http18", "hashstr": SHA256, "hashes": {"a": 12, "p": "12"}},
+        {"url": "http19", "hashstr": SHA256, "hashes": {"x": "0f2787ff93c5c3c1"}},
+        {"url": "http20", "hashstr": SHA256, "hashes": {"w": "0f2787ff93c5c3c"}},
+        {"url": "http21", "hashstr": SHA256, "hashes": "0f2787ff93c5c3c1"},
+        {"url": "http22", "hashstr": SHA256, "hashes": {}},
+    ]
+    one_by_one = ResultStore()
+    for r in records:
+        one_by_one.append(r)
+    one_by_one.commit()
+    monkeypatch.setattr(result_store, "_MIN_BULK_SIZE", 1)
+    monkeypatch.setattr(result_store, "_CHUNK_SIZE", chunk_size)
+    # WHEN
+    bulk = ResultStore()
+    for r in records:
+        bulk.append(r)
+    bulk.commit()
+    # THEN
+    for store in (one_by_one, bulk):
+        assert store.view(1).ts == datetime.datetime(2000, 10, 5, 12, 13, 14, 15)
+        assert store.view(13).hashstr == SHA256
+        assert store.near_duplicate({"a": "0f2787ff93c5c3c0"}, 2) == store.view(14)
+    assert bulk._flags == one_by_one._flags
+    assert bulk._raw.keys() == one_by_one._raw.keys()
+    assert bulk._sha256 == one_by_one._sha256
+    assert bulk._ts == one_by_one._ts
+    assert [bulk.view(pos).url for pos in range(len(bulk))] == [
+        r["url"] for r in records
+    ]
+    for pos, r in enumerate(records):
+        assert _pos(bulk.get("url", r["url"])) == pos
+        for h in [r["hashstr"], r["hashstr"][:3]]:
+            assert _pos(bulk.get_by_hashstr_prefix(h)) == _pos(
+                one_by_one.get_by_hashstr_prefix(h)
+            )
+        if isinstance(r.get("hashes"), dict):
+            for k, h in r["hashes"].items():
+                if isinstance(h, str):
+                    assert _pos(bulk.near_duplicate({k: h}, 0)) == _pos(
+                        one_by_one.near_duplicate({k: h}, 0)
+                    )
+
+
+def _pos(view: ResultView | None) -> int | None:
+    return view._pos if view is not None else None
+
+
+def test_speed_result_store_bulk(monkeypatch):
+    # GIVEN
+    N = 20_000
+    rng = random.Random(42)
+    records = [
+        {
+            "url": f"https://images.example.com/{i}.jpeg",
+            "hashstr": f"{rng.getrandbits(256):064x}",
+            "ts": f"2024-01-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}",
+            "query": f"cats {i % 50}",
+            "hashes": {k: f"{rng.getrandbits(64):016x}" for k in HASH_TYPES},
+        }
+        for i in range(N)
+    ]
+    times = {}
+    # WHEN
+    for name, min_bulk_size in [("bulk", 64), ("one by one", N + 1)]:
+        monkeypatch.setattr(result_store, "_MIN_BULK_SIZE", min_bulk_size)
+        store = ResultStore()
+        start_time = time.perf_counter()
+        for r in records:
+            store.append(r)
+        store.commit()
+        times[name] = time.perf_counter() - start_time
+    # THEN
+    assert not store._raw
+    assert times["bulk"] <= times["one by one"] / 3, times
@@ -0,0 +1,127 @@
+import asyncio
+import email.utils
+import time
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+
+from similar_images.gemini import Gemini
+from similar_images.rate_limiter import RateLimiter
+from similar_images.retry_policy import RetryPolicy
+
+REQUEST = httpx.Request("POST", url="goo.gell.com")
+OK = {
+    "candidates": [{"content": {"parts": [{"text": "yes"}]}}],
+    "usageMetadata": {"totalTokenCount": 260},
+}
+
+
+def _status_error(status_code: int, headers: dict | None = None):
+    response = httpx.Response(status_code, headers=headers, request=REQUEST)
+    return httpx.HTTPStatusError("error", request=REQUEST, response=response)
+
+
+@pytest.mark.parametrize(
+    "ex,expected",
+    [
+        (_status_error(429), True),
+        (_status_error(503), True),
+        (_status_error(400), False),
+        (_status_error(404), False),
+        (httpx.ReadTimeout("timeout", request=REQUEST), True),
+        (httpx.ConnectError("refused", request=REQUEST), True),
+        (ValueError(), False),
+    ],
+)
+def test_retryable(ex, expected):
+    assert RetryPolicy().retryable(ex) == expected
+
+
+@pytest.mark.parametrize(
+    "previous,headers,expected_min,expected_max",
+    [
+        (0, None, 1, 1),
+        (2, None, 1, 6),
+        (100, None, 1, 20),
+        (0, {"retry-after": "30"}, 30, 30),
+        (0, {"retry-after": "soon"}, 1, 1),
+        (
+            0,
+            {"retry-after": email.utils.formatdate(time.time() + 1000, usegmt=True)},
+            900,  # some time has passed since collecting the tests
+            1000,
+        ),
+    ],
+)
+def test_sleep_time(previous, headers, expected_min, expected_max):
+    # GIVEN
+    policy = RetryPolicy(base_sleep=1, max_sleep=20)
+    # WHEN
+    got = [policy.sleep_time(previous, _status_error(503, headers)) for _ in range(20)]
+    # THEN
+    assert all(expected_min <= sleep <= expected_max for sleep in got)
+
+
+def _gemini(side_effect, **kwargs) -> tuple[Gemini, AsyncMock]:
+    httpx_client = AsyncMock()
+    httpx_client.post = AsyncMock(side_effect=side_effect)
+    gemini = Gemini(
+        httpx_client=httpx_client,
+        model="hello",
+        api_key="key",
+        rate_limiter=RateLimiter(),
+        retry_policy=RetryPolicy(base_sleep=0.01, max_sleep=0.01, **kwargs),
+    )
+    return gemini, httpx_client
+
+
+@pytest.mark.parametrize(
+    "responses,expected_decision,expected_posts,expected_retries,expected_gave_up",
+    [
+        ([OK], "yes", 1, 0, 0),
+        ([httpx.ReadTimeout("timeout", request=REQUEST), OK], "yes", 2, 1, 0),
+        ([httpx.ConnectError("refused", request=REQUEST), 503, OK], "yes", 3, 2, 0),
+        ([400, OK], None, 1, 0, 1),
+        ([503, 503, 503], None, 3, 2, 1),
+    ],
+)
+@pytest.mark.asyncio
+async def test_gemini_retry_policy(
+    responses,
+    expected_decision,
+    expected_posts,
+    expected_retries,
+    expected_gave_up,
+):
+    # GIVEN
+    side_effect = []
+    for response in responses:
+        if isinstance(response, int):
+            response = httpx.Response(response, request=REQUEST)
+        elif isinstance(response, dict):
+            response = httpx.Response(200, json=response, request=REQUEST)
+        side_effect.append(response)
+    gemini, httpx_client = _gemini(side_effect, tries=3)
+    # WHEN
+    got = await gemini.chat("Yes?", image_contents=[b"image"], image_formats=["PNG"])
+    # THEN
+    assert got.decision == expected_decision
+    assert httpx_client.post.call_count == expected_posts
+    assert gemini.retry_policy.retries == expected_retries
+    assert gemini.retry_policy.gave_up == expected_gave_up
+
+
+@pytest.mark.asyncio
+async def test_gemini_retry_policy_deadline():
+    # GIVEN
+    async def slow_post(*args, **kwargs):
+        await asyncio.sleep(10)
+
+    gemini, httpx_client = _gemini(slow_post, deadline=0.05)
+    # WHEN
+    got = await gemini.chat("Yes?", image_contents=[b"image"], image_formats=["PNG"])
+    # THEN
+    assert got.decision is None
+    assert httpx_client.post.call_count == 1
+    assert gemini.retry_policy.gave_up == 1
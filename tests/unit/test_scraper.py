@@ -1,3 +1,5 @@
+import asyncio
+import contextlib
 import datetime
 import os
 from io import BytesIO
@@ -14,8 +16,17 @@ from similar_images.filters.db_filters import (
     DbNearDupFilter,
     DbUrlFilter,
 )
+from similar_images.filters.filter import (
+    Filter,
+    FilterInput,
+    FilterResult,
+    FilterStage,
+)
 from similar_images.filters.image_filters import ImageFilter
+from similar_images.hash_index import HASH_TYPES
+from similar_images.hashing import image_hashes, sha256
 from similar_images.image_sources import ImageSource
+from similar_images.reject_cache import RejectCache
 from similar_images.scraper import Scraper, _apply_filters
 from similar_images.types import Result
 
@@ -65,12 +76,18 @@ async def download(url: str) -> bytes:
     )
 
 
+@contextlib.asynccontextmanager
+async def stream(method: str, url: str):
+    yield await download(url)
+
+
 class MockImageSource(ImageSource):
     """Return URLs or paths to images."""
 
-    def get_client(self):
+    def get_client(self, download_cache=None):
         mock_client = AsyncMock()
         mock_client.get = AsyncMock(side_effect=download)
+        mock_client.stream = stream
         return mock_client
 
     async def batches(self):
@@ -92,10 +109,11 @@ class MockImageSource(ImageSource):
                 raise Exception(f"MockImageSource.images: unexpected query: {batch}")
 
 
+@pytest.mark.parametrize("stream", [False, True])
 @patch("similar_images.scraper.datetime")
 @patch("similar_images.scraper.logger")
 @pytest.mark.asyncio
-async def test_scrape_async(mock_logger, mock_datetime, tmp_path):
+async def test_scrape_async(mock_logger, mock_datetime, tmp_path, stream):
     # GIVEN
     mock_datetime.datetime.now.return_value = datetime.datetime(2010, 11, 1, 5, 6, 7)
     db_file = tmp_path / "test_scrape_async.jsonl"
@@ -115,6 +133,7 @@ async def test_scrape_async(mock_logger, mock_datetime, tmp_path):
         debug_outdir=str(debug_dir),
         outdir=outdir,
         count=10,
+        stream=stream,
     )
     # WHEN
     links = await scraper.async_scrape()
@@ -168,3 +187,412 @@ async def test_scrape_async(mock_logger, mock_datetime, tmp_path):
         ),
     ]
     assert mock_logger.debug.call_args_list == expected_debug_calls
+
+
+@pytest.mark.parametrize(
+    "filter_hash_types,scraper_hash_types,expected_hash_types",
+    [
+        (None, None, HASH_TYPES),
+        (["p"], None, HASH_TYPES),
+        (None, [], []),
+        (["p"], [], ["p"]),
+        (["p", "a"], ["w", "p"], ["p", "a", "w"]),
+        (None, ["d"], ["d"]),
+    ],
+)
+@pytest.mark.asyncio
+async def test_scrape_hash_types(
+    tmp_path, filter_hash_types, scraper_hash_types, expected_hash_types
+):
+    # GIVEN
+    db = CrappyDB(tmp_path / "test_scrape_hash_types.jsonl")
+    filters = [DbUrlFilter(db), DbExactDupFilter(db)]
+    if filter_hash_types:
+        filters.append(DbNearDupFilter(db, hash_types=filter_hash_types))
+    scraper = Scraper(
+        image_source=MockImageSource(),
+        db=db,
+        filters=filters,
+        hash_types=scraper_hash_types,
+    )
+    # WHEN
+    with patch(
+        "similar_images.hashing.image_hashes", wraps=image_hashes
+    ) as mock_image_hashes:
+        await scraper.async_scrape()
+    # THEN
+    records = list(db.scan())
+    assert records
+    for r in records:
+        assert set(r.hashes or {}) == set(expected_hash_types)
+    if expected_hash_types:
+        assert mock_image_hashes.call_count >= len(records)
+    else:
+        mock_image_hashes.assert_not_called()
+
+
+@patch("similar_images.scraper.logger")
+@pytest.mark.asyncio
+async def test_scrape_profile(mock_logger, tmp_path):
+    # GIVEN
+    db = CrappyDB(tmp_path / "test_scrape_profile.jsonl")
+    filters = [
+        DbUrlFilter(db),
+        DbExactDupFilter(db),
+        DbNearDupFilter(db),
+        ImageFilter((100, 100), 50_000),
+    ]
+    scraper = Scraper(
+        image_source=MockImageSource(), db=db, filters=filters, profile=True
+    )
+    # WHEN
+    with patch("similar_images.hashing.sha256", wraps=sha256) as mock_sha256:
+        await scraper.async_scrape()
+    # THEN
+    # 5 links downloaded (1 dup:url), each hashed once
+    assert mock_sha256.call_count == 5
+    assert scraper.profiled_links == 5
+    assert set(scraper.timings) == {
+        "img",
+        "sha256",
+        "hashes",
+        "filters:contents",
+        "filters:hashes",
+        "filters:expensive",
+    }
+    cpu_debug_calls = [
+        c for c in mock_logger.debug.call_args_list if c.args[0].startswith("CPU ")
+    ]
+    assert len(cpu_debug_calls) == 5
+    assert (
+        mock_logger.info.call_args_list[-1]
+        .args[0]
+        .startswith("CPU per link n=5 | img:")
+    )
+
+
+def _image_bytes(size: tuple[int, int]) -> bytes:
+    contents = BytesIO()
+    Image.effect_noise(size, 64).save(contents, format="png")
+    return contents.getvalue()
+
+
+@pytest.mark.parametrize(
+    "headers,contents,max_bytes,expected_code,expected_chunks",
+    [
+        ({"content-type": "image/png"}, _image_bytes((500, 500)), None, None, None),
+        ({}, _image_bytes((500, 500)), None, None, None),
+        ({"content-type": "text/html"}, b"<html>" * 10_000, None, "err", 0),
+        ({"content-type": "image/png"}, _image_bytes((10, 10)), None, "small", 1),
+        ({"content-length": "2000"}, _image_bytes((500, 500)), 1000, "err", 0),
+        ({}, _image_bytes((500, 500)), 1000, "err", 2),
+    ],
+    ids=["image", "no headers", "html", "small", "content-length", "max_bytes"],
+)
+@pytest.mark.asyncio
+async def test_scrape_stream(
+    headers, contents, max_bytes, expected_code, expected_chunks
+):
+    # GIVEN
+    chunk_size = 512
+    chunks_read = 0
+
+    async def body():
+        nonlocal chunks_read
+        for i in range(0, len(contents), chunk_size):
+            chunks_read += 1
+            yield contents[i : i + chunk_size]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers=headers, content=body())
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    scraper = Scraper(
+        image_source=MockImageSource(),
+        client=client,
+        filters=[ImageFilter((100, 100), 50_000)],
+        stream=True,
+        max_bytes=max_bytes,
+    )
+    # WHEN
+    got, code = await scraper._stream("http://images.com/a.png", "query")
+    # THEN
+    assert code == expected_code
+    if expected_code is None:
+        assert got == contents
+    else:
+        assert got is None
+        assert chunks_read == expected_chunks
+
+
+class SlowFilter(Filter):
+    """Keeps all images, slowly, and records how many run at the same time."""
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.calls = 0
+
+    def stage(self) -> FilterStage:
+        return "expensive"
+
+    def stat_name(self) -> str:
+        return "slow"
+
+    def inputs(self) -> set[FilterInput]:
+        return {"url"}
+
+    async def filter(self, url: str, **kwargs) -> FilterResult:
+        self.calls += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.running -= 1
+        return FilterResult(keep=True)
+
+
+@pytest.mark.parametrize("expensive_workers", [1, 2])
+@patch("similar_images.scraper.logger")
+@pytest.mark.asyncio
+async def test_scrape_pipeline(mock_logger, tmp_path, expensive_workers):
+    # GIVEN
+    db = CrappyDB(tmp_path / "test_scrape_pipeline.jsonl")
+    slow_filter = SlowFilter()
+    filters = [
+        DbUrlFilter(db),
+        DbExactDupFilter(db),
+        ImageFilter((100, 100), 50_000),
+        slow_filter,
+    ]
+    scraper = Scraper(
+        image_source=MockImageSource(),
+        db=db,
+        filters=filters,
+        stage_workers={"download": 4, "expensive": expensive_workers},
+    )
+    # WHEN
+    await scraper.async_scrape()
+    # THEN
+    assert scraper.stage_workers == {
+        "download": 4,
+        "hash": 1,
+        "expensive": expensive_workers,
+    }
+    assert slow_filter.max_running == expensive_workers
+    last_info = mock_logger.info.call_args_list[-1].args[0]
+    assert last_info.startswith("Cumulative n=3 | links:6 |")
+    assert "small:1" in last_info
+    assert last_info.endswith(f"new:{len(list(db.scan()))}")
+
+
+class CountingFilter(SlowFilter):
+    """Counts its calls in the scraper stats."""
+
+    def stats(self) -> dict[str, int]:
+        return {"slow:calls": self.calls}
+
+
+@patch("similar_images.scraper.logger")
+@pytest.mark.asyncio
+async def test_scrape_filter_stats(mock_logger):
+    # GIVEN
+    scraper = Scraper(
+        image_source=MockImageSource(),
+        filters=[ImageFilter((100, 100), 50_000), CountingFilter()],
+    )
+    # WHEN
+    await scraper.async_scrape()
+    # THEN
+    infos = [c.args[0] for c in mock_logger.info.call_args_list]
+    assert [i for i in infos if i.startswith("Done")] == [
+        "Done query='hello' | links:3 | small:1 slow:0 err:0 slow:calls:2 | new:2",
+        "Done query='world' | links:0 | small:0 slow:0 err:0 slow:calls:0 | new:0",
+        "Done query='!' | links:3 | small:0 slow:0 err:0 slow:calls:3 | new:3",
+    ]
+    assert infos[-1] == (
+        "Cumulative n=3 | links:6 | small:1 slow:0 err:0 slow:calls:5 | new:5"
+    )
+
+
+class EndlessImageSource(MockImageSource):
+    """Yields links forever, like a browser scrolling search results."""
+
+    def __init__(self):
+        self.closed = False
+
+    async def batches(self):
+        for q in ["hello", "world"]:
+            yield q
+
+    async def images(self, batch: str):
+        try:
+            while True:
+                for i in (1, 2):
+                    await asyncio.sleep(0)
+                    yield f"http://images.com/{i}.png"
+        finally:
+            self.closed = True
+
+
+@pytest.mark.parametrize("stage_workers", [None, {"download": 4, "expensive": 2}])
+@patch("similar_images.scraper.logger")
+@pytest.mark.asyncio
+async def test_scrape_quota(mock_logger, stage_workers):
+    # GIVEN
+    image_source = EndlessImageSource()
+    slow_filter = SlowFilter()
+    scraper = Scraper(
+        image_source=image_source,
+        filters=[slow_filter],
+        concurrency=4,
+        count=3,
+        stage_workers=stage_workers,
+    )
+    # WHEN
+    await asyncio.wait_for(scraper.async_scrape(), timeout=10)
+    # THEN
+    assert image_source.closed
+    assert scraper.quota.new == 3
+    assert slow_filter.running == 0  # done or cancelled
+    assert len(mock_logger.info.call_args_list) == 2  # only one query
+    assert mock_logger.info.call_args_list[-1].args[0].endswith("new:3")
+
+
+class SlowRejectFilter(Filter):
+    """Rejects all images, slowly."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def stage(self) -> FilterStage:
+        return "contents"
+
+    def stat_name(self) -> str:
+        return "slow"
+
+    def inputs(self) -> set[FilterInput]:
+        return {"url", "contents"}
+
+    async def filter(self, url: str, **kwargs) -> FilterResult:
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return FilterResult(keep=False, explanation=f"Slow: {url}")
+
+
+class DuplicatesImageSource(MockImageSource):
+    async def batches(self):
+        yield "hello"
+
+    async def images(self, batch: str):
+        yield "http://images.com/1.png"
+        yield "http://images.com/1.png"
+        yield "http://images.com/2.png"  # same image
+        yield "http://google.com/images/img0.jpeg"  # near duplicate
+
+
+@pytest.mark.parametrize("stage_workers", [None, {"download": 4, "expensive": 4}])
+@patch("similar_images.scraper.logger")
+@pytest.mark.asyncio
+async def test_scrape_in_flight(mock_logger, tmp_path, stage_workers):
+    # GIVEN
+    db = CrappyDB(tmp_path / "test_scrape_in_flight.jsonl")
+    slow_filter = SlowFilter()
+    filters = [DbUrlFilter(db), DbExactDupFilter(db), DbNearDupFilter(db), slow_filter]
+    scraper = Scraper(
+        image_source=DuplicatesImageSource(),
+        db=db,
+        filters=filters,
+        concurrency=4,
+        stage_workers=stage_workers,
+    )
+    # WHEN
+    await scraper.async_scrape()
+    # THEN
+    assert slow_filter.calls == 1
+    assert len(list(db.scan())) == 1
+    assert len(scraper.in_flight) == 0
+    assert mock_logger.info.call_args_list[-1] == call(
+        "Cumulative n=1 | links:4 | dup:url:1 dup:hash:1 dup:near:1 slow:0 err:0 | new:1"
+    )
+
+
+@pytest.mark.parametrize("stage_workers", [None, {"download": 4, "expensive": 4}])
+@patch("similar_images.scraper.logger")
+@pytest.mark.asyncio
+async def test_scrape_in_flight_rejected(mock_logger, tmp_path, stage_workers):
+    # GIVEN
+    db = CrappyDB(tmp_path / "test_scrape_in_flight_rejected.jsonl")
+    reject_filter = SlowRejectFilter()
+    filters = [DbUrlFilter(db), DbExactDupFilter(db), reject_filter]
+    scraper = Scraper(
+        image_source=DuplicatesImageSource(),
+        db=db,
+        filters=filters,
+        concurrency=4,
+        stage_workers=stage_workers,
+    )
+    # WHEN
+    await scraper.async_scrape()
+    # THEN the second link with the same URL is neither downloaded nor filtered
+    assert scraper.client.get.call_count == 3
+    assert reject_filter.calls == 3
+    assert not list(db.scan())
+    assert len(scraper.in_flight) == 0
+    assert mock_logger.info.call_args_list[-1] == call(
+        "Cumulative n=1 | links:4 | dup:url:0 dup:hash:0 slow:4 err:0 | new:0"
+    )
+
+
+@pytest.mark.parametrize("stream", [False, True])
+@patch("similar_images.scraper.logger")
+@pytest.mark.asyncio
+async def test_scrape_reject_cache(mock_logger, tmp_path, stream):
+    # GIVEN
+    db = CrappyDB(tmp_path / "test_scrape_reject_cache.jsonl")
+    reject_cache = RejectCache(tmp_path / "rejects.sqlite")
+
+    def scraper():
+        return Scraper(
+            image_source=MockImageSource(),
+            db=db,
+            filters=[DbUrlFilter(db), ImageFilter((100, 100), 50_000)],
+            reject_cache=reject_cache,
+            stream=stream,
+        )
+
+    await scraper().async_scrape()
+    # WHEN
+    mock_logger.reset_mock()
+    await scraper().async_scrape()
+    # THEN
+    assert reject_cache.get("http://images.com/0.png").size == (10, 10)
+    assert mock_logger.info.call_args_list[-1] == call(
+        "Cumulative n=3 | links:6 | cache:reject:1 dup:url:5 small:0 err:0 | new:0"
+    )
+
+
+@patch("similar_images.scraper.logger")
+@pytest.mark.asyncio
+async def test_scrape_reject_cache_min_size(mock_logger, tmp_path):
+    # GIVEN
+    reject_cache = RejectCache(tmp_path / "rejects.sqlite")
+
+    def scraper(min_size):
+        db = CrappyDB(tmp_path / f"test_scrape_reject_cache_{min_size}.jsonl")
+        return Scraper(
+            image_source=MockImageSource(),
+            db=db,
+            filters=[DbUrlFilter(db), ImageFilter((min_size, min_size), 0)],
+            reject_cache=reject_cache,
+        )
+
+    await scraper(100).async_scrape()
+    # WHEN
+    mock_logger.reset_mock()
+    await scraper(10).async_scrape()
+    # THEN the small image is downloaded again
+    assert mock_logger.info.call_args_list[-1] == call(
+        "Cumulative n=3 | links:6 | cache:reject:0 dup:url:1 small:0 err:0 | new:5"
+    )
@@ -0,0 +1,141 @@
+import datetime
+
+import pytest
+
+from similar_images.crappy_db import CrappyDB
+from similar_images.sqlite_db import SqliteDB
+from similar_images.types import Result
+from similar_images.utils import get_database
+
+SHA256 = "2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824"
+
+
+@pytest.fixture
+def results():
+    return [
+        Result(url="https://image.com/a.jpeg", hashstr="abc"),
+        Result(
+            url="https://example.com/b.png",
+            hashstr=SHA256,
+            ts=datetime.datetime(2000, 10, 5, 12, 13, 14, 15),
+            query="cats and dogs",
+            hashes={"a": "0f2787ff93c5c3c1", "p": "03200040006", "dv": "00ff"},
+        ),
+        Result(
+            url="http://images.bing.com/extra-1800.png",
+            hashstr="xxx",
+            ts=datetime.datetime(2020, 1, 2, tzinfo=datetime.UTC),
+            query="",
+            hashes={"a": "ffffffffffffffffffff", "x": "12", "w": "ABCD"},
+        ),
+        Result(url="https://image.com/a.jpeg", hashstr=SHA256, hashes={}),
+    ]
+
+
+def test_sqlite_db_new(tmp_path):
+    # GIVEN
+    db_file = tmp_path / "db.sqlite"
+    # WHEN
+    db = SqliteDB(db_file)
+    # THEN
+    assert len(db) == 0
+    assert not list(db.scan())
+    assert not db.get("url", "https://image.com/a.jpeg")
+    assert not db.near_duplicate({"a": "0f2787ff93c5c3c1"})
+
+
+@pytest.mark.parametrize("reopen", [False, True])
+def test_sqlite_db_put(tmp_path, results, reopen):
+    # GIVEN
+    db_file = tmp_path / "db.sqlite"
+    db = SqliteDB(db_file)
+    db.put(results[0])
+    db.put(results[1])
+    assert db.near_duplicate({"a": "0f2787ff93c5c3c0"}) == results[1]
+    if reopen:
+        db.close()
+        db = SqliteDB(db_file)
+    # WHEN
+    assert db.get("url", "https://example.com/b.png") == results[1]
+    db.put(results[2])
+    db.put(results[3])
+    # THEN
+    assert list(db.scan()) == results
+    assert db.get("url", "https://image.com/a.jpeg") == results[3]
+    assert not db.get("url", "https://image.com/b.jpeg")
+    assert db.get("hashstr", "abc") == results[0]
+    assert db.get("hashstr", SHA256) == results[3]
+    assert not db.get("query", "")
+    assert db.near_duplicate({"p": "02200040006"}) == results[1]
+    assert db.near_duplicate({"a": "fffffffffffffffffffe"}) == results[2]
+    assert db.near_duplicate({"w": "abcf"}) == results[2]
+    assert not db.near_duplicate({"x": "ff"})
+
+
+def test_sqlite_db_buffer_size(tmp_path, results):
+    # GIVEN
+    db_file = tmp_path / "db.sqlite"
+    db = SqliteDB(db_file, buffer_size=3)
+    # WHEN
+    db.put(results[0])
+    db.put(results[1])
+    # THEN
+    assert db.get("hashstr", "abc") == results[0]  # visible before the commit
+    assert len(SqliteDB(db_file)) == 0
+    db.put(results[2])
+    assert len(SqliteDB(db_file)) == 3
+    db.put(results[3])
+    db.close()
+    assert list(SqliteDB(db_file).scan()) == results
+
+
+def test_sqlite_db_commit_at_exit(tmp_path, results):
+    # GIVEN
+    db_file = tmp_path / "db.sqlite"
+    db = SqliteDB(db_file, buffer_size=100)
+    db.put(results[0])
+    # WHEN
+    del db
+    # THEN
+    assert list(SqliteDB(db_file).scan()) == results[:1]
+
+
+@pytest.mark.parametrize(
+    "filename,expected",
+    [
+        ("db.sqlite", True),
+        ("db.sqlite3", True),
+        ("db.db", False),
+        ("db.jsonl", False),
+    ],
+)
+def test_get_database_sqlite(tmp_path, filename, expected):
+    # WHEN
+    db = get_database(str(tmp_path / filename))
+    # THEN
+    assert isinstance(db, SqliteDB) == expected
+
+
+def test_get_database_jsonl_db(tmp_path, results):
+    # GIVEN a JSONL database named *.db
+    db = CrappyDB(tmp_path / "db.db")
+    for r in results:
+        db.put(r)
+    db.close()
+    # WHEN
+    got = get_database(str(tmp_path / "db.db"))
+    # THEN
+    assert isinstance(got, CrappyDB)
+    assert list(got.scan()) == results
+
+
+def test_sqlite_db_hashstr_prefix(tmp_path, results):
+    # GIVEN
+    db = SqliteDB(tmp_path / "db.sqlite")
+    for r in results:
+        db.put(r)
+    # WHEN / THEN
+    assert db.get_by_hashstr_prefix("2cf24dba") == results[1]
+    assert db.get_by_hashstr_prefix("ab") == results[0]
+    assert db.get_by_hashstr_prefix("") == results[0]
+    assert not db.get_by_hashstr_prefix("2cf24dbb")